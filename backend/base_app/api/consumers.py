@@ -1,12 +1,41 @@
 """Chat WebSocket Consumers"""
 
+import io
+import json
 import asyncio
+import inspect
+import logging
 from functools import wraps
 from typing import Iterable
+from urllib.parse import parse_qs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.functional import cached_property
+
+from rest_framework import exceptions as EX
 
 from channels.generic import websocket as WS
 from channels.db import database_sync_to_async as DSA
 
+from ..presence import presence
+from ..replay import replay
+from ..cache import group_members
+from ..models import User, PMessage, GroupMessage
+from .outbound import OutboundQueue
+from .receipts import receipts
+from .counters import online_counters
+from .serializers import MessageSerializer, GMessageSerializer
+
+
+logger = logging.getLogger(__name__)
+
 
 class MyLogger:
     HEADER = "\033[95m"
@@ -24,6 +53,13 @@ class MyLogger:
         print(f"{cls.FAIL}{prefix}: {msg}")
 
 
+def encode_frame(data: dict) -> str:
+    """Encodes event frame to JSON text"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data)
+
+
 def exclude_sender(method):
     """
     Decorator to exclude sender
@@ -38,6 +74,20 @@ def exclude_sender(method):
     return wrapper
 
 
+def skip_replayed(method):
+    """
+    Decorator to skip frames that were already replayed to the session
+    """
+
+    @wraps(method)
+    async def wrapper(self, event: dict):
+        seq = event.get("seq")
+        if seq is None or seq > self.replayed.get(event["stream"], 0):
+            return await method(self, event)
+
+    return wrapper
+
+
 class GroupConsumerMixin:
     """Mixin to handle group related WS events"""
 
@@ -47,8 +97,8 @@ class GroupConsumerMixin:
     group_event_p = "grp_%s_evt"
 
     def __init__(self, *args, **kwargs) -> None:
-        # dict to cache connected groups
-        self.conn_groups = {}
+        # set of connected group ids
+        self.conn_groups = set()
         super().__init__(*args, **kwargs)
 
     async def group_handler(self, event: str, **kwargs):
@@ -84,6 +134,7 @@ class GroupConsumerMixin:
             people (list[id]): list of people to notify
         """
 
+        await self.invalidate_members(group_id)
         await self.notify_users(people, "remove_chat", self.group_data(group_id))
 
     async def grp_connect_evt(self, group_id, **kwargs):
@@ -94,14 +145,16 @@ class GroupConsumerMixin:
             group_id: connecting group
         """
 
+        if self.subscribed_all and group_id in self.conn_groups:
+            return
         assert group_id not in self.conn_groups, (
             "You are already connected to group: %s" % group_id
         )
 
-        group = await self.get_group(group_id)
+        await self.get_group(group_id)
         await self.join_layer(self.group_layer_p % group_id)
-        self.conn_groups[group_id] = group
-        print("%s connected to group: %s" % (self.user, group_id))
+        self.conn_groups.add(group_id)
+        print("%s connected to group: %s" % (self.user.username, group_id))
 
     async def grp_disconnect_evt(self, group_id, **kwargs):
         """'Disconnect' event handler, called when channel wants to
@@ -111,9 +164,9 @@ class GroupConsumerMixin:
             group_id: disconnecting group
         """
 
-        del self.conn_groups[group_id]
+        self.conn_groups.remove(group_id)
         await self.leave_layer(self.group_layer_p % group_id)
-        print("%s disconnected from group: %s" % (self.user, group_id))
+        print("%s disconnected from group: %s" % (self.user.username, group_id))
 
     def group_data(self, group_id, data=None):
         """Generates group data for user events"""
@@ -127,6 +180,7 @@ class GroupConsumerMixin:
             members (list): list of invited members
         """
 
+        await self.invalidate_members(group_id)
         cor1 = self.notify_users(
             map(lambda m: m["user"]["id"], members),
             "new_chat",
@@ -136,6 +190,9 @@ class GroupConsumerMixin:
         await asyncio.gather(cor1, cor2)
 
     async def grp_join_evt(self, group_id, member, **kwargs):
+        """'Join' event handler, called when user joins a group"""
+
+        await self.invalidate_members(group_id)
         cor1 = self.notify_user(
             member["user"]["id"], "new_chat", self.group_data(group_id)
         )
@@ -161,11 +218,13 @@ class GroupConsumerMixin:
             user_id: leaving user id
         """
 
+        await self.invalidate_members(group_id)
         await asyncio.gather(*self.group_leave_tasks(group_id, user_id))
 
     async def grp_ban_evt(self, group_id, ban, **kwargs):
         """'Ban' event handler, called when user is banned from a group"""
 
+        await self.invalidate_members(group_id)
         tasks = self.group_leave_tasks(group_id, ban["user"]["id"])
         tasks.append(self.send_group_event(group_id, "ban", ban, exclude=False))
         await asyncio.gather(*tasks)
@@ -173,9 +232,9 @@ class GroupConsumerMixin:
     async def grp_unban_evt(self, group_id, user_id, **kwargs):
         """'Unban' event handler, called when user is unbanned"""
 
-        group = self.conn_groups[group_id]
+        await self.invalidate_members(group_id)
         tasks = []
-        if await DSA(group.has_member)(user_id):
+        if user_id in await DSA(group_members.member_ids)(group_id):
             tasks.append(
                 self.notify_user(user_id, "new_chat", self.group_data(group_id))
             )
@@ -217,10 +276,8 @@ class GroupConsumerMixin:
         """'Send Message' event handler, called when group message is sent"""
 
         # send new message to group listeners
-        cor1 = self.send_group_event(group_id, "new_msg", data.copy())
-        cor2 = self.notify_members(
-            group_id, "new_msg", self.group_data(group_id, data.copy())
-        )
+        cor1 = self.send_group_event(group_id, "new_msg", data)
+        cor2 = self.notify_members(group_id, "new_msg", self.group_data(group_id, data))
         await asyncio.gather(cor1, cor2)
 
     async def grp_edit_msg_evt(self, group_id, msg_id, data, **kwargs):
@@ -233,12 +290,79 @@ class GroupConsumerMixin:
     async def grp_del_msg_evt(self, group_id, msg_id, **kwargs):
         await self.send_group_event(group_id, "del_msg", {"msg_id": msg_id})
 
+    async def grp_send_msg_evt(self, group_id, data: dict, ref=None, **kwargs):
+        """'Send Message' event handler, called when session sends
+        group message over WS instead of REST API
+
+        Args:
+            group_id: Group id
+            data (dict): Message data
+            ref (optional): Client reference of acknowledgement. Defaults to None.
+        """
+        await self.acknowledge("group", ref, self.save_group_msg, group_id, data)
+
+    async def grp_update_msg_evt(
+        self, group_id, msg_id, data: dict, ref=None, **kwargs
+    ):
+        """'Update Message' event handler, called when session edits
+        its group message over WS instead of REST API
+
+        Args:
+            group_id: Group id
+            msg_id (int): Editing message id
+            data (dict): Changes data
+            ref (optional): Client reference of acknowledgement. Defaults to None.
+        """
+        await self.acknowledge(
+            "group", ref, self.save_group_msg, group_id, data, msg_id
+        )
+
+    async def grp_seen_evt(self, group_id, msg_id, **kwargs):
+        """
+        'Seen' event handler, called when session reads group messages
+        up to the message. Receipts are coalesced before writing
+
+        Args:
+            group_id: Group id
+            msg_id (int): Latest read message id
+        """
+        await DSA(self.add_group_receipt)(group_id, msg_id)
+
+    async def grp_read_evt(self, group_id, user_id, msg_id, created, **kwargs):
+        """'Read' event handler, called when member read receipt is written"""
+
+        await self.send_group_event(
+            group_id,
+            "read",
+            {"user_id": user_id, "msg_id": msg_id, "created": created},
+            exclude=False,
+        )
+
     # Group utility methods
     @DSA
     def get_group(self, group_id):
         """Retrieves group from DB based on group id"""
         return self.user.allowed_groups.get(pk=group_id)
 
+    def save_group_msg(self, group_id, data: dict, msg_id=None) -> dict:
+        """
+        Creates or updates group message of current user.
+        Sending permission is checked by 'GroupMessage.clean'
+        """
+        group = self.user.allowed_groups.get(pk=group_id)
+        if msg_id is None:
+            return self.save_serializer(
+                GMessageSerializer, data=data, owner=self.user, group=group
+            )
+        msg = group.messages.common_fetch().get(pk=msg_id, owner=self.user)
+        return self.save_serializer(GMessageSerializer, msg, data)
+
+    def add_group_receipt(self, group_id, msg_id):
+        """Adds read receipt of current user in an allowed group"""
+        groups = self.user.allowed_groups.values("pk")
+        msg = GroupMessage.objects.filter(group__in=groups, group_id=group_id)
+        receipts.add(self.user, msg.only("group", "created").get(pk=msg_id))
+
     async def notify_members(
         self, group_id, event: str, data=None, exclude: Iterable = None
     ):
@@ -250,13 +374,18 @@ class GroupConsumerMixin:
             data (Any): Data to send with event. Defaults to None.
             exclude (Iterable, optional): Users to exclude. Defaults to None.
         """
-        group = self.conn_groups[group_id]
-        qs = group.online_ids
+        assert group_id in self.conn_groups
+        members = await DSA(group_members.online_ids)(group_id)
         if exclude:
-            qs = qs.exclude(pk__in=exclude)
-        members = await DSA(list)(qs)
-        await self.notify_users(members, event, data)
-        print(f"Notified members:\n{members}")
+            members = members.difference(exclude)
+        # buffered once in group stream replayed to all members
+        streams = [self.group_layer_p % group_id]
+        await self.notify_users(members, event, data, streams=streams)
+        logger.debug("Notified members of group %s: %s", group_id, members)
+
+    async def invalidate_members(self, group_id):
+        """Invalidates cached members of a group"""
+        await DSA(group_members.invalidate)(group_id)
 
     def get_group_layer(self, group_id):
         layer = self.group_layer_p % group_id
@@ -292,7 +421,9 @@ class GroupConsumerMixin:
         data = {"group_id": group_id, "data": data}
         if extra_data:
             data.update(extra_data)
-        await self.send_event(layer, "group", event, data, exclude=exclude, **kwargs)
+        await self.send_event(
+            layer, "group", event, data, exclude=exclude, streams=[layer], **kwargs
+        )
 
 
 class ChatConsumerMixin:
@@ -306,7 +437,7 @@ class ChatConsumerMixin:
     chat_event_p = "chat_%s_event"
 
     def __init__(self, *args, **kwargs) -> None:
-        # dict to cache connected chats
+        # connected chat ids mapped to their members ids
         self.conn_chats = {}
         super().__init__(*args, **kwargs)
 
@@ -325,14 +456,16 @@ class ChatConsumerMixin:
         Args:
             chat_id: connecting chat id
         """
+        if self.subscribed_all and chat_id in self.conn_chats:
+            return
         assert chat_id not in self.conn_chats, (
             "You are already connected to chat: %s" % chat_id
         )
 
         chat = await self.get_chat(chat_id)
         await self.join_layer(self.chat_layer_p % chat_id)
-        self.conn_chats[chat_id] = chat
-        print("%s connected to chat: %s" % (self.user, chat_id))
+        self.conn_chats[chat_id] = chat.get_members_id()
+        print("%s connected to chat: %s" % (self.user.username, chat_id))
 
     async def chat_disconnect_event(self, chat_id, **kwargs):
         """
@@ -345,7 +478,7 @@ class ChatConsumerMixin:
 
         del self.conn_chats[chat_id]
         await self.leave_layer(self.chat_layer_p % chat_id)
-        print("%s disconnected from chat: %s" % (self.user, chat_id))
+        print("%s disconnected from chat: %s" % (self.user.username, chat_id))
 
     async def chat_send_event(self, chat_id, data: dict, **kwargs):
         """
@@ -356,13 +489,13 @@ class ChatConsumerMixin:
             data (dict): Message data
         """
         # send data to all sessions that are connected to the chat
-        cor1 = self.send_chat_event(chat_id, "%s:new" % chat_id, data.copy())
+        cor1 = self.send_chat_event(chat_id, "%s:new" % chat_id, data)
 
         # notify companion incase they haven't joint the chat yet
         cor2 = self.notify_companion(
             chat_id,
             "new_msg",
-            {"type": "chat", "chat_id": chat_id, "data": data.copy()},
+            {"type": "chat", "chat_id": chat_id, "data": data},
         )
         await asyncio.gather(cor1, cor2)
 
@@ -403,12 +536,85 @@ class ChatConsumerMixin:
 
         await self.send_chat_event(chat_id, "%s:delete" % chat_id, {"msg_id": msg_id})
 
+    async def chat_send_msg_event(self, chat_id, data: dict, ref=None, **kwargs):
+        """
+        'Send Message' event handler, called when session sends
+        chat message over WS instead of REST API
+
+        Args:
+            chat_id: Chat id
+            data (dict): Message data
+            ref (optional): Client reference of acknowledgement. Defaults to None.
+        """
+        await self.acknowledge("chat", ref, self.save_chat_msg, chat_id, data)
+
+    async def chat_update_msg_event(
+        self, chat_id, msg_id, data: dict, ref=None, **kwargs
+    ):
+        """
+        'Update Message' event handler, called when session edits
+        its chat message over WS instead of REST API
+
+        Args:
+            chat_id: Chat id
+            msg_id (int): Editing message id
+            data (dict): Changes data
+            ref (optional): Client reference of acknowledgement. Defaults to None.
+        """
+        await self.acknowledge("chat", ref, self.save_chat_msg, chat_id, data, msg_id)
+
+    async def chat_seen_event(self, chat_id, msg_id, **kwargs):
+        """
+        'Seen' event handler, called when session reads chat messages
+        up to the message. Receipts are coalesced before writing
+
+        Args:
+            chat_id: Chat id
+            msg_id (int): Latest read message id
+        """
+        await DSA(self.add_chat_receipt)(chat_id, msg_id)
+
+    async def chat_read_event(self, chat_id, user_id, msg_id, created, **kwargs):
+        """
+        'Read' event handler, called when read receipt of a chat member
+        is written
+
+        Args:
+            chat_id: Chat id
+            user_id: Reader id
+            msg_id (int): Latest read message id
+            created (str): Latest read message creation date
+        """
+
+        await self.send_chat_event(
+            chat_id,
+            "%s:read" % chat_id,
+            {"user_id": user_id, "msg_id": msg_id, "created": created},
+            exclude=False,
+        )
+
     # chat utility methods
     @DSA
     def get_chat(self, chat_id):
         """Retrieves chat from DB based on chat id"""
         return self.user.get_chats().get(pk=chat_id)
 
+    def save_chat_msg(self, chat_id, data: dict, msg_id=None) -> dict:
+        """Creates or updates chat message of current user"""
+        chat = self.user.get_chats().get(pk=chat_id)
+        if msg_id is None:
+            return self.save_serializer(
+                MessageSerializer, data=data, owner=self.user, chat=chat
+            )
+        msg = chat.messages.common_fetch().get(pk=msg_id, owner=self.user)
+        return self.save_serializer(MessageSerializer, msg, data)
+
+    def add_chat_receipt(self, chat_id, msg_id):
+        """Adds read receipt of current user in a chat"""
+        chats = self.user.get_chats().values("pk")
+        msg = PMessage.objects.filter(chat__in=chats, chat_id=chat_id)
+        receipts.add(self.user, msg.only("chat", "created").get(pk=msg_id))
+
     def get_chat_layer(self, chat_id):
         """Get chat channel layer based on chat id"""
 
@@ -421,10 +627,10 @@ class ChatConsumerMixin:
         """
         Notifies companion based on chat id
         """
-        chat = self.conn_chats.get(chat_id)
-        if not chat:
-            chat = await self.get_chat(chat_id)
-        await self.notify_users(chat.get_members_id(), event, data)
+        members = self.conn_chats.get(chat_id)
+        if not members:
+            members = (await self.get_chat(chat_id)).get_members_id()
+        await self.notify_users(members, event, data)
 
     async def send_chat_event(
         self, chat_id, event: str, data=None, exclude=True, **kwargs
@@ -438,7 +644,9 @@ class ChatConsumerMixin:
             exclude (bool, optional): Exclude sender?. Defaults to True.
         """
         group = self.get_chat_layer(chat_id)
-        await self.send_event(group, "chat", event, data, exclude=exclude, **kwargs)
+        await self.send_event(
+            group, "chat", event, data, exclude=exclude, streams=[group], **kwargs
+        )
 
 
 class UserConsumerMixin:
@@ -455,6 +663,9 @@ class UserConsumerMixin:
     # user related events pattern
     user_event_p = "user_%s_event"
 
+    # current node heartbeat task shared by all sessions
+    node_heartbeat: asyncio.Task = None
+
     async def user_handler(self, event: str, **kwargs):
         """Base user related event handler"""
         await getattr(self, self.user_event_p % event)(**kwargs)
@@ -471,6 +682,14 @@ class UserConsumerMixin:
         """
         await self.leave_layer(self.watch_layer_p % user_id)
 
+    async def user_ack_event(self, stream: str, seq: int, **kwargs):
+        """
+        Called when client acknowledges frames it received
+        """
+        if not isinstance(stream, str) or type(seq) is not int:
+            raise EX.ValidationError({"detail": "Invalid acknowledgement."})
+        self.outbound.ack((stream, seq))
+
     async def user_edit_event(self, data: dict, **kwargs):
         """
         Called when user profile is updated
@@ -486,27 +705,87 @@ class UserConsumerMixin:
             data (_type_, optional): Notification data. Defaults to None.
         """
         group = self.user_layer_p % user_id
-        await self.send_event(group, "user", event, data, exclude=True)
+        await self.send_event(group, "user", event, data, exclude=True, streams=[group])
 
     async def send_session_event(self, event: str, data=None):
         """Base method to send session related events"""
-        await self.send_event(self.user_g, "user", event, data, exclude=True)
+        await self.send_event(
+            self.user_g, "user", event, data, exclude=True, streams=[self.user_g]
+        )
 
-    async def notify_users(self, users, event, data=None):
-        """Method to notify list of users[id] with given event and data"""
+    async def notify_users(self, users, event, data=None, streams=None):
+        """
+        Method to notify list of users[id] with given event and data.
+        Event is buffered in user streams unless other streams are given
+        """
 
-        await asyncio.gather(
-            *(self.notify_user(user_id, event, data) for user_id in users)
+        groups = [self.user_layer_p % user_id for user_id in users]
+        await self.send_event_many(
+            groups, "user", event, data, exclude=True, streams=streams or groups
         )
 
     @DSA
-    def get_sessions_count(self):
+    def presence_connect(self):
+        """
+        Registers current session in presence backend and counts user
+        online in their groups if user came online.
+        Returns True if user came online
+        """
+        came_online = presence.connect(self.user.pk, self.channel_name)
+        if came_online:
+            online_counters.add([self.user.pk], 1)
+        return came_online
+
+    @DSA
+    def presence_disconnect(self):
         """
-        Gets the number of online sessions.
-        Currently works only with 'InMemoryStorage' class
+        Removes current session from presence backend, persists last seen
+        time and uncounts user online in their groups if user went offline
         """
-        self.user.refresh_from_db(fields=["status"])
-        return self.user.status
+        went_offline = presence.disconnect(self.user.pk, self.channel_name)
+        if went_offline:
+            self.user.update_last_seen()
+            online_counters.add([self.user.pk], -1)
+        return went_offline
+
+    @classmethod
+    def start_node_heartbeat(cls, channel_layer):
+        """Starts current node heartbeat task if it is not running"""
+        task = cls.node_heartbeat
+        if task is None or task.done():
+            cls.node_heartbeat = asyncio.create_task(cls.beat_node(channel_layer))
+
+    @classmethod
+    async def beat_node(cls, channel_layer):
+        """
+        Keeps current node sessions alive and reaps sessions of dead nodes.
+        Users that went offline after reaping are notified to their watchers
+        """
+        while True:
+            try:
+                await DSA(presence.beat)()
+                offline = await DSA(presence.reap)()
+                if offline:
+                    await DSA(User.objects.filter(pk__in=offline).update_last_seen)()
+                    await DSA(online_counters.add)(offline, -1)
+                    await asyncio.gather(
+                        *(
+                            channel_layer.group_send(
+                                cls.watch_layer_p % user_id,
+                                cls.frame_message(
+                                    {
+                                        "event_type": "user",
+                                        "event": "left",
+                                        "data": {"user_id": user_id, "data": None},
+                                    }
+                                ),
+                            )
+                            for user_id in offline
+                        )
+                    )
+            except Exception as e:
+                MyLogger.error(e, prefix="Presence Error")
+            await asyncio.sleep(presence.heartbeat)
 
     async def send_watch_event(self, event: str, data=None):
         """Base method to send watch events"""
@@ -539,43 +818,157 @@ class SessionConsumer(
     __connected = 0
     # Base event handler pattern
     handler_p = "%s_handler"
+    # Droppable events mapped to their kinds.
+    # Queued frames of the same kind and user are coalesced
+    droppable_events = {
+        ("user", "joint"): "presence",
+        ("user", "left"): "presence",
+        ("user", "profile_edited"): "profile",
+    }
+    # WebSocket close code of overflowed sessions
+    overflow_code = 4008
+    # Errors of malformed events, answered with 'error' event
+    client_errors = (EX.APIException, ObjectDoesNotExist, AssertionError)
+    # Whether session is connected to all user chats and groups
+    subscribed_all = False
 
     async def websocket_connect(self, message):
         """
         Stores user and sets up user channel layer groups
         """
         self.user = self.scope.get("user")
+        # stream -> last sequence number replayed to the session
+        self.replayed = {}
         self.set_user_groups()
         return await super().websocket_connect(message)
 
     async def connect(self):
         """
-        Accepts connection and updates user status
+        Accepts connection and registers session in presence backend
         """
         await self.accept()
+        self.outbound = OutboundQueue(
+            self.send_text_data, **getattr(settings, "WS_OUTBOUND", {})
+        )
         type(self).__connected += 1
         print(
             "Session %r is connected" % self.channel_name,
             "All connections: %d" % self.__connected,
             sep="\n",
         )
-        status = await self.get_sessions_count()
-        if not status:
+        self.start_node_heartbeat(self.channel_layer)
+        if await self.presence_connect():
             await self.send_watch_event("joint")
-        await DSA(self.user.update_status)(1)
-        print("Connected to %s" % self.user)
+        if self.params.get("subscribe") == ["all"]:
+            await self.subscribe_all()
+        await self.resume_session()
+        self.outbound.start()
+        print("Connected to %s" % self.user.username)
+
+    @cached_property
+    def params(self) -> dict:
+        """Query string parameters of the session"""
+        return parse_qs(self.scope["query_string"].decode())
+
+    @DSA
+    def get_chat_members(self) -> list:
+        """Retrieves all user chats and groups from DB in one query"""
+        return list(self.user.get_chat_members())
+
+    async def subscribe_all(self):
+        """
+        Connects session to all user chats and groups at once.
+        Sessions opt in with 'subscribe=all' in the query string
+        """
+        layers = []
+        for chat_type, pk, *members in await self.get_chat_members():
+            if chat_type == "chat":
+                self.conn_chats[pk] = tuple(members)
+                layers.append(self.chat_layer_p % pk)
+            else:
+                self.conn_groups.add(pk)
+                layers.append(self.group_layer_p % pk)
+        await self.join_layers(layers)
+        self.subscribed_all = True
+
+    async def resume_session(self):
+        """
+        Sends session info and replays frames missed by previous session
+        given as 'session' in the query string. Position of previous session
+        is advanced by stream sequence numbers the client received, given
+        as JSON object in 'resume_from'. Sends 'resync' event if previous
+        session expired or some of the missed frames were already dropped
+        from replay buffers. Frames sent by previous session are not replayed.
+        """
+        streams = await self.replay_streams()
+        session = self.params.get("session", [None])[0]
+        frames = None
+        if session is not None:
+            position = await DSA(replay.get_position)(session)
+            if position is not None:
+                position = self.merge_position(position, streams)
+                frames = await DSA(replay.since)(position, session)
+        if frames is None:
+            position = await DSA(replay.last_seqs)(streams)
+        else:
+            for stream, seq, _ in frames:
+                position[stream] = seq
+        await DSA(replay.save_position)(self.channel_name, position)
+        await self.send_frame("user", "session", {"session": self.channel_name})
+        if session is not None and frames is None:
+            await self.send_frame("user", "resync")
+            return
+        for stream, seq, frame in frames or ():
+            await self.send(text_data=frame)
+            self.replayed[stream] = seq
+
+    def merge_position(self, position: dict, streams) -> dict:
+        """
+        Returns position of session streams advanced by sequence numbers
+        given in 'resume_from'. Streams without position start from zero
+        """
+        try:
+            received = json.loads(self.params["resume_from"][0])
+        except (KeyError, ValueError):
+            received = {}
+        if not isinstance(received, dict):
+            received = {}
+        merged = {}
+        for stream in streams:
+            seq = received.get(stream)
+            seq = seq if isinstance(seq, int) else 0
+            merged[stream] = max(position.get(stream, 0), seq)
+        return merged
+
+    async def replay_streams(self) -> list:
+        """
+        Returns replay streams of the session: user stream and streams
+        of all user chats and groups
+        """
+        if self.subscribed_all:
+            chats, groups = self.conn_chats, self.conn_groups
+        else:
+            rows = await self.get_chat_members()
+            chats = [pk for chat_type, pk, *_ in rows if chat_type == "chat"]
+            groups = [pk for chat_type, pk, *_ in rows if chat_type == "group"]
+        return [
+            self.user_g,
+            *(self.chat_layer_p % pk for pk in chats),
+            *(self.group_layer_p % pk for pk in groups),
+        ]
 
     async def disconnect(self, code):
         """
-        Updates user status and notifies user watchers before disconnect
+        Removes session from presence backend, writes pending read receipts
+        of the user and notifies user watchers if user went offline
         """
-        status = await self.get_sessions_count()
-        if status <= 1:
+        self.outbound.stop()
+        await DSA(receipts.flush_user)(self.user.pk)
+        if await self.presence_disconnect():
             await self.send_watch_event("left")
-        await DSA(self.user.update_status)(-1)
         type(self).__connected -= 1
         print(
-            "Disconnected from %s" % self.user,
+            "Disconnected from %s" % self.user.username,
             "All connections: %d" % self.__connected,
             sep="\n",
         )
@@ -583,13 +976,118 @@ class SessionConsumer(
     async def receive_json(self, content: dict, **kwargs):
         """
         Base json message event handler.
-        Calls base event handler of received event if it exists
+        Calls base event handler of received event. Malformed events and
+        events the session isn't allowed to send are answered with 'error'
+        event, other errors are raised
         """
+        e_type = content.get("event_type")
         try:
-            e_type = content.pop("event_type")
+            self.check_event(content)
+            content.pop("event_type")
             await getattr(self, self.handler_p % e_type)(**content, **kwargs)
-        except Exception as e:
-            MyLogger.error(e, prefix="WS Error")
+        except self.client_errors as e:
+            if isinstance(e, EX.APIException):
+                errors = e.detail
+            elif isinstance(e, ObjectDoesNotExist):
+                errors = {"detail": "Not found."}
+            else:
+                errors = {"detail": str(e)}
+            MyLogger.warning("%r event %r: %s" % (e_type, content.get("event"), errors))
+            if e_type not in ("user", "chat", "group"):
+                e_type = "user"
+            await self.send_frame(
+                e_type, "error", {"ref": content.get("ref"), "errors": errors}
+            )
+
+    def check_event(self, content: dict):
+        """
+        Raises ValidationError if received event doesn't have a handler
+        or its arguments don't match the handler
+        """
+        e_type, event = content.get("event_type"), content.get("event")
+        pattern = getattr(self, "%s_event_p" % e_type, None)
+        if not isinstance(e_type, str) or not isinstance(event, str) or not pattern:
+            raise EX.ValidationError({"detail": "Unknown event."})
+        handler = getattr(self, pattern % event, None)
+        if handler is None:
+            raise EX.ValidationError({"detail": "Unknown event."})
+        args = {k: v for k, v in content.items() if k not in ("event_type", "event")}
+        try:
+            inspect.signature(handler).bind(**args)
+        except TypeError as e:
+            raise EX.ValidationError({"detail": str(e)})
+
+    async def send_frame(self, event_type: str, event: str, data=None):
+        """Sends event frame to current session only"""
+        frame = {"event_type": event_type, "event": event, "data": data}
+        await self.send(text_data=encode_frame(frame))
+
+    @cached_property
+    def request(self) -> ASGIRequest:
+        """
+        HTTP request built from the session handshake to serialize data
+        with absolute urls. Changes made in this request are published
+        excluding current session
+        """
+        scheme = {"ws": "http", "wss": "https"}.get(self.scope.get("scheme"), "http")
+        headers = [
+            *self.scope.get("headers", ()),
+            (b"x-ws-session", self.channel_name.encode()),
+        ]
+        scope = {
+            **self.scope,
+            "type": "http",
+            "method": "POST",
+            "scheme": scheme,
+            "headers": headers,
+        }
+        request = ASGIRequest(scope, io.BytesIO())
+        request.user = self.user
+        return request
+
+    def save_serializer(self, ser_class, instance=None, data=None, **kwargs) -> dict:
+        """
+        Validates and saves data using given serializer in current session request.
+        Returns serialized instance
+        """
+        from .outbox import current_request
+
+        token = current_request.set(self.request)
+        try:
+            serializer = ser_class(
+                instance,
+                data=data,
+                partial=instance is not None,
+                context={"request": self.request},
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save(**kwargs)
+            return serializer.data
+        finally:
+            current_request.reset(token)
+
+    async def acknowledge(self, event_type: str, ref, save, *args):
+        """
+        Runs session write in DB thread and acknowledges the session with
+        saved data or errors. Saved changes are published by outbox after
+        commit.
+
+        Args:
+            event_type (str): Acknowledgement event type
+            ref (Any): Client reference of acknowledgement
+            save (Callable): DB write that returns saved data
+            args: DB write arguments
+        """
+        try:
+            data = await DSA(save)(*args)
+        except EX.ValidationError as e:
+            await self.send_frame(event_type, "error", {"ref": ref, "errors": e.detail})
+        except ObjectDoesNotExist:
+            errors = {"detail": "Not found."}
+            await self.send_frame(event_type, "error", {"ref": ref, "errors": errors})
+        else:
+            ack = {"ref": ref, "id": data["id"], "data": data}
+            await self.send_frame(event_type, "ack", ack)
 
     async def send_event(
         self, group: str, event_type: str, event: str, data=None, **kwargs
@@ -601,10 +1099,28 @@ class SessionConsumer(
             event_type (str): Base event type (user, chat, etc.)
             event (str): event name
             data (dict, optional): Sending data. Defaults to None.
+            streams (Iterable, optional): replay streams to buffer event in.
+            Defaults to None.
         """
         data = {"event_type": event_type, "event": event, "data": data}
         await self.send_all(group, data, **kwargs)
 
+    async def send_event_many(
+        self, groups, event_type: str, event: str, data=None, **kwargs
+    ):
+        """
+        Base event-send method for many channel layers
+        Args:
+            groups (list[str]): group channel layers to send event
+            event_type (str): Base event type (user, chat, etc.)
+            event (str): event name
+            data (dict, optional): Sending data. Defaults to None.
+            streams (Iterable, optional): replay streams to buffer event in.
+            Defaults to None.
+        """
+        data = {"event_type": event_type, "event": event, "data": data}
+        await self.send_many(groups, data, **kwargs)
+
     async def join_layer(self, group: str):
         """
         Base method to join channel layer
@@ -612,6 +1128,23 @@ class SessionConsumer(
         self.groups.add(group)
         await self.channel_layer.group_add(group, self.channel_name)
 
+    async def join_layers(self, groups: list):
+        """
+        Base method to join many channel layers. Joins all channel layers
+        at once if channel layer supports it
+        """
+        self.groups.update(groups)
+        add_many = getattr(self.channel_layer, "group_add_many", None)
+        if add_many is not None:
+            await add_many(groups, self.channel_name)
+        else:
+            await asyncio.gather(
+                *(
+                    self.channel_layer.group_add(group, self.channel_name)
+                    for group in groups
+                )
+            )
+
     async def leave_layer(self, group):
         """
         Base method to leave channel layer
@@ -619,14 +1152,50 @@ class SessionConsumer(
         self.groups.remove(group)
         await self.channel_layer.group_discard(group, self.channel_name)
 
+    @skip_replayed
+    async def send_text(self, message):
+        """
+        Base send method for pre-encoded event frames
+        """
+        await self.queue_frame(message)
+
     @exclude_sender
-    async def send_exclude(self, data):
+    @skip_replayed
+    async def send_text_exclude(self, message):
         """
-        Base send method that excludes a sender
+        Base send method for pre-encoded event frames that excludes a sender
         """
-        await self.send_json(data)
+        await self.queue_frame(message)
+
+    async def send_text_data(self, text: str):
+        """Writes encoded frame to the session"""
+        await self.send(text_data=text)
+
+    async def queue_frame(self, message: dict):
+        """
+        Queues channel layer message frame to outbound queue.
+        Closes session if it can't keep up with its frames
+        """
+        ref = None
+        if "seq" in message:
+            ref = (message["stream"], message["seq"])
+        queued = self.outbound.put(
+            message["text"], message.get("kind"), ref, message.get("coalesce")
+        )
+        if not queued:
+            await self.close_overflowed()
 
-    async def send_all(self, group: str, data: dict, *, exclude=False):
+    async def close_overflowed(self):
+        """
+        Closes overflowed session with a hint to resume it,
+        frames that were not written are replayed to the next session
+        """
+        MyLogger.warning("Session %r overflowed" % self.channel_name)
+        self.outbound.stop()
+        await self.send_frame("user", "overflow", {"session": self.channel_name})
+        await self.close(self.overflow_code)
+
+    async def send_all(self, group: str, data: dict, *, exclude=False, streams=None):
         """
         Base send-channel-layer method
         Args:
@@ -634,10 +1203,90 @@ class SessionConsumer(
             data (dict): data to send
             exclude (bool, optional): if true excludes sender.
             Defaults to False.
+            streams (Iterable, optional): replay streams to buffer event in.
+            Defaults to None.
+        """
+        message = await self.layer_message(data, exclude, streams)
+        await self.channel_layer.group_send(group, message)
+
+    async def send_many(self, groups, data: dict, *, exclude=False, streams=None):
+        """
+        Base send-many-channel-layers method. Publishes message to all
+        channel layers at once if channel layer supports it,
+        otherwise sends message to each channel layer separately.
+        Args:
+            groups (list[str]): channel layers to send event
+            data (dict): data to send
+            exclude (bool, optional): if true excludes sender.
+            Defaults to False.
+            streams (Iterable, optional): replay streams to buffer event in.
+            Defaults to None.
+        """
+        if not groups:
+            return
+        streams = list(streams) if streams is not None else None
+        if streams is not None and len(streams) > 1:
+            # every stream numbers its frames, so frames of user streams
+            # are sent to their channel layers separately
+            assert streams == list(groups), "Streams must match channel layers"
+            messages = await asyncio.gather(
+                *(self.layer_message(dict(data), exclude, [s]) for s in streams)
+            )
+            await asyncio.gather(
+                *(
+                    self.channel_layer.group_send(group, message)
+                    for group, message in zip(groups, messages)
+                )
+            )
+            return
+        data = await self.layer_message(data, exclude, streams)
+        send_many = getattr(self.channel_layer, "group_send_many", None)
+        if send_many is not None:
+            await send_many(groups, data)
+        else:
+            await asyncio.gather(
+                *(self.channel_layer.group_send(group, data) for group in groups)
+            )
+
+    async def layer_message(self, data: dict, exclude=False, streams=None) -> dict:
+        """
+        Encodes event frame once and wraps it into channel layer message.
+        Every receiving session sends the encoded frame as it is.
+        Frames with a stream are stamped with its sequence number and
+        buffered for replay.
         """
-        type_ = "send.json"
+        if not streams:
+            message = self.frame_message(data)
+        else:
+            (stream,) = streams
+            origin = self.channel_name if exclude else None
+            message = await DSA(self.buffer_frame)(data, stream, origin)
         if exclude:
-            type_ = "send.exclude"
-            data["channel_name"] = self.channel_name
-        data.setdefault("type", type_)
-        await self.channel_layer.group_send(group, data)
+            message["type"] = "send.text.exclude"
+            message["channel_name"] = self.channel_name
+        return message
+
+    @classmethod
+    def buffer_frame(cls, data: dict, stream: str, origin=None) -> dict:
+        """
+        Stamps event frame with sequence number of the stream, appends it
+        to replay buffer of the stream and wraps it into channel layer message
+        """
+        data["stream"] = stream
+        seq = data["seq"] = replay.next_seq(stream)
+        message = cls.frame_message(data)
+        replay.append(stream, seq, message["text"], origin)
+        return message
+
+    @classmethod
+    def frame_message(cls, data: dict) -> dict:
+        """Encodes event frame and wraps it into channel layer message"""
+        event = (data["event_type"], data["event"])
+        message = {"type": "send.text", "text": encode_frame(data), "kind": event[0]}
+        if "seq" in data:
+            message["stream"], message["seq"] = data["stream"], data["seq"]
+        kind = cls.droppable_events.get(event)
+        if kind is not None:
+            message["kind"] = kind
+            message["coalesce"] = "%s:%s" % (kind, data["data"]["user_id"])
+        return message
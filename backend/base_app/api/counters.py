@@ -0,0 +1,90 @@
+"""Online counters aggregator"""
+
+import asyncio
+import threading
+from contextvars import Context
+
+from django.conf import settings
+from django.db import transaction
+
+from channels.db import database_sync_to_async as DSA
+
+from ..models import Group
+
+
+class OnlineCounters:
+    """
+    Aggregates presence transitions of users to shift online counters of
+    their groups in batches. Transitions of a user within a window are
+    summed, so reconnecting users don't touch their groups at all, then
+    groups are updated once per delta instead of once per transition.
+    Windows are timed on the server event loop of the outbox dispatcher.
+    """
+
+    def __init__(self, window: float = 1):
+        """Initializes online counters aggregator
+
+        Args:
+            window (float, optional): seconds to batch transitions.
+            Defaults to 1.
+        """
+        self.window = window
+        # user id -> sum of online deltas
+        self.pending = {}
+        # running flush tasks
+        self.tasks = set()
+        self.lock = threading.Lock()
+
+    def add(self, user_ids, delta: int):
+        """
+        Adds transition of users that came online (delta=1)
+        or went offline (delta=-1)
+        """
+        with self.lock:
+            scheduled = bool(self.pending)
+            for user_id in user_ids:
+                self.pending[user_id] = self.pending.get(user_id, 0) + delta
+        if not scheduled:
+            self.schedule()
+
+    def schedule(self):
+        """
+        Schedules flush after the window on the server event loop.
+        Without server event loop transitions are written in place
+        """
+        from .outbox import dispatcher
+
+        loop = dispatcher.loop
+        if loop is None or loop.is_closed():
+            self.flush()
+            return
+        loop.call_soon_threadsafe(
+            loop.call_later, self.window, self.start_flush, context=Context()
+        )
+
+    def start_flush(self):
+        """Starts flush task on the event loop"""
+        task = asyncio.create_task(DSA(self.flush)())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def flush(self) -> int:
+        """
+        Shifts online counters by pending transitions.
+        Returns the number of updated group rows
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        users = {}
+        for user_id, delta in pending.items():
+            if delta:
+                users.setdefault(delta, []).append(user_id)
+        with transaction.atomic():
+            return sum(
+                Group.objects.shift_online(user_ids, delta)
+                for delta, user_ids in users.items()
+            )
+
+
+# Shared online counters aggregator of the process
+online_counters = OnlineCounters(**getattr(settings, "ONLINE_COUNTERS", {}))
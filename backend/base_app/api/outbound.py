@@ -0,0 +1,150 @@
+"""Outbound queues of WebSocket sessions"""
+
+import asyncio
+from collections import Counter, deque
+
+
+class OutboundStats:
+    """Dropped/coalesced frame counters per event kind"""
+
+    def __init__(self):
+        self.dropped = Counter()
+        self.coalesced = Counter()
+
+    def drop(self, kind):
+        self.dropped[kind] += 1
+
+    def coalesce(self, kind):
+        self.coalesced[kind] += 1
+
+    def as_dict(self) -> dict:
+        return {"dropped": dict(self.dropped), "coalesced": dict(self.coalesced)}
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames waiting to be written to a session.
+    Backlog of the queue is its queued frames plus written frames that
+    the client hasn't acknowledged yet. Writer pauses while unacknowledged
+    frames reach high-water mark, so queue grows when client can't keep up.
+    Droppable frames replace queued frames with the same coalescing key
+    and are dropped when backlog is above high-water mark.
+    Queue overflows when backlog reaches its limit.
+    Written frames are tracked only after the first acknowledgement,
+    so clients that don't acknowledge frames are bounded by queue size.
+    """
+
+    def __init__(self, send, high_water: int = 100, limit: int = 1000, stats=None):
+        """Initializes outbound queue
+
+        Args:
+            send (Callable): coroutine function that writes frame text
+            high_water (int, optional): backlog size to start dropping
+            droppable frames and max unacknowledged frames to write.
+            Defaults to 100.
+            limit (int, optional): max backlog size. Defaults to 1000.
+            stats (OutboundStats, optional): counters. Defaults to shared stats.
+        """
+        assert high_water <= limit, "High-water mark must not exceed the limit"
+        self.send = send
+        self.high_water = high_water
+        self.limit = limit
+        self.stats = stats or outbound_stats
+        # queued entries [text, ref, coalescing key]
+        self.entries = deque()
+        # coalescing key -> queued entry
+        self.coalescing = {}
+        # references of written frames not acknowledged by the client
+        self.unacked = deque()
+        # whether client acknowledges received frames
+        self.acking = False
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def backlog(self) -> int:
+        """Number of queued and unacknowledged frames"""
+        return len(self.entries) + len(self.unacked)
+
+    @property
+    def writable(self) -> bool:
+        """Whether client can receive more frames"""
+        return len(self.unacked) < self.high_water
+
+    def ack(self, ref):
+        """Acknowledges written frames up to the frame with given reference
+
+        Args:
+            ref: reference of the last frame received by the client
+        """
+        self.acking = True
+        if ref not in self.unacked:
+            return
+        while self.unacked.popleft() != ref:
+            pass
+        if self.entries:
+            self.ready.set()
+
+    def put(self, text: str, kind=None, ref=None, coalesce=None) -> bool:
+        """Queues frame. Returns False if queue overflowed
+
+        Args:
+            text (str): encoded frame
+            kind (str, optional): frame kind for counters. Defaults to None.
+            ref (optional): reference of frame the client acknowledges,
+            e.g. its stream and sequence number. Defaults to None.
+            coalesce (str, optional): coalescing key of droppable frame.
+            Defaults to None.
+        """
+        if coalesce is not None:
+            entry = self.coalescing.get(coalesce)
+            if entry is not None:
+                entry[0], entry[1] = text, ref
+                self.stats.coalesce(kind)
+                return True
+            if self.backlog >= self.high_water:
+                self.stats.drop(kind)
+                return True
+        if self.backlog >= self.limit:
+            self.stats.drop(kind)
+            return False
+        entry = [text, ref, coalesce]
+        self.entries.append(entry)
+        if coalesce is not None:
+            self.coalescing[coalesce] = entry
+        self.ready.set()
+        return True
+
+    async def run(self):
+        """Writes queued frames in order"""
+        while True:
+            await self.ready.wait()
+            while self.entries and self.writable:
+                entry = self.entries.popleft()
+                text, ref, coalesce = entry
+                if coalesce is not None and self.coalescing.get(coalesce) is entry:
+                    del self.coalescing[coalesce]
+                await self.send(text)
+                if ref is not None and self.acking:
+                    self.unacked.append(ref)
+            self.ready.clear()
+
+    def start(self):
+        """Starts writer task"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Stops writer task and clears queue"""
+        if self.task is not None:
+            self.task.cancel()
+        self.entries.clear()
+        self.coalescing.clear()
+        self.unacked.clear()
+
+
+# Shared counters of all outbound queues
+outbound_stats = OutboundStats()
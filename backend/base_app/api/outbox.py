@@ -0,0 +1,377 @@
+"""
+Transactional outbox of WebSocket events.
+Model writes record events that are published to channel layers
+after commit by a server side session that runs the same event handlers
+the client used to relay.
+"""
+
+import asyncio
+from collections import deque
+from contextvars import Context, ContextVar
+from urllib.parse import urlsplit
+
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.http import HttpRequest
+from django.core.exceptions import DisallowedHost
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.db import database_sync_to_async as DSA
+
+from ..models import (
+    OutboxEvent,
+    PChat,
+    PMessage,
+    GroupRole,
+    GroupMember,
+    GroupBan,
+    GroupMessage,
+)
+
+from .serializers import (
+    MessageSerializer,
+    GMessageSerializer,
+    MemberSerializer,
+    GroupBanSerializer,
+    RoleSerializer,
+)
+from .consumers import SessionConsumer, MyLogger
+
+
+# Request that is currently being processed
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+# Request header of the session that made the change
+ORIGIN_HEADER = "X-WS-Session"
+
+
+class OutboxMiddleware:
+    """
+    Middleware to keep current request for serializing events
+    and detecting their origin session
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+
+class OutboxRequest(HttpRequest):
+    """
+    Request of the base url an event was recorded in.
+    Used to serialize event data with absolute urls after the recording
+    request is gone
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        url = urlsplit(base_url)
+        self.base_scheme = url.scheme
+        self.META["HTTP_HOST"] = url.netloc
+        self.path = self.path_info = "/"
+
+    def _get_scheme(self) -> str:
+        return self.base_scheme
+
+
+def get_base_url(request) -> str:
+    """Returns base url of request to build absolute urls on publish"""
+    if request is None:
+        return ""
+    try:
+        return request.build_absolute_uri("/")
+    except DisallowedHost:
+        return ""
+
+
+def serialize(ser_class, instance, request=None, **kwargs):
+    """Serializes instance in given or current request context"""
+    context = {"request": request or current_request.get()}
+    return ser_class(instance, context=context, **kwargs).data
+
+
+def record_event(event_type: str, event: str, **kwargs) -> OutboxEvent:
+    """Records outbox event and publishes it after commit
+
+    Args:
+        event_type (str): event type (chat, group)
+        event (str): event name
+        kwargs: event handler arguments
+    """
+    request = current_request.get()
+    origin = request.headers.get(ORIGIN_HEADER, "") if request else ""
+    outbox_event = OutboxEvent.objects.create(
+        event_type=event_type,
+        event=event,
+        kwargs=kwargs,
+        origin=origin,
+        base_url=get_base_url(request),
+    )
+    transaction.on_commit(lambda: dispatcher.submit([outbox_event]))
+    return outbox_event
+
+
+class ServerSession(SessionConsumer):
+    """
+    Headless session that runs session event handlers on behalf of
+    the origin session. Frames excluding sender exclude the origin session.
+    """
+
+    # message models and serializers of events with new messages
+    messages = {
+        "chat": (PMessage, MessageSerializer),
+        "group": (GroupMessage, GMessageSerializer),
+    }
+
+    def __init__(self, origin: str = "", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channel_layer = get_channel_layer()
+        self.channel_name = origin
+        self.user = None
+        self.groups = set()
+
+    async def join_layer(self, group: str):
+        self.groups.add(group)
+
+    async def leave_layer(self, group: str):
+        self.groups.discard(group)
+
+    @DSA
+    def get_chat(self, chat_id):
+        return PChat.objects.get(pk=chat_id)
+
+    @classmethod
+    def hydrate(cls, event: OutboxEvent) -> dict:
+        """
+        Returns event handler arguments.
+        New messages are serialized on publish to include their files
+        """
+        kwargs = dict(event.kwargs)
+        if event.event == "send":
+            model, ser_class = cls.messages[event.event_type]
+            msg = model.objects.common_fetch().get(pk=kwargs.pop("msg_id"))
+            request = OutboxRequest(event.base_url) if event.base_url else None
+            kwargs["data"] = serialize(ser_class, msg, request=request)
+        return kwargs
+
+    async def publish(self, event_type: str, event: str, **kwargs):
+        """Connects to event chat or group and runs event handler"""
+        if event_type == "chat":
+            chat_id = kwargs["chat_id"]
+            chat = await self.get_chat(chat_id)
+            self.conn_chats[chat_id] = chat.get_members_id()
+            await self.join_layer(self.chat_layer_p % chat_id)
+        else:
+            group_id = kwargs["group_id"]
+            self.conn_groups.add(group_id)
+            await self.join_layer(self.group_layer_p % group_id)
+        await getattr(self, self.handler_p % event_type)(event, **kwargs)
+
+
+def claim_events(events) -> list:
+    """Claims given outbox events, returns the ones claimed in order"""
+    qs = OutboxEvent.objects.filter(pk__in=[event.pk for event in events])
+    claimed = {event.pk for event in qs.claim(OutboxEvent.CLAIM_LEASE)}
+    return [event for event in events if event.pk in claimed]
+
+
+async def publish_events(events) -> int:
+    """
+    Publishes outbox events in order and deletes published ones.
+    Events claimed by other publishers are skipped, events that failed
+    are published by the next publisher after their claim expires.
+    Returns the number of published events
+    """
+    published = []
+    for event in await DSA(claim_events)(events):
+        try:
+            kwargs = await DSA(ServerSession.hydrate)(event)
+            session = ServerSession(event.origin)
+            await session.publish(event.event_type, event.event, **kwargs)
+            published.append(event.pk)
+        except Exception as e:
+            MyLogger.error("%s %r" % (event, e), prefix="Outbox Error")
+    if published:
+        await DSA(OutboxEvent.objects.filter(pk__in=published).delete)()
+    return len(published)
+
+
+def dispatch_events(events) -> int:
+    """Publishes outbox events in place, returns the number of published ones"""
+    return async_to_sync(publish_events)(events)
+
+
+class OutboxDispatcher:
+    """
+    Publishes committed outbox events on the server event loop,
+    so requests don't wait for events fan-out. Events are published by
+    a single task in the order of commits. Without server event loop,
+    e.g. in management commands, events are published in place
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = None
+        # batches of events waiting to be published
+        self.pending: deque = deque()
+        self.task: asyncio.Task = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Binds dispatcher to the server event loop"""
+        if self.loop is not loop:
+            self.loop, self.task = loop, None
+            self.pending.clear()
+
+    def submit(self, events: list):
+        """Schedules publishing of committed events from any thread"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            dispatch_events(events)
+        else:
+            # publishing doesn't run in the context of the committing thread
+            loop.call_soon_threadsafe(self.schedule, events, context=Context())
+
+    def schedule(self, events: list):
+        """Queues events and starts publishing task if it is not running"""
+        self.pending.append(events)
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        """Publishes pending events until there are no ones left"""
+        while self.pending:
+            await publish_events(self.pending.popleft())
+
+
+# Dispatcher of the current server node
+dispatcher = OutboxDispatcher()
+
+
+class OutboxDispatcherMiddleware:
+    """ASGI middleware to bind outbox dispatcher to the server event loop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        dispatcher.bind(asyncio.get_running_loop())
+        return await self.app(scope, receive, send)
+
+
+def is_direct(instance, origin) -> bool:
+    """Indicates whether instance is deleted directly and not by cascade"""
+    return origin is instance
+
+
+@receiver(models.signals.post_save, sender=PMessage)
+def on_pmessage_save(sender, instance: PMessage, created, **kwargs):
+    if created:
+        record_event("chat", "send", chat_id=instance.chat_id, msg_id=instance.pk)
+        return
+    data = serialize(MessageSerializer, instance)
+    record_event(
+        "chat", "edit_msg", chat_id=instance.chat_id, msg_id=instance.pk, data=data
+    )
+
+
+@receiver(models.signals.post_delete, sender=PMessage)
+def on_pmessage_delete(sender, instance: PMessage, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        record_event("chat", "del_msg", chat_id=instance.chat_id, msg_id=instance.pk)
+
+
+@receiver(models.signals.post_save, sender=GroupMessage)
+def on_gmessage_save(sender, instance: GroupMessage, created, **kwargs):
+    if created:
+        record_event("group", "send", group_id=instance.group_id, msg_id=instance.pk)
+        return
+    data = serialize(GMessageSerializer, instance)
+    record_event(
+        "group", "edit_msg", group_id=instance.group_id, msg_id=instance.pk, data=data
+    )
+
+
+@receiver(models.signals.post_delete, sender=GroupMessage)
+def on_gmessage_delete(sender, instance: GroupMessage, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        record_event("group", "del_msg", group_id=instance.group_id, msg_id=instance.pk)
+
+
+@receiver(models.signals.post_save, sender=GroupMember)
+def on_member_save(sender, instance: GroupMember, created, **kwargs):
+    group_id = instance.group_id
+    if not created:
+        data = serialize(MemberSerializer, instance)["role"]
+        record_event(
+            "group",
+            "role_change",
+            group_id=group_id,
+            user_id=instance.user_id,
+            data=data,
+        )
+    elif GroupMember.role.is_cached(instance) and instance.role.is_owner:
+        # owner joins on group creation with its role instance,
+        # roles of other members are not loaded
+        return
+    elif instance.added_by_id:
+        members = [serialize(MemberSerializer, instance)]
+        record_event("group", "invite", group_id=group_id, members=members)
+    else:
+        member = serialize(MemberSerializer, instance)
+        record_event("group", "join", group_id=group_id, member=member)
+
+
+@receiver(models.signals.post_delete, sender=GroupMember)
+def on_member_delete(sender, instance: GroupMember, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        record_event(
+            "group", "leave", group_id=instance.group_id, user_id=instance.user_id
+        )
+
+
+@receiver(models.signals.post_save, sender=GroupBan)
+def on_ban_save(sender, instance: GroupBan, created, **kwargs):
+    if created:
+        ban = serialize(GroupBanSerializer, instance)
+        record_event("group", "ban", group_id=instance.group_id, ban=ban)
+
+
+@receiver(models.signals.post_delete, sender=GroupBan)
+def on_ban_delete(sender, instance: GroupBan, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        record_event(
+            "group", "unban", group_id=instance.group_id, user_id=instance.user_id
+        )
+
+
+@receiver(models.signals.post_save, sender=GroupRole)
+def on_role_save(sender, instance: GroupRole, created, **kwargs):
+    group_id = instance.group_id
+    if not created:
+        data = serialize(RoleSerializer, instance)
+        record_event(
+            "group", "role_update", group_id=group_id, role_id=instance.pk, data=data
+        )
+    elif not instance.is_special:
+        # special roles are created on group creation
+        role = serialize(RoleSerializer, instance)
+        record_event("group", "new_role", group_id=group_id, role=role)
+
+
+@receiver(models.signals.post_delete, sender=GroupRole)
+def on_role_delete(sender, instance: GroupRole, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        new_role = serialize(RoleSerializer, instance.group.default_role)
+        record_event(
+            "group",
+            "role_del",
+            group_id=instance.group_id,
+            role_id=instance.pk,
+            new_role=new_role,
+        )
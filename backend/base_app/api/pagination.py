@@ -1,18 +1,292 @@
 """API pagination classes"""
 
-from rest_framework.pagination import LimitOffsetPagination
-from rest_framework.utils.urls import replace_query_param
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 
+from django.db.models import Q, Subquery, Value
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    LimitOffsetPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class LimitPaginationMixin:
+    """Mixin to get page size limit from query params"""
 
-class ChatLimitPagination(LimitOffsetPagination):
     default_limit = 30
+    max_limit = 100
+    limit_query_param = "limit"
+
+    def get_limit(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.limit_query_param],
+                strict=True,
+                cutoff=self.max_limit,
+            )
+        except (KeyError, ValueError):
+            return self.default_limit
+
+
+class NoCountLimitPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that doesn't count the queryset.
+    Next page existence is checked by fetching one extra row,
+    so expensive querysets are evaluated only for the page
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.request = request
+        page = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[: self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        offset = self.offset + self.limit
+        return replace_query_param(url, self.offset_query_param, offset)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        del schema["properties"]["count"]
+        return schema
+
+
+class MessageCursorPagination(LimitPaginationMixin, BasePagination):
+    """
+    Keyset pagination of messages over (created, id), newest first.
+    Pages are taken relative to a message given by 'before', 'after' or
+    'around' (message with context) params, so deep pages cost the same as
+    the first one. 'offset' is supported only to start from the first page.
+    """
+
+    offset_query_param = "offset"
+    before_query_param = "before"
+    after_query_param = "after"
+    around_query_param = "around"
+    ordering = ("-created", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.next_id = self.previous_id = None
+        queryset = queryset.order_by(*self.ordering)
+        params = request.query_params
+        if self.around_query_param in params:
+            return self.around(queryset, self.get_cursor(self.around_query_param))
+        if self.before_query_param in params:
+            return self.before(queryset, self.get_cursor(self.before_query_param))
+        if self.after_query_param in params:
+            return self.after(queryset, self.get_cursor(self.after_query_param))
+        return self.first(queryset, self.get_offset(request))
+
+    def get_offset(self, request):
+        try:
+            return _positive_int(request.query_params[self.offset_query_param])
+        except (KeyError, ValueError):
+            return 0
+
+    def get_cursor(self, param: str) -> int:
+        try:
+            return _positive_int(self.request.query_params[param], strict=True)
+        except ValueError:
+            raise NotFound("Invalid cursor")
+
+    def anchor(self, queryset, msg_id) -> Subquery:
+        """Creation date of the cursor message if it is in the queryset"""
+        return Subquery(queryset.order_by().filter(pk=msg_id).values("created"))
+
+    def older(self, queryset, msg_id, inclusive=False):
+        """Messages before the cursor message, newest first"""
+        created = self.anchor(queryset, msg_id)
+        id_lookup = "pk__lte" if inclusive else "pk__lt"
+        # 'created <= anchor' bounds the index scan to the rows after the cursor
+        return queryset.filter(
+            Q(created__lt=created) | Q(**{id_lookup: msg_id}),
+            created__lte=created,
+        )
+
+    def newer(self, queryset, msg_id):
+        """Messages after the cursor message, oldest first"""
+        created = self.anchor(queryset, msg_id)
+        return queryset.filter(
+            Q(created__gt=created) | Q(pk__gt=msg_id),
+            created__gte=created,
+        ).order_by("created", "id")
+
+    def first(self, queryset, offset: int) -> list:
+        page = list(queryset[offset : offset + self.limit + 1])
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            self.next_id = page[-1].pk
+        if page and offset:
+            self.previous_id = page[0].pk
+        return page
+
+    def before(self, queryset, msg_id) -> list:
+        page = list(self.older(queryset, msg_id)[: self.limit + 1])
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            self.next_id = page[-1].pk
+        if page:
+            self.previous_id = page[0].pk
+        return page
+
+    def after(self, queryset, msg_id) -> list:
+        page = list(self.newer(queryset, msg_id)[: self.limit + 1])
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            self.previous_id = page[-1].pk
+        page.reverse()
+        if page:
+            self.next_id = page[-1].pk
+        return page
+
+    def around(self, queryset, msg_id) -> list:
+        newer_limit = self.limit // 2
+        older_limit = self.limit - newer_limit
+        newer = list(self.newer(queryset, msg_id)[: newer_limit + 1])
+        older = list(self.older(queryset, msg_id, True)[: older_limit + 1])
+        if not older:
+            # cursor message is not in the queryset
+            return []
+        if len(newer) > newer_limit:
+            newer = newer[:newer_limit]
+            self.previous_id = newer[-1].pk
+        if len(older) > older_limit:
+            older = older[:older_limit]
+            self.next_id = older[-1].pk
+        newer.reverse()
+        return newer + older
+
+    def get_link(self, param: str, msg_id):
+        if msg_id is None:
+            return None
+        url = self.request.build_absolute_uri()
+        for name in (
+            self.offset_query_param,
+            self.before_query_param,
+            self.after_query_param,
+            self.around_query_param,
+        ):
+            url = remove_query_param(url, name)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, param, msg_id)
+
+    def get_next_link(self):
+        return self.get_link(self.before_query_param, self.next_id)
 
     def get_previous_link(self):
-        url = super().get_previous_link()
+        return self.get_link(self.after_query_param, self.previous_id)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+
+class SearchCursorPagination(LimitPaginationMixin, BasePagination):
+    """
+    Keyset pagination of ranked search results of several types over
+    (rank, created, type, id), best first. Querysets of each type are
+    filtered by the cursor before they are combined, so deep pages cost
+    the same as the first one. Cursor is an opaque position of the last
+    result of the previous page.
+    """
+
+    default_limit = 20
+    max_limit = 50
+    cursor_query_param = "cursor"
+    ordering = ("-rank", "-created", "-type", "-id")
+    fields = ("id", "created", "rank", "type")
+
+    def paginate_queryset(self, querysets: dict, request, view=None) -> list[dict]:
+        """
+        Paginates querysets with 'rank' annotation by their result type.
+        Returns rows of (id, created, rank, type) of the page
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.next_cursor = None
+        cursor = self.get_cursor()
+        parts = [
+            self.after(qs.annotate(type=Value(type_)), type_, cursor)
+            .values(*self.fields)
+            .order_by(*self.ordering)[: self.limit + 1]
+            for type_, qs in querysets.items()
+        ]
+        if not parts:
+            return []
+        results = parts[0]
+        if len(parts) > 1:
+            results = results.union(*parts[1:], all=True).order_by(*self.ordering)
+        page = list(results[: self.limit + 1])
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def after(self, queryset, type_: str, cursor):
+        """Results of the type after the cursor in result ordering"""
+        if cursor is None:
+            return queryset
+        rank, created, cursor_type, result_id = cursor
+        exp = Q(rank__lt=rank) | Q(rank=rank, created__lt=created)
+        if type_ < cursor_type:
+            exp |= Q(rank=rank, created=created)
+        elif type_ == cursor_type:
+            exp |= Q(rank=rank, created=created, id__lt=result_id)
+        return queryset.filter(exp)
+
+    def encode_cursor(self, row: dict) -> str:
+        position = [row["rank"], row["created"].isoformat(), row["type"], row["id"]]
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def get_cursor(self):
+        encoded = self.request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
         try:
-            assert url and self.offset
-            if self.offset - self.limit <= 0:
-                return replace_query_param(url, self.limit_query_param, self.offset)
-        except Exception:
-            pass
-        return url
+            rank, created, type_, result_id = json.loads(urlsafe_b64decode(encoded))
+            created = parse_datetime(created)
+            if created is None:
+                raise ValueError(created)
+            return float(rank), created, str(type_), int(result_id)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
@@ -0,0 +1,119 @@
+"""Read receipts aggregator"""
+
+import asyncio
+import threading
+from contextvars import Context
+
+from django.conf import settings
+from django.db import transaction
+
+from channels.db import database_sync_to_async as DSA
+
+from ..models import Inbox
+
+
+class ReadReceipts:
+    """
+    Aggregates read receipts of users sent over REST or WS.
+    Receipts of the same user chat or group are coalesced to the latest
+    read message within a window, then read watermark is written once and
+    one 'read' event is recorded to outbox of the chat or group.
+    Windows are timed on the server event loop of the outbox dispatcher,
+    pending receipts of a user are written when user session disconnects.
+    """
+
+    def __init__(self, window: float = 0.5):
+        """Initializes read receipts aggregator
+
+        Args:
+            window (float, optional): seconds to coalesce receipts.
+            Defaults to 0.5.
+        """
+        self.window = window
+        # (user id, inbox field, chat or group id) -> (user, latest message)
+        self.pending = {}
+        # running flush tasks
+        self.tasks = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(user, msg) -> tuple:
+        field = msg.inbox_field
+        return (user.pk, field, getattr(msg, field + "_id"))
+
+    def add(self, user, msg):
+        """Adds receipt of user that read messages up to the message"""
+        key = self.get_key(user, msg)
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending and (pending[1].created, pending[1].pk) >= (msg.created, msg.pk):
+                return
+            self.pending[key] = (user, msg)
+        if pending is None:
+            self.schedule(key)
+
+    def schedule(self, key):
+        """
+        Schedules flush of receipt after the window on the server event loop.
+        Without server event loop receipt is written in place
+        """
+        from .outbox import dispatcher
+
+        loop = dispatcher.loop
+        if loop is None or loop.is_closed():
+            self.flush(key)
+            return
+        loop.call_soon_threadsafe(
+            loop.call_later, self.window, self.start_flush, key, context=Context()
+        )
+
+    def start_flush(self, key):
+        """Starts flush task of receipt on the event loop"""
+        task = asyncio.create_task(DSA(self.flush)(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def flush(self, key) -> bool:
+        """
+        Writes coalesced receipt with its 'read' event.
+        Returns False if watermark has not moved
+        """
+        from .outbox import record_event
+
+        with self.lock:
+            pending = self.pending.pop(key, None)
+        if pending is None:
+            return False
+        user, msg = pending
+        event_type = msg.inbox_field
+        with transaction.atomic():
+            if not Inbox.objects.read(user, msg):
+                return False
+            record_event(
+                event_type,
+                "read",
+                user_id=user.pk,
+                msg_id=msg.pk,
+                created=msg.created.isoformat(),
+                **{"%s_id" % event_type: getattr(msg, event_type + "_id")},
+            )
+        return True
+
+    def flush_user(self, user_id) -> int:
+        """
+        Writes pending receipts of a user.
+        Returns the number of written ones
+        """
+        with self.lock:
+            keys = [key for key in self.pending if key[0] == user_id]
+        return sum(self.flush(key) for key in keys)
+
+    def flush_all(self) -> int:
+        """Writes all pending receipts. Returns the number of written ones"""
+        with self.lock:
+            keys = list(self.pending)
+        return sum(self.flush(key) for key in keys)
+
+
+# Shared read receipts aggregator of the process
+receipts = ReadReceipts(**getattr(settings, "READ_RECEIPTS", {}))
@@ -11,3 +11,4 @@ from .groups import (
     GroupBanSerializer,
     GMessageSerializer,
 )
+from .search import MessageSearchSerializer
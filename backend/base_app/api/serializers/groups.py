@@ -115,9 +115,6 @@ class GroupSerializer(ChatMixin, GroupMixin, ModelSerializerMixin, S.ModelSerial
 
         msg_serializer_class = GMessageSerializer
 
-    def get_message(self, group):
-        return group.latest[0]
-
     def validate_photo(self, val):
         """
         Cleans old photo before  if it exists
@@ -132,6 +129,7 @@ class GroupSerializer(ChatMixin, GroupMixin, ModelSerializerMixin, S.ModelSerial
             with transaction.atomic():
                 group = super().create(validated_data)
                 group.setup_group()
+                group.refresh_from_db(fields=Group.COUNTER_FIELDS)
         except Exception as e:
             raise EX.ValidationError({"unknown": "Something went wrong."})
         return group
@@ -143,20 +141,27 @@ class MemberSerializer(ReprSerializerMixin, ModelSerializerMixin, S.ModelSeriali
     """
 
     url = AbsoluteURLField()
-    last_activity = S.SerializerMethodField()
+    # viewer capabilities over member, included if they are annotated
+    can_kick = S.BooleanField(read_only=True)
+    can_ban = S.BooleanField(read_only=True)
+    can_manage_role = S.BooleanField(read_only=True)
 
     class Meta:
         model = GroupMember
-        fields = ("id", "url", "user", "role", "joint", "last_activity")
-        read_only_fields = ("id",)
+        fields = (
+            "id",
+            "url",
+            "user",
+            "role",
+            "joint",
+            "last_activity",
+            "can_kick",
+            "can_ban",
+            "can_manage_role",
+        )
+        read_only_fields = ("id", "last_activity")
         extra_kwargs = {"role": {"required": False, "allow_null": True}}
 
-    def get_last_activity(self, member):
-        try:
-            return getattr(member, "last_activity", member.joint)
-        except Exception:
-            pass
-
     def __init__(self, *args, **kwargs):
         self.user_kwargs = kwargs.pop("user_kwargs", {})
         self.role_kwargs = kwargs.pop("role_kwargs", {})
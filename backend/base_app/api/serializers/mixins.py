@@ -79,7 +79,8 @@ class ModelSerializerMixin:
 
     def update(self, instance, validated_data):
         try:
-            super().update(instance, validated_data)
+            with transaction.atomic():
+                super().update(instance, validated_data)
         except IntegrityError as error:
             raise EX.ValidationError from error
         return instance
@@ -132,7 +133,10 @@ class ChatMixin(DynamicFieldsMixin, RequestMixin, metaclass=S.SerializerMetaclas
             return None
 
     def get_message(self, chat):
-        return chat.messages.first()
+        latest = getattr(chat, "latest", None)
+        if latest is None:
+            return chat.messages.first()
+        return latest[0] if latest else None
 
     def get_unread(self, chat):
         try:
@@ -144,14 +148,8 @@ class ChatMixin(DynamicFieldsMixin, RequestMixin, metaclass=S.SerializerMetaclas
 class GroupMixin(metaclass=S.SerializerMetaclass):
     """Mixin for common group serializer fields, methods and etc."""
 
-    members = S.SerializerMethodField()
-    online = S.SerializerMethodField()
-
-    def get_members(self, group):
-        return getattr(group, "members_count", 0)
-
-    def get_online(self, group):
-        return getattr(group, "online_count", 0)
+    members = S.IntegerField(source="member_count", read_only=True)
+    online = S.IntegerField(source="online_count", read_only=True)
 
 
 class FileMixin(metaclass=S.SerializerMetaclass):
@@ -171,6 +169,8 @@ class MessageMixin(DynamicFieldsMixin, metaclass=S.SerializerMetaclass):
     url = AbsoluteURLField()
     owner_name = S.SerializerMethodField()
     files = S.SerializerMethodField()
+    # annotated from read watermarks, marks messages read when passed
+    seen = S.BooleanField(required=False)
 
     class Meta:
         fields = (
@@ -214,18 +214,28 @@ class MessageMixin(DynamicFieldsMixin, metaclass=S.SerializerMetaclass):
             files = self.initial_data.getlist("files", [])
         except Exception as e:
             files = None
-        msg = super().create(validated_data)
-        if files:
-            try:
-                [data, model] = self.validate_files(files)
-                files = model.objects.bulk_create(
-                    [model(**attrs, message=msg).before_create() for attrs in data]
-                )
-                msg._cached_files = files
-            except Exception as e:
-                print(e)
+        validated_data.pop("seen", None)
+        # create files in the same transaction to publish message with files
+        with transaction.atomic():
+            msg = super().create(validated_data)
+            msg.seen = False
+            if files:
+                try:
+                    [data, model] = self.validate_files(files)
+                    files = model.objects.bulk_create(
+                        [model(**attrs, message=msg).before_create() for attrs in data]
+                    )
+                    msg._cached_files = files
+                except Exception as e:
+                    print(e)
         return msg
 
+    def update(self, instance, validated_data: dict):
+        validated_data.pop("seen", None)
+        # record edit event in the same transaction
+        with transaction.atomic():
+            return super().update(instance, validated_data)
+
     def validate_files(self, files: list):
         """Validates files using file serializer"""
         ser_cls = self.get_file_serializer()
@@ -0,0 +1,19 @@
+"""Search serializers"""
+
+from rest_framework import serializers as S
+
+from ...models import FILE_TYPES
+
+
+class MessageSearchSerializer(S.Serializer):
+    """
+    Serializer to validate message search params
+    """
+
+    q = S.CharField(max_length=200)
+    type = S.ChoiceField(choices=("chat", "group"), required=False)
+    sender = S.IntegerField(required=False)
+    since = S.DateTimeField(required=False)
+    until = S.DateTimeField(required=False)
+    has_file = S.BooleanField(required=False)
+    file_type = S.ChoiceField(choices=tuple(FILE_TYPES), required=False)
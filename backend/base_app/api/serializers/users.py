@@ -46,6 +46,7 @@ class UserSerializer(DynamicFieldsMixin, UserEditMixin, S.ModelSerializer):
             "bio",
             "photo",
             "status",
+            "last_seen",
             "old_password",
             "password",
             "chat_id",
@@ -55,7 +56,7 @@ class UserSerializer(DynamicFieldsMixin, UserEditMixin, S.ModelSerializer):
             "status": {"source": "is_online"},
             "password": {"write_only": True, "label": "New Password"},
         }
-        read_only_fields = ("id",)
+        read_only_fields = ("id", "last_seen")
 
     def __init__(self, *args, exclude_chat=True, **kwargs):
         if exclude_chat and "include" not in kwargs:
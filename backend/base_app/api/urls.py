@@ -53,6 +53,11 @@ urlpatterns = [
     path("check-user-email/", V.check_user_mail, name="check-user-email"),
     path("register/", V.UserRegisterAPIView.as_view(), name="register"),
     path("search/", V.SearchAPIView.as_view(), name="search"),
+    path(
+        "search/messages/",
+        V.MessageSearchAPIView.as_view(),
+        name="search_messages",
+    ),
     path(
         "users/",
         include(
@@ -1,9 +1,8 @@
 """Common API Views"""
 
-import re
 from itertools import chain
 
-from django.db.models import Max, F, Q
+from django.db.models import Max, F, Q, Value
 from django.http import HttpRequest
 from django.utils.functional import cached_property
 from django.core.validators import validate_email
@@ -13,11 +12,23 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework import generics as G, mixins as MX
 from rest_framework.pagination import LimitOffsetPagination
 
-from ..models import User, PChat, Group, FILE_TYPES, MessageFile
+from ..models import (
+    User,
+    PChat,
+    PMessage,
+    Group,
+    GroupMessage,
+    FILE_TYPES,
+    MessageFile,
+)
 
 from . import serializers as S
 from . import permissions as P
-from .pagination import ChatLimitPagination
+from .pagination import (
+    MessageCursorPagination,
+    NoCountLimitPagination,
+    SearchCursorPagination,
+)
 
 
 class SessionAPIView(G.RetrieveUpdateAPIView):
@@ -28,9 +39,10 @@ class SessionAPIView(G.RetrieveUpdateAPIView):
     serializer_class = S.UserSerializer
 
     def get_object(self):
-        user = self.request.user
+        # authenticated user is a cached snapshot without private fields
+        user = User.objects.get(pk=self.request.user.pk)
         # make user online
-        user.status = 1
+        user.is_online = True
         return user
 
 
@@ -93,6 +105,11 @@ class MultiSerializerMixin:
         return result
 
 
+class SearchLimitPagination(NoCountLimitPagination):
+    default_limit = 10
+    max_limit = 50
+
+
 class SearchAPIView(MultiSerializerMixin, G.ListAPIView):
     """
     API View to search group, user chats
@@ -102,43 +119,104 @@ class SearchAPIView(MultiSerializerMixin, G.ListAPIView):
         "Group": {"ser": S.PublicGroupSerializer},
         "User": {"ser": S.UserSerializer},
     }
+    pagination_class = SearchLimitPagination
+    # result ordering: prefix matches, similarity, then name
+    ordering = ("-priority", "-similarity", "sort_name", "type", "id")
 
     @staticmethod
-    def calc_user(user, query: str):
-        priority = not bool(
-            re.match(query, user.username) or re.match(query, user.first_name)
+    def ranked(qs, type_: str, query: str, order: str, name: str):
+        """
+        Returns rows of (id, type, priority, similarity, name) of search results.
+        Rank aliases are set by search methods only for non empty queries
+        """
+        if query:
+            rank = {"priority": F(order), "similarity": F("similarity")}
+        else:
+            rank = {"priority": Value(True), "similarity": Value(0.0)}
+        qs = qs.annotate(type=Value(type_), sort_name=F(name), **rank).order_by()
+        return qs.values("id", "type", "priority", "similarity", "sort_name")
+
+    def get_queryset(self):
+        qr = self.request.GET.get("q", "")
+        user = self.request.user
+        users = self.ranked(
+            User.objects.search_people(qr, user), "user", qr, "user_order", "username"
+        )
+        groups = self.ranked(
+            Group.objects.get_queryset().search_groups(qr, user),
+            "group",
+            qr,
+            "group_order",
+            "unique_name",
         )
-        return (priority, user.username)
+        return users.union(groups, all=True).order_by(*self.ordering)
 
-    @staticmethod
-    def calc_group(group, query: str):
-        priority = not bool(
-            re.match(query, group.unique_name) or re.match(query, group.name)
+    def get_results(self, rows) -> list:
+        """Fetches users and groups of result rows keeping their order"""
+        ids = {"user": [], "group": []}
+        for row in rows:
+            ids[row["type"]].append(row["id"])
+        qs = chain(
+            User.objects.filter(pk__in=ids["user"]).order_by(),
+            Group.objects.filter(pk__in=ids["group"]).order_by(),
         )
-        return (priority, group.unique_name)
+        results = {(type(obj).__name__.lower(), obj.pk): obj for obj in qs}
+        rows = ((row["type"], row["id"]) for row in rows)
+        return [results[row] for row in rows if row in results]
+
+    def list(self, request, *args, **kwargs):
+        rows = self.paginate_queryset(self.get_queryset())
+        data = self.multi_serialize(self.get_results(rows))
+        return self.get_paginated_response(data)
 
-    @classmethod
-    def calc_dispatcher(cls, obj, query: str):
-        return (cls.calc_user if isinstance(obj, User) else cls.calc_group)(obj, query)
 
-    def get_queryset(self):
-        qr = self.request.GET.get("q", "")
+class MessageSearchAPIView(MultiSerializerMixin, G.ListAPIView):
+    """
+    API view to search messages of user chats and groups
+    """
+
+    options = {
+        "PMessage": {"ser": S.MessageSerializer, "type": "chat"},
+        "GroupMessage": {"ser": S.GMessageSerializer, "type": "group"},
+    }
+    models = {"chat": PMessage, "group": GroupMessage}
+    pagination_class = SearchCursorPagination
+
+    def get_queryset(self) -> dict:
+        """Returns querysets of matching messages by their type"""
+        ser = S.MessageSearchSerializer(data=self.request.query_params)
+        ser.is_valid(raise_exception=True)
+        params = dict(ser.validated_data)
+        query = params.pop("q")
+        type_ = params.pop("type", None)
         user = self.request.user
-        user_qs = User.objects.search_people(qr, user)[:5]
-        group_qs = Group.objects.search_groups(qr, user)[:5]
-        return sorted(
-            chain(user_qs, group_qs), key=lambda obj: self.calc_dispatcher(obj, qr)
-        )
+        scopes = {
+            "chat": Q(chat__in=user.get_chats().values("pk")),
+            "group": Q(group__in=user.allowed_groups.values("pk")),
+        }
+        return {
+            key: model.objects.filter(scopes[key]).search(query).filter_search(**params)
+            for key, model in self.models.items()
+            if type_ in (None, key)
+        }
+
+    def get_messages(self, rows) -> list:
+        """Fetches messages of result rows keeping their order"""
+        ids = {}
+        for row in rows:
+            ids.setdefault(row["type"], []).append(row["id"])
+        messages = {}
+        user = self.request.user
+        for key, pks in ids.items():
+            qs = self.models[key].objects.common_fetch(user).filter(pk__in=pks)
+            messages.update(((key, msg.pk), msg) for msg in qs)
+        rows = ((row["type"], row["id"]) for row in rows)
+        return [messages[row] for row in rows if row in messages]
 
     def list(self, request, *args, **kwargs):
-        qs_list = self.get_queryset()
-        data = self.multi_serialize(qs_list)
-        return Response(
-            {
-                "count": len(data),
-                "results": data,
-            }
-        )
+        rows = self.paginate_queryset(self.get_queryset())
+        data = self.multi_serialize(self.get_messages(rows))
+        return self.get_paginated_response(data)
 
 
 class UsersAPIView(MX.RetrieveModelMixin, MX.ListModelMixin, G.GenericAPIView):
@@ -224,10 +302,10 @@ class ChatMessagesAPIView(ChatMixin, G.ListCreateAPIView):
     """
 
     serializer_class = S.MessageSerializer
-    pagination_class = ChatLimitPagination
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
-        return self.chat.messages.common_fetch()
+        return self.chat.messages.common_fetch(self.request.user)
 
     def perform_create(self, serializer: S.MessageSerializer):
         return serializer.save(chat=self.chat, owner=self.request.user)
@@ -262,19 +340,21 @@ class AllChatsAPIView(MultiSerializerMixin, G.ListAPIView):
         return self.request.user.get_generic_chats()
 
     def paginate_queryset(self, queryset):
-        chats_ = super().paginate_queryset(queryset)
-        generics = dict.fromkeys("%(type)s:%(id)s" % chat for chat in chats_)
+        entries = super().paginate_queryset(queryset)
+        generics = dict.fromkeys(
+            f"{entry.type}:{entry.chat_id or entry.group_id}" for entry in entries
+        )
         chats = set()
         groups = set()
-        for chat in chats_:
-            if chat["type"] == "chat":
-                chats.add(chat["id"])
+        for entry in entries:
+            if entry.chat_id:
+                chats.add(entry.chat_id)
             else:
-                groups.add(chat["id"])
+                groups.add(entry.group_id)
         user = self.request.user
         qs = chain(
             PChat.objects.common_fetch(user).filter(id__in=chats).order_by(),
-            Group.objects.common_fetch().filter(id__in=groups).order_by(),
+            Group.objects.common_fetch(user).filter(id__in=groups).order_by(),
         )
         generics.update((f"{chat.type}:{chat.pk}", chat) for chat in qs)
         return generics.values()
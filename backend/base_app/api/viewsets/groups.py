@@ -2,8 +2,8 @@
 
 import re
 
-from django.db.models import Q, Subquery, OuterRef, F
-from django.db.models.functions import Greatest
+from django.db import transaction
+from django.db.models import Q
 from django.utils.translation import gettext as _
 
 from rest_framework import status
@@ -13,7 +13,17 @@ from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 
-from ...models import GroupMessageFile, FILE_TYPES, User, Group, UNIQUE_NAME_RE
+from ...models import (
+    GroupMessageFile,
+    GroupMember,
+    FILE_TYPES,
+    User,
+    Group,
+    Inbox,
+    UNIQUE_NAME_RE,
+)
+from ...presence import presence
+from ...cache import group_members
 
 from ..serializers import (
     UserSerializer,
@@ -25,6 +35,9 @@ from ..serializers import (
     GFileSerializer,
 )
 
+from ..outbox import record_event, serialize
+from ..pagination import MessageCursorPagination
+from ..receipts import receipts
 from .utils import nested_action, exc_manager
 from .mixins import NestedViewSetMixin
 
@@ -35,7 +48,7 @@ class MessageMixin:
     def messages_queryset(self):
         if self.request.method == "DELETE":
             return self.group.messages.all()
-        qs = self.group.messages.common_fetch()
+        qs = self.group.messages.common_fetch(self.request.user)
         lookup = getattr(self, "messages_lookup", None)
         if lookup:
             qs = qs.filter(lookup)
@@ -44,6 +57,9 @@ class MessageMixin:
     def messages_ser_class(self):
         return GMessageSerializer
 
+    def messages_pagination_class(self):
+        return MessageCursorPagination
+
     def messages_create(self, serializer):
         serializer.save(owner=self.request.user, group=self.group)
 
@@ -86,6 +102,18 @@ class MessageMixin:
             self.messages_lookup = Q(owner=self.request.user)
         return self.destroy(request, *args, **kwargs)
 
+    @action(
+        detail=True,
+        methods=["post"],
+        url_path=r"messages/(?P<pk>\d+)/read",
+        url_name="message-read",
+    )
+    @nested_action(action="messages", detail=True)
+    def message_read(self, request, *args, **kwargs):
+        """Marks group messages up to the message as read"""
+        receipts.add(request.user, self.get_object())
+        return Response(status=status.HTTP_202_ACCEPTED)
+
 
 class RoleMixin:
     """Mixin to handle group role requests"""
@@ -212,26 +240,28 @@ class MemberMixin:
         if query:
             qs = self.group.search_member(query)
         else:
-            sub_q = Subquery(
-                self.group.messages.filter(owner_id=OuterRef("user_id"))
-                .order_by("-created")
-                .values("created")[:1]
-            )
-            qs = self.group.allowed_members.annotate(
-                last_activity=Greatest(sub_q, F("joint"))
-            ).order_by("-last_activity")
+            qs = self.group.allowed_members.order_by("-last_activity")
+        if self.request.GET.get("capabilities"):
+            qs = qs.annotate_capabilities(self.viewer_role())
         return qs.select_related("user", "role").only(
             "joint",
+            "last_activity",
             "group",
             "user",
             "user__first_name",
             "user__last_name",
             "user__photo",
-            "user__status",
             "role",
             "role__name",
         )
 
+    def viewer_role(self):
+        """Returns role of current user in group or None if they are not a member"""
+        try:
+            return self.group.get_user_role(self.request.user)
+        except GroupMember.DoesNotExist:
+            return None
+
     def members_ser_class(self):
         return MemberSerializer
 
@@ -285,10 +315,23 @@ class MemberMixin:
         model = group.members.model
         role = group.default_role
         add_user = self.request.user
-        members = model.objects.bulk_create(
-            model(user=user, group=group, role=role, added_by=add_user)
-            for user in users
-        )
+        with transaction.atomic():
+            members = model.objects.bulk_create(
+                model(user=user, group=group, role=role, added_by=add_user)
+                for user in users
+            )
+            # bulk create doesn't send signals
+            Inbox.objects.add_group_members([user.pk for user in users], group.pk)
+            Group.objects.filter(pk=group.pk).shift_counts(
+                len(members), presence.online_count(user.pk for user in users)
+            )
+            record_event(
+                "group",
+                "invite",
+                group_id=group.pk,
+                members=serialize(MemberSerializer, members, many=True),
+            )
+        group_members.invalidate(group.pk)
         return members
 
     def members_bulk_try(self, request):
@@ -344,6 +387,7 @@ class MemberMixin:
 
     @action(methods=["delete"], detail=True)
     @nested_action(action="members")
+    @transaction.atomic
     def leave(self, request, *args, **kwargs):
         member = get_object_or_404(self.group.members, user_id=request.user)
         member.delete()
@@ -355,23 +399,8 @@ class MemberBanMixin:
 
     def bans_queryset(self):
         query = self.request.GET.get("q")
-        qs = self.group.bans.select_related("user", "banned_by")
-        if query:
-            qs = (
-                qs.filter(
-                    Q(user__username__icontains=query)
-                    | Q(user__first_name__icontains=query)
-                    | Q(user__last_name__icontains=query)
-                )
-                .alias(
-                    q_priority=(
-                        Q(user__username__istartswith=query)
-                        | Q(user__first_name__istartswith=query)
-                    )
-                )
-                .order_by("-q_priority", "user__username")
-            )
-        return qs
+        qs = self.group.search_ban(query) if query else self.group.bans.all()
+        return qs.select_related("user", "banned_by")
 
     def bans_ser_class(self):
         return GroupBanSerializer
@@ -472,7 +501,7 @@ class GroupViewSet(
         if self.request.method == "DELETE":
             return qs
         sub_q = qs.values("pk")
-        return Group.objects.common_fetch().filter(pk__in=sub_q)
+        return Group.objects.common_fetch(user).filter(pk__in=sub_q)
 
     def root_create(self, serializer):
         return serializer.save(owner=self.request.user)
@@ -502,7 +531,8 @@ class GroupViewSet(
         if not group.is_owner(self.request.user.pk):
             raise PermissionDenied(_("You're not allowed to delete this group"))
         members = list(group.online_ids)
-        group.delete()
+        with transaction.atomic():
+            group.delete()
         return Response(members)
 
     @action(detail=True, methods=["get"], url_path=r"my-role", url_name="my-role")
@@ -1,5 +1,7 @@
 """ViewSet mixins"""
 
+from django.db import transaction
+
 
 class NestedViewSetMixin:
     """Mixin to implement nested viewsets"""
@@ -21,6 +23,7 @@ class NestedViewSetMixin:
     CREATE_PAT = "%s_create"
     UPDATE_PAT = "%s_update"
     DESTROY_PAT = "%s_destroy"
+    PAGINATION_PAT = "%s_pagination_class"
 
     @property
     def root_action(self):
@@ -66,6 +69,15 @@ class NestedViewSetMixin:
     def get_object(self):
         return self.dynamic_call(self.OBJ_PAT, super().get_object)
 
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            pagination_class = self.dynamic_call(
+                self.PAGINATION_PAT, lambda: self.pagination_class
+            )
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
+
     def get_serializer_class(self):
         return self.dynamic_call(self.SER_CLASS_PAT, super().get_serializer_class)
 
@@ -76,12 +88,17 @@ class NestedViewSetMixin:
             pass
         return self.dynamic_call(self.SER_PAT, super().get_serializer, *args, **kwargs)
 
+    # writes run in transactions to record their outbox events atomically
+
+    @transaction.atomic
     def perform_create(self, serializer):
         self.dynamic_call(self.CREATE_PAT, super().perform_create, serializer)
 
+    @transaction.atomic
     def perform_update(self, serializer):
         self.dynamic_call(self.UPDATE_PAT, super().perform_update, serializer)
 
+    @transaction.atomic
     def perform_destroy(self, instance):
         self.dynamic_call(self.DESTROY_PAT, super().perform_destroy, instance)
 
@@ -1,10 +1,12 @@
-from django.http import Http404
-from django.db.models import Q
+from django.db import transaction
 
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import mixins as MX
+from rest_framework import status
+from rest_framework.response import Response
 
 from ...models import PMessage
+from ..receipts import receipts
 from ..serializers import MessageSerializer
 
 
@@ -16,26 +18,27 @@ class MessageViewSet(
     serializer_class = MessageSerializer
 
     def get_queryset(self):
+        user = self.request.user
+        # check chat membership in the same query
+        chats = user.get_chats().values("pk")
         if self.request.method == "DELETE":
-            return PMessage.objects.all()
-        return PMessage.objects.common_fetch()
+            return PMessage.objects.filter(chat__in=chats)
+        return PMessage.objects.common_fetch(user).filter(chat__in=chats)
 
-    def get_object(self):
-        msg = super().get_object()
-        if not self.request.user.get_chats().contains(msg.chat):
-            raise Http404()
-        return msg
-
-    def perform_update(self, serializer: MessageSerializer):
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
         v_data = serializer.validated_data
         if len(v_data) == 1 and "seen" in v_data:
-            msg = serializer.instance
-            expr = (
-                ~Q(owner=self.request.user)
-                & Q(created__lte=msg.created)
-                & Q(seen=False)
-            )
-            msg.chat.messages.filter(expr).update(seen=True)
-            msg.seen = True
-            return msg
-        return serializer.save()
+            # receipts are coalesced and written after a short window,
+            # so seen state is not known yet
+            receipts.add(request.user, instance)
+            return Response(status=status.HTTP_202_ACCEPTED)
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
+    @transaction.atomic
+    def perform_destroy(self, instance: PMessage):
+        instance.delete()
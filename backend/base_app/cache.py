@@ -0,0 +1,342 @@
+"""Shared caches of the app"""
+
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from .presence import presence
+
+
+class CacheStats:
+    """Hit/miss counters of a cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        self.hits += 1
+
+    def miss(self):
+        self.misses += 1
+
+    def as_dict(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class GroupMembersCache:
+    """
+    Caches member ids and banned ids of groups keyed by group id.
+    Must be invalidated whenever group membership changes
+    """
+
+    # cache key pattern
+    key_p = "group_members:%s"
+
+    def __init__(self, alias: str = "default", timeout: int = 60 * 10):
+        """Initializes group members cache
+
+        Args:
+            alias (str, optional): django cache alias. Defaults to "default".
+            timeout (int, optional): entries lifetime in seconds. Defaults to 600.
+        """
+        self.alias = alias
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def load(self, group_id) -> dict:
+        """Loads member and banned ids of a group from DB"""
+        from .models import GroupMember, GroupBan
+
+        return {
+            "members": list(
+                GroupMember.objects.filter(group_id=group_id)
+                .order_by()
+                .values_list("user_id", flat=True)
+            ),
+            "banned": list(
+                GroupBan.objects.filter(group_id=group_id)
+                .order_by()
+                .values_list("user_id", flat=True)
+            ),
+        }
+
+    def get(self, group_id) -> dict:
+        """Returns cached member and banned ids of a group as sets"""
+        key = self.key_p % group_id
+        entry = self.cache.get(key)
+        if entry is None:
+            self.stats.miss()
+            entry = self.load(group_id)
+            self.cache.set(key, entry, self.timeout)
+        else:
+            self.stats.hit()
+        return {"members": set(entry["members"]), "banned": set(entry["banned"])}
+
+    def member_ids(self, group_id) -> set:
+        """Returns ids of all group members"""
+        return self.get(group_id)["members"]
+
+    def banned_ids(self, group_id) -> set:
+        """Returns ids of banned people"""
+        return self.get(group_id)["banned"]
+
+    def allowed_ids(self, group_id) -> set:
+        """Returns ids of members that are not banned"""
+        entry = self.get(group_id)
+        return entry["members"] - entry["banned"]
+
+    def online_ids(self, group_id) -> set:
+        """Returns ids of allowed members that are online"""
+        return presence.online_ids(self.allowed_ids(group_id))
+
+    def invalidate(self, group_id):
+        """Removes cached entry of a group"""
+        self.cache.delete(self.key_p % group_id)
+
+
+class GroupRolesCache:
+    """
+    Caches compact role records of group members keyed by
+    (group id, user id). Entries of a group are versioned, so role changes
+    invalidate the whole group by bumping its version while membership
+    changes remove one entry. Non members are not cached
+    """
+
+    # cache key patterns
+    key_p = "group_role_mask:%s:%s:%s"
+    version_key_p = "group_roles_version:%s"
+
+    def __init__(self, alias: str = "default", timeout: int = 60 * 10):
+        """Initializes group roles cache
+
+        Args:
+            alias (str, optional): django cache alias. Defaults to "default".
+            timeout (int, optional): entries lifetime in seconds. Defaults to 600.
+        """
+        self.alias = alias
+        self.timeout = timeout
+        # shared cache counters
+        self.stats = CacheStats()
+        # counters of roles memoized by group instances
+        self.memo_stats = CacheStats()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_version(self, group_id) -> int:
+        """
+        Returns version of group entries. Versions are timestamps, so
+        entries of an evicted version are never used again
+        """
+        key = self.version_key_p % group_id
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def load(self, group_id, user_ids) -> dict:
+        """Loads role records of group members from DB"""
+        from .models import GroupMember, GroupRole
+
+        fields = ("role__%s" % field for field in GroupRole.RECORD_FIELDS)
+        qs = GroupMember.objects.filter(group_id=group_id, user_id__in=user_ids)
+        return {
+            row[0]: row[1:] for row in qs.order_by().values_list("user_id", *fields)
+        }
+
+    def get_many(self, group_id, user_ids) -> dict:
+        """Returns roles of group members by user ids, None for non members"""
+        from .models import GroupRole
+
+        version = self.get_version(group_id)
+        keys = {
+            self.key_p % (group_id, version, user_id): user_id for user_id in user_ids
+        }
+        records = {
+            keys[key]: record for key, record in self.cache.get_many(keys).items()
+        }
+        self.stats.hits += len(records)
+        missing = [user_id for user_id in user_ids if user_id not in records]
+        if missing:
+            self.stats.misses += len(missing)
+            loaded = self.load(group_id, missing)
+            self.cache.set_many(
+                {
+                    self.key_p % (group_id, version, user_id): record
+                    for user_id, record in loaded.items()
+                },
+                self.timeout,
+            )
+            records.update(loaded)
+        return {
+            user_id: GroupRole.from_record(group_id, records[user_id])
+            if user_id in records
+            else None
+            for user_id in user_ids
+        }
+
+    def invalidate(self, group_id, user_id):
+        """Removes cached role of a group member"""
+        version = self.get_version(group_id)
+        self.cache.delete(self.key_p % (group_id, version, user_id))
+
+    def invalidate_group(self, group_id):
+        """Invalidates cached roles of all group members"""
+        self.cache.set(self.version_key_p % group_id, time.time_ns(), None)
+
+
+class UserCache:
+    """
+    Caches user snapshots keyed by user id to authenticate
+    requests without DB queries. Snapshots are records of public
+    and auth fields only, secrets like passwords are never cached.
+    Must be invalidated whenever user is changed
+    """
+
+    # cache key pattern
+    key_p = "user:%s"
+
+    def __init__(self, alias: str = "default", timeout: int = 60 * 10):
+        """Initializes user cache
+
+        Args:
+            alias (str, optional): django cache alias. Defaults to "default".
+            timeout (int, optional): entries lifetime in seconds. Defaults to 600.
+        """
+        self.alias = alias
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, user_id):
+        """
+        Returns user built from cached snapshot
+        or None if user does not exist
+        """
+        from .models import User
+
+        key = self.key_p % user_id
+        record = self.cache.get(key)
+        if record is None:
+            self.stats.miss()
+            record = (
+                User.objects.filter(pk=user_id).values_list(*User.RECORD_FIELDS).first()
+            )
+            if record is None:
+                return None
+            self.cache.set(key, record, self.timeout)
+        else:
+            self.stats.hit()
+        return User.from_record(record)
+
+    def invalidate(self, user_id):
+        """Removes cached user"""
+        self.cache.delete(self.key_p % user_id)
+
+
+class ActivityThrottle:
+    """
+    Throttles activity writes of group members keyed by (group id, user id).
+    The first write of an interval adds a key living for the interval,
+    so other writes are skipped without DB queries on all server nodes
+    """
+
+    # cache key pattern
+    key_p = "member_activity:%s:%s"
+
+    def __init__(self, alias: str = "default"):
+        """Initializes activity throttle
+
+        Args:
+            alias (str, optional): django cache alias. Defaults to "default".
+        """
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def allow(self, group_id, user_id, interval: timedelta) -> bool:
+        """Returns True if member activity wasn't written within interval"""
+        key = self.key_p % (group_id, user_id)
+        return self.cache.add(key, 1, interval.total_seconds())
+
+
+class TokenCache:
+    """
+    Process local LRU cache of validated tokens keyed by token hash.
+    Entries expire together with their tokens
+    """
+
+    def __init__(self, size: int = 10000):
+        """Initializes token cache
+
+        Args:
+            size (int, optional): max number of tokens. Defaults to 10000.
+        """
+        self.size = size
+        # token hash -> (validated token, expiry timestamp)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+
+    @staticmethod
+    def key(raw_token) -> str:
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        return hashlib.sha256(raw_token).hexdigest()
+
+    def get(self, raw_token):
+        """Returns validated token or None if it is not cached or expired"""
+        key = self.key(raw_token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.stats.miss()
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hit()
+            return entry[0]
+
+    def set(self, raw_token, token):
+        """Caches validated token until its 'exp' claim"""
+        expiry = token.payload.get("exp", 0)
+        key = self.key(raw_token)
+        with self.lock:
+            self.entries[key] = (token, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+# Default group members cache
+group_members = GroupMembersCache()
+
+# Default group member roles cache
+group_roles = GroupRolesCache()
+
+# Default user snapshots cache
+users = UserCache()
+
+# Default member activity throttle
+member_activity = ActivityThrottle()
+
+# Default validated tokens cache
+tokens = TokenCache()
@@ -0,0 +1,245 @@
+"""In-process fake of the redis client used by redis backends in tests"""
+
+import time
+import threading
+
+
+def encode(value) -> bytes:
+    """Encodes value the same way redis client does"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).encode()
+
+
+def parse_score(value, default) -> tuple[float, bool]:
+    """Parses redis score bound and returns (score, exclusive)"""
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str):
+        if value in ("-inf", "+inf", "inf"):
+            return float(value), False
+        if value.startswith("("):
+            return float(value[1:]), True
+    return float(value if value is not None else default), False
+
+
+class LocalPipeline:
+    """Pipeline that queues commands and runs them on execute"""
+
+    def __init__(self, client: "LocalRedis"):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> list:
+        with self.client.lock:
+            commands, self.commands = self.commands, []
+            return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class LocalRedis:
+    """
+    Process local redis compatible client.
+    Implements only the commands used by redis backends of the app,
+    so they can be tested without a redis server.
+    Values are returned as bytes like the real client does
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """Initializes local redis client
+
+        Args:
+            clock (Callable, optional): current time in seconds used for
+            key expiration. Defaults to time.monotonic.
+        """
+        self.clock = clock
+        self.data: dict[bytes, object] = {}
+        self.expiry: dict[bytes, float] = {}
+        self.lock = threading.RLock()
+
+    def pipeline(self, transaction=True) -> LocalPipeline:
+        return LocalPipeline(self)
+
+    def _get(self, key, default=None):
+        """Returns value of key that is not expired"""
+        key = encode(key)
+        exp = self.expiry.get(key)
+        if exp is not None and exp <= self.clock():
+            del self.expiry[key]
+            self.data.pop(key, None)
+        if key not in self.data and default is not None:
+            self.data[key] = default
+        return self.data.get(key)
+
+    def _cleanup(self, key):
+        """Removes empty collection"""
+        key = encode(key)
+        if not self.data.get(key, True):
+            del self.data[key]
+            self.expiry.pop(key, None)
+
+    # keys
+
+    def exists(self, *keys) -> int:
+        with self.lock:
+            return sum(self._get(key) is not None for key in keys)
+
+    def delete(self, *keys) -> int:
+        with self.lock:
+            removed = 0
+            for key in keys:
+                removed += self._get(key) is not None
+                self.data.pop(encode(key), None)
+                self.expiry.pop(encode(key), None)
+            return removed
+
+    def expire(self, key, seconds) -> bool:
+        with self.lock:
+            if self._get(key) is None:
+                return False
+            self.expiry[encode(key)] = self.clock() + seconds
+            return True
+
+    # strings
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and self._get(key) is not None:
+                return None
+            self.data[encode(key)] = encode(value)
+            self.expiry.pop(encode(key), None)
+            if ex is not None:
+                self.expiry[encode(key)] = self.clock() + ex
+            return True
+
+    def mget(self, keys) -> list:
+        with self.lock:
+            return [self._get(key) for key in keys]
+
+    def incr(self, key, amount=1) -> int:
+        with self.lock:
+            value = int(self._get(key) or 0) + amount
+            self.data[encode(key)] = encode(value)
+            return value
+
+    # hashes
+
+    def hset(self, key, field=None, value=None, mapping=None) -> int:
+        with self.lock:
+            hash = self._get(key, {})
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(encode(f) not in hash for f in items)
+            hash.update({encode(f): encode(v) for f, v in items.items()})
+            return added
+
+    def hgetall(self, key) -> dict:
+        with self.lock:
+            return dict(self._get(key) or {})
+
+    def hdel(self, key, *fields) -> int:
+        with self.lock:
+            hash = self._get(key, {})
+            removed = sum(hash.pop(encode(f), None) is not None for f in fields)
+            self._cleanup(key)
+            return removed
+
+    def hlen(self, key) -> int:
+        with self.lock:
+            return len(self._get(key) or ())
+
+    # sets
+
+    def sadd(self, key, *members) -> int:
+        with self.lock:
+            members = {encode(m) for m in members}
+            set_ = self._get(key, set())
+            added = len(members - set_)
+            set_ |= members
+            return added
+
+    def srem(self, key, *members) -> int:
+        with self.lock:
+            members = {encode(m) for m in members}
+            set_ = self._get(key, set())
+            removed = len(members & set_)
+            set_ -= members
+            self._cleanup(key)
+            return removed
+
+    def smembers(self, key) -> set:
+        with self.lock:
+            return set(self._get(key) or ())
+
+    # sorted sets
+
+    def _sorted(self, key) -> list:
+        """Returns (member, score) of sorted set ordered by score"""
+        return sorted((self._get(key) or {}).items(), key=lambda i: (i[1], i[0]))
+
+    def zadd(self, key, mapping: dict) -> int:
+        with self.lock:
+            zset = self._get(key, {})
+            added = sum(encode(m) not in zset for m in mapping)
+            zset.update({encode(m): float(s) for m, s in mapping.items()})
+            return added
+
+    def zrem(self, key, *members) -> int:
+        with self.lock:
+            zset = self._get(key, {})
+            removed = sum(zset.pop(encode(m), None) is not None for m in members)
+            self._cleanup(key)
+            return removed
+
+    def zcard(self, key) -> int:
+        with self.lock:
+            return len(self._get(key) or ())
+
+    def zrange(self, key, start, end, withscores=False) -> list:
+        with self.lock:
+            items = self._sorted(key)
+            start = max(len(items) + start, 0) if start < 0 else start
+            end = len(items) + end if end < 0 else end
+            items = items[start : max(end + 1, 0)]
+            return items if withscores else [m for m, _ in items]
+
+    def zrangebyscore(
+        self, key, min, max, start=None, num=None, withscores=False
+    ) -> list:
+        with self.lock:
+            low, low_exclusive = parse_score(min, "-inf")
+            high, high_exclusive = parse_score(max, "+inf")
+            items = [
+                (member, score)
+                for member, score in self._sorted(key)
+                if (score > low if low_exclusive else score >= low)
+                and (score < high if high_exclusive else score <= high)
+            ]
+            if start is not None:
+                items = items[start : None if num is None else start + num]
+            return items if withscores else [m for m, _ in items]
+
+    def zremrangebyrank(self, key, start, end) -> int:
+        with self.lock:
+            members = self.zrange(key, start, end)
+            return self.zrem(key, *members) if members else 0
+
+    def zremrangebyscore(self, key, min, max) -> int:
+        with self.lock:
+            members = self.zrangebyscore(key, min, max)
+            return self.zrem(key, *members) if members else 0
@@ -0,0 +1,30 @@
+"""Command to fill inbox entries of existing chats and groups"""
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from ...models import User, Inbox
+
+
+class Command(BaseCommand):
+    help = "Rebuilds inbox entries of users from their chats and groups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=500,
+            help="Number of users to rebuild at once. Defaults to 500.",
+        )
+
+    def handle(self, *args, batch, **options):
+        user_ids = User.objects.order_by("pk").values_list("pk", flat=True)
+        users = rows = 0
+        for i in range(0, len(user_ids), batch):
+            ids = list(user_ids[i : i + batch])
+            with transaction.atomic():
+                rows += Inbox.objects.rebuild(ids)
+            users += len(ids)
+        self.stdout.write(
+            self.style.SUCCESS("Rebuilt %d entries of %d users" % (rows, users))
+        )
@@ -0,0 +1,46 @@
+"""Command to check inbox entries consistency"""
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from ...models import User, Inbox
+
+
+class Command(BaseCommand):
+    help = "Compares inbox entries with chats and groups of users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=500,
+            help="Number of users to check at once. Defaults to 500.",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Rebuild entries of users with inconsistent inbox.",
+        )
+
+    def handle(self, *args, batch, repair, **options):
+        user_ids = User.objects.order_by("pk").values_list("pk", flat=True)
+        totals = {"missing": 0, "stale": 0, "orphan": 0}
+        repaired = 0
+        for i in range(0, len(user_ids), batch):
+            ids = list(user_ids[i : i + batch])
+            with transaction.atomic():
+                missing, stale, orphan = Inbox.objects.diff(ids)
+                broken = set()
+                for kind, rows in zip(totals, (missing, stale, orphan)):
+                    totals[kind] += len(rows)
+                    for row in rows:
+                        broken.add(row.user_id)
+                        self.stdout.write("%s: %s" % (kind, row))
+                if repair and broken:
+                    Inbox.objects.rebuild(list(broken))
+                    repaired += len(broken)
+        summary = ", ".join("%d %s" % (n, kind) for kind, n in totals.items())
+        style = self.style.SUCCESS if not any(totals.values()) else self.style.WARNING
+        self.stdout.write(style("Inbox check: %s" % summary))
+        if repair:
+            self.stdout.write(self.style.SUCCESS("Repaired %d users" % repaired))
@@ -0,0 +1,38 @@
+"""Command to publish leftover outbox events"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from ...models import OutboxEvent
+from ...api.outbox import dispatch_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Publishes outbox events that were not published after commit. "
+        "Events claimed by other publishers are skipped until their claim expires"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--age",
+            type=int,
+            default=30,
+            help="Minimal age of events in seconds. Defaults to 30.",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=500,
+            help="Number of events to publish at once. Defaults to 500.",
+        )
+
+    def handle(self, *args, age, batch, **options):
+        created = timezone.now() - timedelta(seconds=age)
+        events = list(OutboxEvent.objects.filter(created__lte=created)[:batch])
+        published = dispatch_events(events)
+        self.stdout.write(
+            self.style.SUCCESS("Published %d of %d events" % (published, len(events)))
+        )
@@ -0,0 +1,26 @@
+"""Command to repair drifted member and online counters of groups"""
+
+from django.core.management.base import BaseCommand
+
+from ...models import Group
+
+
+class Command(BaseCommand):
+    help = "Recounts member and online counters of groups that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=500,
+            help="Number of groups to recount at once. Defaults to 500.",
+        )
+
+    def handle(self, *args, batch, **options):
+        group_ids = Group.objects.order_by("pk").values_list("pk", flat=True)
+        drifted = 0
+        for i in range(0, len(group_ids), batch):
+            ids = list(group_ids[i : i + batch])
+            drifted += Group.objects.filter(pk__in=ids).repair_counts()
+        style = self.style.SUCCESS if not drifted else self.style.WARNING
+        self.stdout.write(style("Repaired %d of %d groups" % (drifted, len(group_ids))))
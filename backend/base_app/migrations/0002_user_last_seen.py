@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="user",
+            name="user_status_idx",
+        ),
+        migrations.RemoveField(
+            model_name="user",
+            name="status",
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="last_seen",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="last seen"),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0003_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(
+                fields=["group", "-created", "-id"], name="group_msg_group_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pmessage",
+            index=models.Index(
+                fields=["chat", "-created", "-id"], name="pmsg_chat_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,167 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Exists
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_inbox(apps, schema_editor):
+    """
+    Creates inbox entries of existing chats and group members,
+    so read state of messages can be moved to them before it is dropped
+    """
+    Inbox = apps.get_model("base_app", "Inbox")
+    PChat = apps.get_model("base_app", "PChat")
+    PMessage = apps.get_model("base_app", "PMessage")
+    GroupMember = apps.get_model("base_app", "GroupMember")
+    GroupBan = apps.get_model("base_app", "GroupBan")
+    GroupMessage = apps.get_model("base_app", "GroupMessage")
+
+    latest = PMessage.objects.filter(chat=OuterRef("pk")).order_by("-created", "-id")
+    chats = PChat.objects.annotate(
+        activity=Coalesce(Subquery(latest.values("created")[:1]), F("created")),
+        last_msg_id=Subquery(latest.values("pk")[:1]),
+    ).values_list("pk", "from_user_id", "to_user_id", "activity", "last_msg_id")
+    Inbox.objects.bulk_create(
+        (
+            Inbox(
+                user_id=user_id,
+                chat_id=chat_id,
+                last_activity=activity,
+                last_message_id=msg_id,
+            )
+            for chat_id, user1, user2, activity, msg_id in chats.iterator()
+            for user_id in (user1, user2)
+        ),
+        batch_size=1000,
+    )
+
+    latest = GroupMessage.objects.filter(group=OuterRef("group_id")).order_by(
+        "-created", "-id"
+    )
+    banned = GroupBan.objects.filter(
+        group=OuterRef("group_id"), user=OuterRef("user_id")
+    )
+    members = (
+        GroupMember.objects.filter(~Exists(banned))
+        .annotate(
+            activity=Coalesce(
+                Subquery(latest.values("created")[:1]), F("group__created")
+            ),
+            last_msg_id=Subquery(latest.values("pk")[:1]),
+        )
+        .values_list("user_id", "group_id", "activity", "last_msg_id")
+    )
+    Inbox.objects.bulk_create(
+        (
+            Inbox(
+                user_id=user_id,
+                group_id=group_id,
+                last_activity=activity,
+                last_message_id=msg_id,
+            )
+            for user_id, group_id, activity, msg_id in members.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0004_message_order_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Inbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_activity", models.DateTimeField(verbose_name="last activity")),
+                (
+                    "last_message_id",
+                    models.BigIntegerField(null=True, verbose_name="last message id"),
+                ),
+                (
+                    "unread",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="unread messages count"
+                    ),
+                ),
+                (
+                    "pinned",
+                    models.BooleanField(default=False, verbose_name="is pinned"),
+                ),
+                ("muted", models.BooleanField(default=False, verbose_name="is muted")),
+                (
+                    "chat",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="base_app.pchat",
+                    ),
+                ),
+                (
+                    "group",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="base_app.group",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="inbox",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "inbox entries",
+                "ordering": ("-pinned", "-last_activity", "-id"),
+                "indexes": [
+                    models.Index(
+                        fields=["user", "-pinned", "-last_activity", "-id"],
+                        name="inbox_user_activity_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="inbox",
+            constraint=models.UniqueConstraint(
+                fields=("user", "chat"), name="unique_inbox_chat"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="inbox",
+            constraint=models.UniqueConstraint(
+                fields=("user", "group"), name="unique_inbox_group"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="inbox",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("chat__isnull", True), ("group__isnull", True), _connector="XOR"
+                ),
+                name="inbox_chat_or_group",
+            ),
+        ),
+        migrations.RunPython(fill_inbox, migrations.RunPython.noop),
+    ]
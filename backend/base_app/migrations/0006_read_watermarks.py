@@ -0,0 +1,127 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:20
+
+from django.db import migrations, models
+from django.db.models import F, Q, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def set_watermarks(apps, schema_editor):
+    """
+    Sets read watermarks of chat entries to the latest seen message of
+    the companion and counts unread messages after them. Groups had no
+    unread messages, so they are read up to the latest message.
+    Entries are created by the previous migration
+    """
+    Inbox = apps.get_model("base_app", "Inbox")
+    PChat = apps.get_model("base_app", "PChat")
+    PMessage = apps.get_model("base_app", "PMessage")
+
+    seen = (
+        PMessage.objects.filter(chat=OuterRef("chat"), seen=True)
+        .exclude(owner=OuterRef("user"))
+        .order_by("-created", "-id")
+    )
+    chat_created = PChat.objects.filter(pk=OuterRef("chat")).values("created")
+    Inbox.objects.filter(chat__isnull=False).update(
+        last_read=Coalesce(
+            Subquery(seen.values("created")[:1]), Subquery(chat_created)
+        ),
+        last_read_id=Subquery(seen.values("pk")[:1]),
+    )
+    after = Q(created__gt=OuterRef("last_read")) | Q(
+        created=OuterRef("last_read"), pk__gt=Coalesce(OuterRef("last_read_id"), 0)
+    )
+    unread = (
+        PMessage.objects.filter(after, chat=OuterRef("chat"))
+        .exclude(owner=OuterRef("user"))
+        .order_by()
+        .values("chat")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Inbox.objects.filter(chat__isnull=False).update(
+        unread=Coalesce(Subquery(unread), 0)
+    )
+    Inbox.objects.filter(group__isnull=False).update(
+        last_read=F("last_activity"), last_read_id=F("last_message_id"), unread=0
+    )
+    # run deferred checks of updated rows before the table is altered
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0005_inbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="inbox",
+            name="last_read",
+            field=models.DateTimeField(
+                null=True, verbose_name="last read message created"
+            ),
+        ),
+        migrations.AddField(
+            model_name="inbox",
+            name="last_read_id",
+            field=models.BigIntegerField(
+                null=True, verbose_name="last read message id"
+            ),
+        ),
+        migrations.RunPython(set_watermarks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="inbox",
+            name="last_read",
+            field=models.DateTimeField(verbose_name="last read message created"),
+        ),
+        migrations.RemoveIndex(
+            model_name="pmessage",
+            name="pmsg_seen_idx",
+        ),
+        migrations.RemoveField(
+            model_name="pmessage",
+            name="seen",
+        ),
+        migrations.RemoveField(
+            model_name="groupmessage",
+            name="seen",
+        ),
+        migrations.AlterField(
+            model_name="inbox",
+            name="chat",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="base_app.pchat",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="inbox",
+            name="group",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="base_app.group",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inbox",
+            index=models.Index(
+                fields=["chat", "last_read"], name="inbox_chat_read_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inbox",
+            index=models.Index(
+                fields=["group", "last_read"], name="inbox_group_read_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0006_read_watermarks"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector("content", config="simple"),
+                name="group_msg_content_search_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pmessage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector("content", config="simple"),
+                name="pmsg_content_search_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+
+PERMISSIONS = (
+    "send_msg",
+    "delete_msg",
+    "kick_user",
+    "add_user",
+    "ban_user",
+    "unban_user",
+    "edit_group",
+    "manage_role",
+)
+
+
+def set_permissions(apps, schema_editor):
+    """Sets permissions bitmask of roles from their permission flags"""
+    GroupRole = apps.get_model("base_app", "GroupRole")
+    bits = (
+        Case(When(**{perm: True}, then=Value(1 << i)), default=Value(0))
+        for i, perm in enumerate(PERMISSIONS)
+    )
+    GroupRole.objects.update(permissions=sum(bits, Value(0)))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0008_trigram_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="grouprole",
+            name="permissions",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="permissions bitmask"
+            ),
+        ),
+        migrations.RunPython(set_permissions, migrations.RunPython.noop),
+    ]
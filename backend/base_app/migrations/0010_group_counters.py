@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:10
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_member_counts(apps, schema_editor):
+    """
+    Sets member counters of groups to the number of members that are not
+    banned. Online counters are set by 'repair_group_counts' command
+    """
+    Group = apps.get_model("base_app", "Group")
+    GroupMember = apps.get_model("base_app", "GroupMember")
+    GroupBan = apps.get_model("base_app", "GroupBan")
+
+    bans = GroupBan.objects.filter(group=OuterRef("group"), user=OuterRef("user"))
+    count = (
+        GroupMember.objects.filter(group=OuterRef("pk"))
+        .exclude(Exists(bans))
+        .order_by()
+        .values("group")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Group.objects.update(member_count=Coalesce(Subquery(count), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0009_role_permissions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="member_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="members count"
+            ),
+        ),
+        migrations.AddField(
+            model_name="group",
+            name="online_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="online members count"
+            ),
+        ),
+        migrations.RunPython(set_member_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:00
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+import django.utils.timezone
+
+
+def set_last_activity(apps, schema_editor):
+    """Sets last activity of members to their latest message or joint date"""
+    GroupMember = apps.get_model("base_app", "GroupMember")
+    GroupMessage = apps.get_model("base_app", "GroupMessage")
+
+    latest = GroupMessage.objects.filter(
+        group=OuterRef("group"), owner=OuterRef("user")
+    ).order_by("-created")
+    GroupMember.objects.update(
+        last_activity=Greatest(Subquery(latest.values("created")[:1]), F("joint"))
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0010_group_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="groupmember",
+            name="last_activity",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="last activity"
+            ),
+        ),
+        migrations.RunPython(set_last_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="groupmember",
+            index=models.Index(
+                fields=["group", "-last_activity"], name="group_member_activity_idx"
+            ),
+        ),
+    ]
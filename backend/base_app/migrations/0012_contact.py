@@ -0,0 +1,85 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_contacts(apps, schema_editor):
+    """Adds contacts of members of existing chats"""
+    PChat = apps.get_model("base_app", "PChat")
+    Contact = apps.get_model("base_app", "Contact")
+
+    chats = PChat.objects.order_by().values_list("pk", "from_user_id", "to_user_id")
+    Contact.objects.bulk_create(
+        (
+            Contact(user_id=user1, contact_id=user2, chat_id=chat_id)
+            for chat_id, from_user, to_user in chats.iterator(chunk_size=2000)
+            for user1, user2 in ((from_user, to_user), (to_user, from_user))
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0011_member_last_activity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Contact",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "chat",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="base_app.pchat",
+                    ),
+                ),
+                (
+                    "contact",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        related_query_name="contacted",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="contacts",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["contact", "user"],
+                        include=("chat",),
+                        name="contact_reverse_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="contact",
+            constraint=models.UniqueConstraint(
+                fields=("user", "contact"), include=("chat",), name="unique_contact"
+            ),
+        ),
+        migrations.RunPython(add_contacts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.6 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0013_contact_fk_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxevent",
+            name="base_url",
+            field=models.CharField(
+                blank=True, default="", max_length=255, verbose_name="base url"
+            ),
+        ),
+    ]
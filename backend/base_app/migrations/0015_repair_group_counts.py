@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-19 15:40
+
+from itertools import chain
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+def repair_counts(apps, schema_editor):
+    """
+    Recounts member and online counters of groups from allowed members
+    and presence backend, online counters were left at zero since they
+    were added
+    """
+    from base_app.presence import presence
+
+    Group = apps.get_model("base_app", "Group")
+    GroupMember = apps.get_model("base_app", "GroupMember")
+    GroupBan = apps.get_model("base_app", "GroupBan")
+
+    bans = GroupBan.objects.filter(group=OuterRef("group"), user=OuterRef("user"))
+    rows = (
+        GroupMember.objects.exclude(Exists(bans))
+        .order_by()
+        .values_list("group_id", "user_id")
+    )
+    members = {}
+    for group_id, user_id in rows.iterator():
+        members.setdefault(group_id, []).append(user_id)
+    online = presence.online_ids(chain.from_iterable(members.values()))
+
+    groups = list(Group.objects.only("member_count", "online_count"))
+    for group in groups:
+        ids = members.get(group.pk, ())
+        group.member_count = len(ids)
+        group.online_count = len(online.intersection(ids))
+    Group.objects.bulk_update(groups, ["member_count", "online_count"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0014_outboxevent_base_url"),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.6 on 2026-10-19 16:05
+
+from django.db import migrations
+
+
+def reset_group_counters(apps, schema_editor):
+    """
+    Resets unread counters of group entries, unread group messages
+    are counted from read watermarks
+    """
+    Inbox = apps.get_model("base_app", "Inbox")
+    Inbox.objects.filter(group__isnull=False).exclude(unread=0).update(unread=0)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0015_repair_group_counts"),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_group_counters, migrations.RunPython.noop),
+    ]
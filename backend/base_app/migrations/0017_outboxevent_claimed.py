@@ -0,0 +1,19 @@
+# Generated by Django 4.2.6 on 2026-10-19 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("base_app", "0016_group_unread_from_watermarks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxevent",
+            name="claimed",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="claimed datetime"
+            ),
+        ),
+    ]
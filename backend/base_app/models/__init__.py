@@ -1,5 +1,5 @@
 from .user import User
-from .pchats import PChat, PMessage, MessageFile
+from .pchats import PChat, PMessage, MessageFile, Contact
 from .groups import (
     Group,
     GroupRole,
@@ -9,4 +9,6 @@ from .groups import (
     GroupMessageFile,
     UNIQUE_NAME_RE,
 )
+from .outbox import OutboxEvent
 from .utils import FILE_TYPES
+from .inbox import Inbox
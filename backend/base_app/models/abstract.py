@@ -1,17 +1,32 @@
 """Common abstract models"""
 
 import os
+import logging
 from mutagen import File
 
 from django.db import models
-from django.db.models import Prefetch, Value
-from django.db.models.functions import Concat
+from django.db.models import Prefetch, Value, Case, When, Exists, OuterRef, F
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models.functions import Concat, Cast
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
 from .utils import get_file_type, AUDIO_EXTS
 
 
+logger = logging.getLogger(__name__)
+
+
+# Text search configuration of message content.
+# 'simple' does not stem words, so it fits messages of any language
+SEARCH_CONFIG = "simple"
+
+
+def content_vector() -> SearchVector:
+    """Returns text search vector of message content used by GIN indexes"""
+    return SearchVector("content", config=SEARCH_CONFIG)
+
+
 class MessageQuerySet(models.QuerySet):
     """Abstract class for message querysets"""
 
@@ -21,6 +36,57 @@ class MessageQuerySet(models.QuerySet):
             owner_name=Concat("owner__first_name", Value(" "), "owner__last_name")
         )
 
+    def annotate_seen(self, user=None):
+        """
+        Annotates whether messages are seen, i.e. read watermark of another
+        member is not before a message. If user is given, messages of others
+        are seen if they are read by the user
+        """
+        from .inbox import Inbox
+
+        field = self.model.inbox_field
+        read = Inbox.objects.filter(
+            **{field: OuterRef(field), "last_read__gte": OuterRef("created")}
+        )
+        seen = Exists(read.exclude(user=OuterRef("owner")))
+        if user is not None:
+            seen = Case(
+                When(owner=user, then=seen),
+                default=Exists(read.filter(user=user)),
+            )
+        return self.annotate(seen=seen)
+
+    def search(self, query: str):
+        """
+        Filters messages matching web search style query
+        and annotates their rank
+        """
+        query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        # rank is cast from real to keep it exact in pagination cursors
+        rank = Cast(SearchRank(F("vector"), query), models.FloatField())
+        return (
+            self.alias(vector=content_vector()).filter(vector=query).annotate(rank=rank)
+        )
+
+    def filter_search(
+        self, sender=None, since=None, until=None, has_file=False, file_type=None
+    ):
+        """Filters searched messages by sender, date range and files"""
+        qs = self
+        if sender is not None:
+            qs = qs.filter(owner_id=sender)
+        if since is not None:
+            qs = qs.filter(created__gte=since)
+        if until is not None:
+            qs = qs.filter(created__lt=until)
+        if has_file or file_type:
+            file_model = self.model.files.rel.related_model
+            files = file_model.objects.filter(message=OuterRef("pk"))
+            if file_type:
+                files = files.filter(file_type=file_type)
+            qs = qs.filter(Exists(files))
+        return qs
+
     def prefetch_files(self):
         """Prefetches message files"""
         return self.prefetch_related(Prefetch("files", to_attr="_cached_files"))
@@ -35,9 +101,10 @@ class MessageManager(models.Manager):
     def annotate_owner_name(self):
         return self.get_queryset().annotate_owner_name()
 
-    def common_fetch(self):
-        """Base common fetch method for messages"""
-        return self.get_queryset().prefetch_files().annotate_owner_name()
+    def common_fetch(self, user=None):
+        """Base common fetch method for messages seen by user"""
+        qs = self.get_queryset().prefetch_files().annotate_owner_name()
+        return qs.annotate_seen(user)
 
 
 class MessageBase(models.Model):
@@ -53,12 +120,14 @@ class MessageBase(models.Model):
         verbose_name=_("Message owner"),
     )
     content = models.TextField(_("Message content"), blank=True, null=True)
-    seen = models.BooleanField(default=False)
     created = models.DateTimeField(editable=False)
     edited = models.DateTimeField(editable=False)
 
     objects = MessageManager()
 
+    # name of chat or group field that inbox entries refer to
+    inbox_field: str = None
+
     class Meta:
         abstract = True
         ordering = ("-created",)
@@ -114,7 +183,10 @@ class MessageFileBase(models.Model):
                 tags = audio.tags
                 title = tags.get("title", [None])[0]
                 author = (tags.get("artist") or tags.get("author") or [None])[0]
-            except Exception as e:
-                print(e)
+            except Exception:
+                # metadata is optional, the file is still saved without it
+                logger.warning(
+                    "Failed to read audio metadata of %s", file.name, exc_info=True
+                )
             metadata.update({"title": title, "author": author, "duration": duration})
         self.metadata = metadata
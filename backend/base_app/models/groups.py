@@ -1,23 +1,46 @@
 """Group related modules"""
 
 import os
-from uuid import uuid4
+from datetime import timedelta
 from itertools import chain
+from uuid import uuid4
 
 
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.indexes import GinIndex
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q, F, Prefetch, Count
+from django.db.models import (
+    Q,
+    F,
+    Prefetch,
+    Count,
+    Subquery,
+    OuterRef,
+    Exists,
+    Value,
+    ExpressionWrapper,
+)
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.core.exceptions import ValidationError
-from django.db.models.functions import Lower
+from django.db.models.functions import Lower, Greatest
 from django.dispatch import receiver
 from django.core.validators import MaxValueValidator, MinLengthValidator
 
 
-from .abstract import MessageBase, MessageFileBase
-from .utils import MessageFilePath, FILE_VALIDATOR, delete_file, delete_old_file
+from ..presence import presence
+from ..cache import group_members, group_roles, member_activity
+from .abstract import MessageBase, MessageFileBase, content_vector
+from .utils import (
+    MessageFilePath,
+    FILE_VALIDATOR,
+    delete_file,
+    delete_old_file,
+    trigram_index,
+    search_exps,
+)
+from .user import USER_SEARCH_FIELDS
 
 
 # Unique identifier name regex pattern
@@ -35,32 +58,94 @@ class GroupQuerySet(models.QuerySet):
         exp = Q(public=False) | Q(pk__any=user.all_groups.values("pk").order_by())
         qs = self.exclude(exp)
         if query:
-            exp = Q(unique_name__icontains=query) | Q(name__icontains=query)
+            fields = ["unique_name", "name"]
+            exp, priority, similarity = search_exps(query, fields, fields)
             qs = (
-                qs.alias(
-                    group_order=(
-                        Q(unique_name__istartswith=query) | Q(name__istartswith=query)
-                    )
-                )
+                qs.alias(group_order=priority, similarity=similarity)
                 .filter(exp)
-                .order_by("-group_order", "unique_name")
+                .order_by("-group_order", "-similarity", "unique_name")
             )
         return qs
 
     def prefetch_latest(self):
-        """Prefetches latest message for groups"""
-        qs = GroupMessage.objects.annotate_owner_name().order_by("-created")
+        """
+        Prefetches only the latest message of each group as 'latest' list.
+        Sliced prefetch is fetched with a window function per group
+        """
+        qs = (
+            GroupMessage.objects.annotate_owner_name()
+            .annotate_seen()
+            .order_by("-created", "-id")
+        )
         return self.prefetch_related(
-            Prefetch("messages", queryset=qs, to_attr="latest")
+            Prefetch("messages", queryset=qs[:1], to_attr="latest")
+        )
+
+    def annotate_unread(self, user):
+        """
+        Annotates unread messages count for a user, counted after
+        read watermark of user inbox entry
+        """
+        from .inbox import Inbox, unread_messages
+
+        entry = Inbox.objects.filter(user=user, group=OuterRef("pk"))
+        count = unread_messages(GroupMessage)
+        return self.annotate(unread=Subquery(entry.values(count=count)))
+
+    def shift_counts(self, members: int = 0, online: int = 0) -> int:
+        """Shifts member and online counters of groups, never below zero"""
+        return self.update(
+            member_count=Greatest(F("member_count") + members, 0),
+            online_count=Greatest(F("online_count") + online, 0),
         )
 
-    def annotate_count(self):
-        """Annotates members and online people count for groups"""
-        return self.annotate(
-            members_count=Count("members"),
-            online_count=Count("people", filter=Q(people__status__gt=0)),
+    def shift_online(self, user_ids, delta: int) -> int:
+        """
+        Shifts online counters of groups of users that came online (delta=1)
+        or went offline (delta=-1) by the number of those users allowed in
+        each group
+        """
+        members = GroupMember.objects.allowed().filter(user_id__in=user_ids)
+        count = (
+            members.filter(group=OuterRef("pk"))
+            .order_by()
+            .values("group")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return self.filter(pk__in=members.values("group")).update(
+            online_count=Greatest(F("online_count") + delta * Subquery(count), 0)
         )
 
+    def repair_counts(self) -> int:
+        """
+        Recounts member and online counters of groups from allowed members
+        and presence backend. Groups are locked while they are recounted, so
+        concurrent shifts are applied after repair.
+        Returns the number of groups whose counters drifted
+        """
+        with transaction.atomic():
+            groups = list(self.select_for_update().only("member_count", "online_count"))
+            members = {}
+            rows = (
+                GroupMember.objects.allowed()
+                .filter(group__in=groups)
+                .order_by()
+                .values_list("group_id", "user_id")
+            )
+            for group_id, user_id in rows:
+                members.setdefault(group_id, []).append(user_id)
+            online = presence.online_ids(chain.from_iterable(members.values()))
+            drifted = []
+            for group in groups:
+                ids = members.get(group.pk, ())
+                counts = (len(ids), len(online.intersection(ids)))
+                if counts != (group.member_count, group.online_count):
+                    group.member_count, group.online_count = counts
+                    drifted.append(group)
+            self.model.objects.bulk_update(drifted, Group.COUNTER_FIELDS)
+        return len(drifted)
+
 
 class GroupManager(models.Manager):
     """Group manager"""
@@ -70,11 +155,16 @@ class GroupManager(models.Manager):
 
     def search_groups(self, query: str, user):
         """Searches public groups"""
-        return self.get_queryset().annotate_count().search_groups(query, user)
+        return self.get_queryset().search_groups(query, user)
+
+    def shift_online(self, user_ids, delta: int) -> int:
+        """Shifts online counters of groups of users"""
+        return self.get_queryset().shift_online(user_ids, delta)
 
-    def common_fetch(self):
-        """Common fetch for groups"""
-        return self.get_queryset().annotate_count().prefetch_latest()
+    def common_fetch(self, user=None):
+        """Common fetch for groups, annotates unread messages if user is given"""
+        qs = self.get_queryset().prefetch_latest()
+        return qs if user is None else qs.annotate_unread(user)
 
 
 def group_photo_path(group: "Group", fname: str):
@@ -114,6 +204,16 @@ class Group(models.Model):
     created = models.DateTimeField(_("group created"), auto_now_add=True)
     edited = models.DateTimeField(_("group edited"), auto_now=True)
 
+    # counters of allowed members and online ones, shifted by membership
+    # and batched presence changes and repaired by 'repair_group_counts'
+    # command
+    member_count = models.PositiveIntegerField(
+        _("members count"), default=0, editable=False
+    )
+    online_count = models.PositiveIntegerField(
+        _("online members count"), default=0, editable=False
+    )
+
     objects = GroupManager()
 
     people = models.ManyToManyField(
@@ -155,10 +255,25 @@ class Group(models.Model):
             models.Index(F("created").desc(), name="group_created_idx"),
             # Indexing group public flag to speed up public groups searching
             models.Index(F("public").desc(), name="group_public_idx"),
+            # Indexing group names with trigrams to speed up searching
+            trigram_index("unique_name", "name", name="group_name_trgm_idx"),
         ]
         # ordering groups by created date by default
         ordering = ("-created",)
 
+    # counters updated only by queries
+    COUNTER_FIELDS = ("member_count", "online_count")
+
+    def save(self, *args, **kwargs):
+        """Saves group without overwriting counters of existing groups"""
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def type(self):
         return "group"
@@ -191,28 +306,35 @@ class Group(models.Model):
     @property
     def online_people(self):
         """Allowed online people queryset"""
-        return self.allowed_people.filter(status__gt=0)
+        return self.allowed_people.filter(pk__in=self.online_ids)
 
     @property
-    def online_ids(self):
+    def online_ids(self) -> set:
         """Allowed online people ids"""
-        return self.online_people.values_list("pk", flat=True)
+        return presence.online_ids(self.allowed_people.values_list("pk", flat=True))
+
+    @staticmethod
+    def search_people_exps(query: str) -> tuple:
+        """Returns search expressions of query over related user names"""
+        fields = ["user__" + field for field in USER_SEARCH_FIELDS]
+        return search_exps(query, fields, fields[:2])
 
     def search_member(self, query: str):
         """Search group members"""
+        exp, priority, similarity = self.search_people_exps(query)
         return (
-            self.allowed_members.filter(
-                Q(user__username__icontains=query)
-                | Q(user__first_name__icontains=query)
-                | Q(user__last_name__icontains=query)
-            )
-            .alias(
-                member_order=(
-                    Q(user__username__istartswith=query)
-                    | Q(user__first_name__istartswith=query)
-                )
-            )
-            .order_by("-member_order", "user__first_name")
+            self.allowed_members.filter(exp)
+            .alias(member_order=priority, similarity=similarity)
+            .order_by("-member_order", "-similarity", "user__first_name")
+        )
+
+    def search_ban(self, query: str):
+        """Search banned users of group"""
+        exp, priority, similarity = self.search_people_exps(query)
+        return (
+            self.bans.filter(exp)
+            .alias(q_priority=priority, similarity=similarity)
+            .order_by("-q_priority", "-similarity", "user__username")
         )
 
     def setup_group(self):
@@ -313,24 +435,42 @@ class Group(models.Model):
         except Exception:
             return False
 
-    def defer_member_qs(self, perms=None) -> models.QuerySet:
-        """Retrieve only given and specific role permissions"""
-        qs = self.members.select_related("role")
-        if perms is None:
-            qs = qs.defer("joint", "added_by")
-        else:
-            perms = set(chain(GroupRole.SPECIAL_PROPS, perms or []))
-            qs = qs.only("group", "user", *("role__%s" % p for p in perms))
-        return qs
+    @cached_property
+    def role_memo(self) -> dict:
+        """
+        Member roles by user ids memoized for the lifetime of the instance,
+        i.e. for a request or a WebSocket event
+        """
+        return {}
+
+    def get_member_roles(self, *users) -> dict:
+        """
+        Returns roles of members by user ids, skipping non members.
+        Roles are looked up in the instance memo, then in the shared cache
+        """
+        memo = self.role_memo
+        user_ids = {getattr(user, "pk", user) for user in users}
+        missing = [user_id for user_id in user_ids if user_id not in memo]
+        group_roles.memo_stats.hits += len(user_ids) - len(missing)
+        if missing:
+            group_roles.memo_stats.misses += len(missing)
+            memo.update(group_roles.get_many(self.pk, missing))
+        return {user_id: memo[user_id] for user_id in user_ids if memo[user_id]}
 
     def get_user_role(self, user_id, perms=None) -> "GroupRole":
-        """Get user role with given permissions"""
-        return self.defer_member_qs(perms).get(user_id=user_id).role
+        """
+        Get user role. Roles are cached with all permissions,
+        perms are accepted for compatibility
+        """
+        user_id = getattr(user_id, "pk", user_id)
+        role = self.get_member_roles(user_id).get(user_id)
+        if role is None:
+            raise GroupMember.DoesNotExist("User is not a member of the group")
+        return role
 
     def get_user_roles(self, user1, user2, perms=None):
-        """Get users roles with given permissions"""
-        qs = self.defer_member_qs(perms).filter(user_id__in=[user1, user2])
-        return {member.user_id: member.role for member in qs}
+        """Get users roles by their ids"""
+        return self.get_member_roles(user1, user2)
 
     def has_perm_over(self, user1, user2, perm: str) -> bool:
         """Check whether user1 has permission and priority over user2"""
@@ -361,8 +501,7 @@ class Group(models.Model):
                 ],
             )
             return user_role.has_perm_over(role, perm)
-        except Exception as e:
-            print(e)
+        except GroupMember.DoesNotExist:
             return False
 
     def has_perm(self, user_id, perm: str) -> bool:
@@ -398,6 +537,21 @@ class GroupRole(models.Model):
 
     # special role properties list
     SPECIAL_PROPS = ("is_default", "is_owner", "priority", "super_admin")
+    # role permissions list
+    PERMISSIONS = (
+        "send_msg",
+        "delete_msg",
+        "kick_user",
+        "add_user",
+        "ban_user",
+        "unban_user",
+        "edit_group",
+        "manage_role",
+    )
+    # bits of role permissions in permissions bitmask
+    PERMISSION_BITS = {perm: 1 << i for i, perm in enumerate(PERMISSIONS)}
+    # fields of compact role records in caches
+    RECORD_FIELDS = ("id", "name", *SPECIAL_PROPS, "permissions")
 
     name = models.CharField(_("group role"), max_length=50)
     group = models.ForeignKey(
@@ -423,6 +577,10 @@ class GroupRole(models.Model):
     unban_user = models.BooleanField(_("can unban user"), default=False)
     edit_group = models.BooleanField(_("can edit group"), default=False)
     manage_role = models.BooleanField(_("can manage role"), default=False)
+    # bitmask of permissions above, synced on save
+    permissions = models.PositiveIntegerField(
+        _("permissions bitmask"), default=0, editable=False
+    )
 
     # has all the permissions
     super_admin = models.BooleanField(_("is super admin"), default=False)
@@ -468,6 +626,49 @@ class GroupRole(models.Model):
         ]
         ordering = ("-id",)
 
+    @classmethod
+    def from_record(cls, group_id, record) -> "GroupRole":
+        """Builds group role from compact record of RECORD_FIELDS"""
+        data = dict(zip(cls.RECORD_FIELDS, record), group_id=group_id)
+        data.update(cls.unpack_permissions(data["permissions"]))
+        names = [f.attname for f in cls._meta.concrete_fields if f.attname in data]
+        return cls.from_db(None, names, [data[name] for name in names])
+
+    @classmethod
+    def unpack_permissions(cls, permissions: int) -> dict:
+        """Returns permission flags of permissions bitmask"""
+        return {
+            perm: bool(permissions & bit) for perm, bit in cls.PERMISSION_BITS.items()
+        }
+
+    @classmethod
+    def perm_q(cls, perm: str, prefix: str = "") -> Q:
+        """
+        Returns filter of roles that have given permission.
+        It is 'has_perm' evaluated in SQL, prefix is the lookup path of role
+        """
+        exp = Q(**{prefix + "super_admin": True}) | Q(**{prefix + "is_owner": True})
+        bit = cls.PERMISSION_BITS.get(perm)
+        if bit is not None:
+            exp |= Q(**{prefix + "permissions__hasbits": bit})
+        return exp
+
+    def pack_permissions(self) -> int:
+        """Returns permissions bitmask of permission flags"""
+        return sum(
+            bit for perm, bit in self.PERMISSION_BITS.items() if getattr(self, perm)
+        )
+
+    def save(self, *args, **kwargs):
+        """Saves role syncing permissions bitmask with permission flags"""
+        self.permissions = self.pack_permissions()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not set(self.PERMISSIONS).isdisjoint(
+            update_fields
+        ):
+            kwargs["update_fields"] = {*update_fields, "permissions"}
+        super().save(*args, **kwargs)
+
     @property
     def is_special(self):
         """Indicates whether role is special"""
@@ -514,7 +715,8 @@ class GroupRole(models.Model):
 
     def has_perm(self, perm: str) -> bool:
         """Check whether role has given permission"""
-        return getattr(self, perm, False) or self.super_admin or self.is_owner
+        bit = self.PERMISSION_BITS.get(perm, 0)
+        return bool(self.permissions & bit) or self.super_admin or self.is_owner
 
     def has_priority_over(self, role: "GroupRole") -> bool:
         """Check whether role has priority over given role"""
@@ -554,6 +756,56 @@ def on_role_delete(sender, instance: GroupRole, origin, **kwargs):
     instance.members.update(role=instance.group.default_role)
 
 
+@receiver(models.signals.post_save, sender=GroupRole)
+@receiver(models.signals.post_delete, sender=GroupRole)
+def on_role_change(sender, instance: GroupRole, created=False, **kwargs):
+    """Invalidates cached member roles of group after role is changed"""
+    if created:
+        # new roles have no members yet
+        return
+    group_id = instance.group_id
+    transaction.on_commit(lambda: group_roles.invalidate_group(group_id))
+
+
+class GroupMemberQuerySet(models.QuerySet):
+    """Group member queryset class"""
+
+    # capability flags with their permissions
+    CAPABILITIES = {
+        "can_kick": "kick_user",
+        "can_ban": "ban_user",
+        "can_manage_role": "manage_role",
+    }
+
+    def annotate_capabilities(self, role: "GroupRole" = None):
+        """
+        Annotates whether a viewer with the role can kick, ban or manage
+        role of each member. It is 'GroupRole.has_perm_over' evaluated in SQL
+        against member roles. Viewers without role have no capabilities
+        """
+        over = ~Q(role__is_owner=True)
+        if role is not None and not role.is_owner:
+            over &= Q(role__priority__gt=role.priority)
+        flags = {}
+        for name, perm in self.CAPABILITIES.items():
+            if role is not None and role.has_perm(perm):
+                flags[name] = ExpressionWrapper(
+                    over, output_field=models.BooleanField()
+                )
+            else:
+                flags[name] = Value(False)
+        return self.annotate(**flags)
+
+    def with_perm(self, perm: str):
+        """Filters members whose role has given permission"""
+        return self.filter(GroupRole.perm_q(perm, "role__"))
+
+    def allowed(self):
+        """Filters members that are not banned"""
+        bans = GroupBan.objects.filter(group=OuterRef("group"), user=OuterRef("user"))
+        return self.exclude(Exists(bans))
+
+
 class GroupMember(models.Model):
     """Group members model"""
 
@@ -573,6 +825,13 @@ class GroupMember(models.Model):
         related_name="added_members",
     )
     joint = models.DateTimeField(auto_now_add=True)
+    # time of the latest message of member or joint date, throttled
+    last_activity = models.DateTimeField(_("last activity"), default=timezone.now)
+
+    objects = GroupMemberQuerySet.as_manager()
+
+    # minimal interval between last activity writes of a member
+    ACTIVITY_THROTTLE = timedelta(minutes=1)
 
     class Meta:
         constraints = [
@@ -592,12 +851,16 @@ class GroupMember(models.Model):
         indexes = [
             # Indexing user joint date to speed up ordering by joint date
             models.Index(F("joint").desc(), name="group_joint_date_idx"),
+            # Indexing member activity to speed up ordering members of group
+            models.Index(
+                fields=["group", "-last_activity"], name="group_member_activity_idx"
+            ),
         ]
         ordering = ("-joint",)
 
     def save(self, *args, **kwargs):
         # set default role if role is not specified
-        if not self.role:
+        if self.role_id is None:
             self.role = self.group.default_role
         super().save(*args, **kwargs)
 
@@ -678,15 +941,83 @@ class GroupBan(models.Model):
         return reverse(name, kwargs={"group_pk": self.group_id, "pk": self.pk})
 
 
+@receiver(models.signals.post_save, sender=GroupMember)
+@receiver(models.signals.post_delete, sender=GroupMember)
+@receiver(models.signals.post_save, sender=GroupBan)
+@receiver(models.signals.post_delete, sender=GroupBan)
+def on_membership_change(sender, instance, **kwargs):
+    """Invalidates cached group members after membership is changed"""
+    group_id = instance.group_id
+    transaction.on_commit(lambda: group_members.invalidate(group_id))
+
+
+def shift_group_counts(group_id, user_id, delta: int):
+    """Shifts counters of group after user is allowed (1) or disallowed (-1)"""
+    online = delta if presence.is_online(user_id) else 0
+    Group.objects.filter(pk=group_id).shift_counts(delta, online)
+
+
+@receiver(models.signals.post_save, sender=GroupMember)
+def on_member_join(sender, instance: GroupMember, created, **kwargs):
+    """Counts joined member if they are not banned"""
+    if not created:
+        return
+    group_id, user_id = instance.group_id, instance.user_id
+    if not GroupBan.objects.filter(group_id=group_id, user_id=user_id).exists():
+        shift_group_counts(group_id, user_id, 1)
+
+
+@receiver(models.signals.post_delete, sender=GroupMember)
+def on_member_leave(sender, instance: GroupMember, **kwargs):
+    """Uncounts left member if they were not banned"""
+    group_id, user_id = instance.group_id, instance.user_id
+    if not GroupBan.objects.filter(group_id=group_id, user_id=user_id).exists():
+        shift_group_counts(group_id, user_id, -1)
+
+
+@receiver(models.signals.post_save, sender=GroupBan)
+def on_ban(sender, instance: GroupBan, created, **kwargs):
+    """Uncounts banned user if they are a member"""
+    if not created:
+        return
+    group_id, user_id = instance.group_id, instance.user_id
+    if GroupMember.objects.filter(group_id=group_id, user_id=user_id).exists():
+        shift_group_counts(group_id, user_id, -1)
+
+
+@receiver(models.signals.post_delete, sender=GroupBan)
+def on_unban(sender, instance: GroupBan, **kwargs):
+    """Counts unbanned user if they are a member"""
+    group_id, user_id = instance.group_id, instance.user_id
+    if GroupMember.objects.filter(group_id=group_id, user_id=user_id).exists():
+        shift_group_counts(group_id, user_id, 1)
+
+
+@receiver(models.signals.post_save, sender=GroupMember)
+@receiver(models.signals.post_delete, sender=GroupMember)
+def on_member_role_change(sender, instance: GroupMember, **kwargs):
+    """Invalidates cached role of member after member is changed"""
+    group_id, user_id = instance.group_id, instance.user_id
+    transaction.on_commit(lambda: group_roles.invalidate(group_id, user_id))
+
+
 class GroupMessage(MessageBase):
     """Group message model"""
 
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="messages")
 
+    inbox_field = "group"
+
     class Meta(MessageBase.Meta):
         indexes = [
             # Indexing message created date to speed up ordering
             models.Index(F("created").desc(), name="group_msg_created_idx"),
+            # Indexing group messages order for keyset pagination
+            models.Index(
+                fields=["group", "-created", "-id"], name="group_msg_group_created_idx"
+            ),
+            # Indexing message content for full-text search
+            GinIndex(content_vector(), name="group_msg_content_search_idx"),
         ]
 
     def __str__(self) -> str:
@@ -701,6 +1032,25 @@ class GroupMessage(MessageBase):
         return reverse(name, kwargs={"group_pk": self.group_id, "pk": self.pk})
 
 
+@receiver(models.signals.post_save, sender=GroupMessage)
+def on_message_create(sender, instance: GroupMessage, created, **kwargs):
+    """
+    Updates last activity of message owner. Members that were active
+    within ACTIVITY_THROTTLE are skipped by the cache throttle first,
+    so hot senders don't write on every message
+    """
+    throttle = GroupMember.ACTIVITY_THROTTLE
+    if not created or not member_activity.allow(
+        instance.group_id, instance.owner_id, throttle
+    ):
+        return
+    GroupMember.objects.filter(
+        group_id=instance.group_id,
+        user_id=instance.owner_id,
+        last_activity__lt=instance.created - throttle,
+    ).update(last_activity=instance.created)
+
+
 # Path to store group message files
 message_file_path = MessageFilePath("group_media", "message.group_id")
 
@@ -0,0 +1,429 @@
+"""Per-user inbox of chats and groups"""
+
+from django.db import models
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from django.db.models import (
+    Q,
+    F,
+    Case,
+    When,
+    Count,
+    Value,
+    Exists,
+    OuterRef,
+    Subquery,
+)
+from django.db.models.functions import Coalesce, Greatest
+
+from .pchats import PChat, PMessage
+from .groups import Group, GroupMember, GroupBan, GroupMessage
+
+
+def unread_messages(model, last_read=None, last_read_id=None) -> Coalesce:
+    """
+    Subquery to count messages of others in entry chat or group
+    after given read watermark. Defaults to watermark of the entry
+    """
+    if last_read is None:
+        last_read, last_read_id = OuterRef("last_read"), OuterRef("last_read_id")
+    field = model.inbox_field
+    after = Q(created__gt=last_read) | Q(
+        created=last_read, pk__gt=Coalesce(last_read_id, 0)
+    )
+    messages = (
+        model.objects.filter(after, ~Q(owner=OuterRef("user")))
+        .filter(**{field: OuterRef(field)})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(messages), 0)
+
+
+def unread_count() -> Case:
+    """
+    Unread counter of an entry. Only private chats keep counters,
+    unread group messages are counted from read watermarks
+    """
+    return Case(
+        When(chat__isnull=False, then=unread_messages(PMessage)),
+        default=Value(0),
+    )
+
+
+class InboxQuerySet(models.QuerySet):
+    """Inbox queryset class"""
+
+    def chats(self):
+        return self.filter(chat__isnull=False)
+
+    def groups(self):
+        return self.filter(group__isnull=False)
+
+    def before(self, msg):
+        """Filters entries with read watermark before message"""
+        return self.filter(
+            Q(last_read__lt=msg.created)
+            | Q(last_read=msg.created, last_read_id__lt=msg.pk)
+            | Q(last_read=msg.created, last_read_id__isnull=True)
+        )
+
+    def mark_read(self, count: int):
+        """Decrements unread counters by number of read messages"""
+        return self.update(unread=Greatest(F("unread") - count, 0))
+
+    def annotate_unread_count(self):
+        """Annotates count of unread messages after read watermarks"""
+        return self.annotate(unread_count=unread_count())
+
+
+class InboxManager(models.Manager):
+    """
+    Inbox manager class.
+    Inbox rows are maintained by signal receivers below, rows expected
+    from messages and memberships are used to backfill and check them.
+    """
+
+    def get_queryset(self) -> InboxQuerySet:
+        return InboxQuerySet(self.model, using=self._db)
+
+    def read(self, user, msg) -> int:
+        """
+        Moves user read watermark of message chat or group up to the message
+        and recounts unread messages of chat after it.
+        Returns number of updated rows
+        """
+        field = msg.inbox_field + "_id"
+        entries = self.filter(user=user, **{field: getattr(msg, field)})
+        changes = {"last_read": msg.created, "last_read_id": msg.pk}
+        if isinstance(msg, PMessage):
+            changes["unread"] = unread_messages(PMessage, msg.created, msg.pk)
+        return entries.before(msg).update(**changes)
+
+    def expected_chats(self, user_ids) -> list:
+        """Returns expected chat rows of given users"""
+
+        latest = PMessage.objects.filter(chat=OuterRef("pk")).order_by(
+            "-created", "-id"
+        )
+        chats = (
+            PChat.objects.filter(Q(from_user__in=user_ids) | Q(to_user__in=user_ids))
+            .annotate(
+                last_activity=Coalesce(
+                    Subquery(latest.values("created")[:1]), F("created")
+                ),
+                last_message_id=Subquery(latest.values("pk")[:1]),
+            )
+            .values_list(
+                "pk", "from_user_id", "to_user_id", "last_activity", "last_message_id"
+            )
+            .order_by()
+        )
+        user_ids = set(user_ids)
+        return [
+            self.model(
+                user_id=user_id,
+                chat_id=chat_id,
+                last_activity=activity,
+                last_message_id=msg_id,
+                last_read=activity,
+                last_read_id=msg_id,
+            )
+            for chat_id, user1, user2, activity, msg_id in chats
+            for user_id in (user1, user2)
+            if user_id in user_ids
+        ]
+
+    def expected_groups(self, user_ids) -> list:
+        """Returns expected group rows of given users"""
+
+        latest = GroupMessage.objects.filter(group=OuterRef("group_id")).order_by(
+            "-created", "-id"
+        )
+        banned = GroupBan.objects.filter(
+            group=OuterRef("group_id"), user=OuterRef("user_id")
+        )
+        members = (
+            GroupMember.objects.filter(~Exists(banned), user__in=user_ids)
+            .annotate(
+                group_activity=Coalesce(
+                    Subquery(latest.values("created")[:1]), F("group__created")
+                ),
+                last_message_id=Subquery(latest.values("pk")[:1]),
+            )
+            .values_list("user_id", "group_id", "group_activity", "last_message_id")
+            .order_by()
+        )
+        return [
+            self.model(
+                user_id=user_id,
+                group_id=group_id,
+                last_activity=activity,
+                last_message_id=msg_id,
+                last_read=activity,
+                last_read_id=msg_id,
+            )
+            for user_id, group_id, activity, msg_id in members
+        ]
+
+    def diff(self, user_ids) -> tuple[list, list, list]:
+        """
+        Compares inbox rows of given users with expected ones.
+        Returns lists of missing (expected rows), stale and orphan rows
+        """
+        expected = {
+            row.key: row
+            for row in self.expected_chats(user_ids) + self.expected_groups(user_ids)
+        }
+        missing, stale, orphan = [], [], []
+        for row in self.filter(user__in=user_ids).annotate_unread_count():
+            exp_row = expected.pop(row.key, None)
+            if exp_row is None:
+                orphan.append(row)
+            elif exp_row.state != row.state or row.unread != row.unread_count:
+                stale.append(row)
+        missing.extend(expected.values())
+        return missing, stale, orphan
+
+    def rebuild(self, user_ids) -> int:
+        """
+        Rebuilds inbox rows of given users from their chats and groups
+        keeping read watermarks, pinned and muted flags. Missing rows are
+        read up to the latest message. Returns the number of written rows
+        """
+        chats = self.expected_chats(user_ids)
+        groups = self.expected_groups(user_ids)
+        update_fields = ["last_activity", "last_message_id"]
+        self.bulk_create(
+            chats,
+            update_conflicts=True,
+            unique_fields=["user", "chat"],
+            update_fields=update_fields,
+        )
+        self.bulk_create(
+            groups,
+            update_conflicts=True,
+            unique_fields=["user", "group"],
+            update_fields=update_fields,
+        )
+        entries = self.filter(user__in=user_ids)
+        # drop rows of chats and groups that are not available anymore
+        keys = {row.key for row in chats + groups}
+        orphans = [row.pk for row in entries if row.key not in keys]
+        self.filter(pk__in=orphans).delete()
+        entries.update(unread=unread_count())
+        return len(chats) + len(groups)
+
+    def add_group(self, user_id, group_id):
+        """
+        Adds group to user inbox if user is a not banned member.
+        Group messages sent before joining are considered read
+        """
+        self.add_group_members([user_id], group_id)
+
+    def add_group_members(self, user_ids, group_id):
+        """
+        Adds group to inboxes of given users that are not banned members.
+        Used for members created in bulk, because bulk creation doesn't
+        send signals
+        """
+
+        banned = GroupBan.objects.filter(group_id=group_id, user_id=OuterRef("user_id"))
+        members = GroupMember.objects.filter(
+            ~Exists(banned), group_id=group_id, user_id__in=user_ids
+        ).values_list("user_id", flat=True)
+        members = list(members)
+        if not members:
+            return
+        group = Group.objects.only("created").get(pk=group_id)
+        msg_id, activity = latest_message(group.messages, group.created)
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    group_id=group_id,
+                    last_activity=activity,
+                    last_message_id=msg_id,
+                    last_read=activity,
+                    last_read_id=msg_id,
+                )
+                for user_id in members
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def latest_message(messages, default) -> tuple:
+    """Returns id and creation date of the latest message, or default date"""
+    latest = messages.order_by("-created", "-id").values_list("pk", "created")
+    return latest.first() or (None, default)
+
+
+class Inbox(models.Model):
+    """
+    Inbox entry of a user chat or group.
+    Holds last activity, last message id and unread messages count
+    to list all user chats with a single index scan.
+    Messages up to the read watermark (last read message) are read.
+    Unread messages are counted only for private chats, group messages
+    would update the counters of all group members.
+    """
+
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="inbox")
+    chat = models.ForeignKey(
+        PChat,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_index=False,
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_index=False,
+    )
+    last_activity = models.DateTimeField(_("last activity"))
+    last_message_id = models.BigIntegerField(_("last message id"), null=True)
+    # read watermark
+    last_read = models.DateTimeField(_("last read message created"))
+    last_read_id = models.BigIntegerField(_("last read message id"), null=True)
+    # unread messages count of private chats, zero for groups
+    unread = models.PositiveIntegerField(_("unread messages count"), default=0)
+    pinned = models.BooleanField(_("is pinned"), default=False)
+    muted = models.BooleanField(_("is muted"), default=False)
+
+    objects = InboxManager()
+
+    class Meta:
+        verbose_name_plural = _("inbox entries")
+        constraints = [
+            # User has one entry per chat
+            models.UniqueConstraint(fields=["user", "chat"], name="unique_inbox_chat"),
+            # User has one entry per group
+            models.UniqueConstraint(
+                fields=["user", "group"], name="unique_inbox_group"
+            ),
+            # Entry belongs either to a chat or to a group
+            models.CheckConstraint(
+                check=Q(chat__isnull=True) ^ Q(group__isnull=True),
+                name="inbox_chat_or_group",
+            ),
+        ]
+        indexes = [
+            # Indexing inbox order to list user chats with an index scan
+            models.Index(
+                fields=["user", "-pinned", "-last_activity", "-id"],
+                name="inbox_user_activity_idx",
+            ),
+            # Indexing read watermarks to check if messages are seen
+            models.Index(fields=["chat", "last_read"], name="inbox_chat_read_idx"),
+            models.Index(fields=["group", "last_read"], name="inbox_group_read_idx"),
+        ]
+        ordering = ("-pinned", "-last_activity", "-id")
+
+    @property
+    def type(self) -> str:
+        return "chat" if self.chat_id else "group"
+
+    @property
+    def key(self) -> tuple:
+        """Identifies entry by user, chat and group"""
+        return (self.user_id, self.chat_id, self.group_id)
+
+    @property
+    def state(self) -> tuple:
+        """Fields derived from chat or group messages"""
+        return (self.last_activity, self.last_message_id)
+
+    def __str__(self) -> str:
+        return f"{self.user_id}: {self.type} {self.chat_id or self.group_id}"
+
+
+def is_direct(instance, origin) -> bool:
+    """Indicates whether instance is deleted directly and not by cascade"""
+    return origin is instance
+
+
+def get_entries(msg) -> InboxQuerySet:
+    """Returns inbox entries of message chat or group"""
+    field = msg.inbox_field + "_id"
+    return Inbox.objects.filter(**{field: getattr(msg, field)})
+
+
+@receiver(models.signals.post_save, sender=PChat)
+def on_chat_save(sender, instance: PChat, created, **kwargs):
+    if created:
+        Inbox.objects.bulk_create(
+            Inbox(
+                user_id=user_id,
+                chat=instance,
+                last_activity=instance.created,
+                last_read=instance.created,
+            )
+            for user_id in instance.get_members_id()
+        )
+
+
+@receiver(models.signals.post_save, sender=PMessage)
+@receiver(models.signals.post_save, sender=GroupMessage)
+def on_message_save(sender, instance, created, **kwargs):
+    if not created:
+        return
+    changes = {"last_activity": instance.created, "last_message_id": instance.pk}
+    if sender is PMessage:
+        changes["unread"] = Case(
+            When(~Q(user_id=instance.owner_id), then=F("unread") + 1),
+            default=F("unread"),
+            output_field=models.PositiveIntegerField(),
+        )
+    get_entries(instance).update(**changes)
+
+
+@receiver(models.signals.post_delete, sender=PMessage)
+@receiver(models.signals.post_delete, sender=GroupMessage)
+def on_message_delete(sender, instance, origin=None, **kwargs):
+    if not is_direct(instance, origin):
+        return
+    entries = get_entries(instance)
+    if sender is PMessage:
+        entries.before(instance).exclude(user_id=instance.owner_id).mark_read(1)
+    last_entries = entries.filter(last_message_id=instance.pk)
+    if last_entries.exists():
+        parent = getattr(instance, instance.inbox_field)
+        msg_id, activity = latest_message(parent.messages, parent.created)
+        last_entries.update(last_activity=activity, last_message_id=msg_id)
+
+
+@receiver(models.signals.post_save, sender=GroupMember)
+def on_member_save(sender, instance: GroupMember, created, **kwargs):
+    if created:
+        Inbox.objects.add_group(instance.user_id, instance.group_id)
+
+
+@receiver(models.signals.post_delete, sender=GroupBan)
+def on_ban_delete(sender, instance: GroupBan, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        Inbox.objects.add_group(instance.user_id, instance.group_id)
+
+
+@receiver(models.signals.post_delete, sender=GroupMember)
+def on_member_delete(sender, instance: GroupMember, origin=None, **kwargs):
+    if is_direct(instance, origin):
+        Inbox.objects.filter(
+            user_id=instance.user_id, group_id=instance.group_id
+        ).delete()
+
+
+@receiver(models.signals.post_save, sender=GroupBan)
+def on_ban_save(sender, instance: GroupBan, created, **kwargs):
+    # banned members keep membership but lose access to the group
+    if created:
+        Inbox.objects.filter(
+            user_id=instance.user_id, group_id=instance.group_id
+        ).delete()
@@ -1,6 +1,6 @@
 """Custom django queryset lookup classes"""
 
-from django.db.models import Lookup, Field
+from django.db.models import Lookup, Field, IntegerField
 
 
 @Field.register_lookup
@@ -14,3 +14,16 @@ class AnyOP(Lookup):
         rhs, rhs_params = self.process_rhs(compiler, connection)
         params.extend(rhs_params)
         return "%s = ANY(array(%s))" % (lhs, rhs), params
+
+
+@IntegerField.register_lookup
+class HasBits(Lookup):
+    """Implements postgres (col & bits) = bits for django bitmask lookups"""
+
+    lookup_name = "hasbits"
+
+    def as_sql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        params.extend(rhs_params * 2)
+        return "(%s & %s) = %s" % (lhs, rhs, rhs), params
@@ -0,0 +1,64 @@
+"""Transactional outbox of WebSocket events"""
+
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class OutboxEventQuerySet(models.QuerySet):
+    """Outbox event queryset class"""
+
+    def claim(self, lease: int) -> list:
+        """
+        Claims events for publishing, so other publishers skip them until
+        the lease expires. Events claimed by other publishers are skipped
+        unless their lease expired. Returns claimed events
+        """
+        now = timezone.now()
+        expired = Q(claimed__isnull=True) | Q(
+            claimed__lte=now - timedelta(seconds=lease)
+        )
+        with transaction.atomic():
+            events = list(self.filter(expired).select_for_update(skip_locked=True))
+            self.model.objects.filter(pk__in=[event.pk for event in events]).update(
+                claimed=now
+            )
+        return events
+
+
+class OutboxEvent(models.Model):
+    """
+    WebSocket event recorded in the same transaction as the change
+    that caused it. Events are published after commit and deleted,
+    leftovers are published by 'dispatch_outbox' command.
+    Publishers claim events before publishing them, so an event is not
+    published twice while its claim lasts.
+    """
+
+    # seconds events are claimed for by a publisher
+    CLAIM_LEASE = 60
+
+    event_type = models.CharField(_("event type"), max_length=20)
+    event = models.CharField(_("event name"), max_length=50)
+    kwargs = models.JSONField(
+        _("event arguments"), default=dict, encoder=DjangoJSONEncoder
+    )
+    origin = models.CharField(
+        _("origin session"), max_length=255, blank=True, default=""
+    )
+    # base url of the recording request to build absolute urls on publish
+    base_url = models.CharField(_("base url"), max_length=255, blank=True, default="")
+    created = models.DateTimeField(_("created datetime"), auto_now_add=True)
+    claimed = models.DateTimeField(_("claimed datetime"), null=True, blank=True)
+
+    objects = OutboxEventQuerySet.as_manager()
+
+    class Meta:
+        ordering = ("id",)
+
+    def __str__(self) -> str:
+        return f"{self.pk}: {self.event_type}.{self.event}"
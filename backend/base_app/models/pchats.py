@@ -4,10 +4,11 @@ from django.db import models
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q, F, Count, Prefetch
+from django.db.models import Q, F, Prefetch, Subquery, OuterRef
 from django.db.models.functions import Greatest, Least, Lower
+from django.contrib.postgres.indexes import GinIndex
 
-from .abstract import MessageBase, MessageFileBase
+from .abstract import MessageBase, MessageFileBase, content_vector
 from .utils import MessageFilePath, FILE_VALIDATOR, delete_file, delete_old_file
 
 
@@ -15,14 +16,25 @@ class ChatQuerySet(models.QuerySet):
     """Private chat queryset class"""
 
     def annotate_unread(self, user):
-        """Annotates unread messages count for a user"""
-        exp = ~Q(messages__owner=user) & Q(messages__seen=False)
-        return self.annotate(unread=Count("messages", filter=exp))
+        """Annotates unread messages count for a user from user inbox"""
+        from .inbox import Inbox
+
+        entry = Inbox.objects.filter(user=user, chat=OuterRef("pk"))
+        return self.annotate(unread=Subquery(entry.values("unread")))
 
     def prefetch_latest(self):
-        """Prefetches chats latest message"""
-        qs = PMessage.objects.annotate_owner_name().order_by("-created")
-        return self.prefetch_related(Prefetch("messages", queryset=qs))
+        """
+        Prefetches only the latest message of each chat as 'latest' list.
+        Sliced prefetch is fetched with a window function per chat
+        """
+        qs = (
+            PMessage.objects.annotate_owner_name()
+            .annotate_seen()
+            .order_by("-created", "-id")
+        )
+        return self.prefetch_related(
+            Prefetch("messages", queryset=qs[:1], to_attr="latest")
+        )
 
     def select_companion(self):
         """Prefetches companion"""
@@ -129,6 +141,57 @@ class PChat(models.Model):
         return f"Chat: {self.from_user} and {self.to_user}"
 
 
+class Contact(models.Model):
+    """
+    Symmetric adjacency of people that have a private chat.
+    Every chat has a row for each of its members, rows are created with
+    the chat and deleted with it by cascade
+    """
+
+    # Both lookups are covered by the leading columns of the indexes below
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="contacts", db_index=False
+    )
+    contact = models.ForeignKey(
+        "User",
+        on_delete=models.CASCADE,
+        related_name="+",
+        related_query_name="contacted",
+        db_index=False,
+    )
+    chat = models.ForeignKey(PChat, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            # People have only one chat, chat ids are included for index only scans
+            models.UniqueConstraint(
+                fields=["user", "contact"], include=["chat"], name="unique_contact"
+            ),
+        ]
+        indexes = [
+            # Indexing reverse adjacency to speed up lookups by contact
+            models.Index(
+                fields=["contact", "user"], include=["chat"], name="contact_reverse_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} -> {self.contact_id}: {self.chat_id}"
+
+
+@receiver(models.signals.post_save, sender=PChat)
+def on_chat_create(sender, instance: PChat, created, **kwargs):
+    """Adds contacts of chat members after chat is created"""
+    if created:
+        user1, user2 = instance.get_members_id()
+        Contact.objects.bulk_create(
+            [
+                Contact(user_id=user1, contact_id=user2, chat=instance),
+                Contact(user_id=user2, contact_id=user1, chat=instance),
+            ]
+        )
+
+
 class PMessage(MessageBase):
     """
     Message model for private chats
@@ -141,12 +204,18 @@ class PMessage(MessageBase):
         verbose_name=_("Message PChat"),
     )
 
+    inbox_field = "chat"
+
     class Meta(MessageBase.Meta):
         indexes = [
             # Indexing message created date to speed up ordering
             models.Index(F("created").desc(), name="pmsg_created_idx"),
-            # Indexing message seen flag to speed up sorting
-            models.Index(F("seen").asc(), name="pmsg_seen_idx"),
+            # Indexing chat messages order for keyset pagination
+            models.Index(
+                fields=["chat", "-created", "-id"], name="pmsg_chat_created_idx"
+            ),
+            # Indexing message content for full-text search
+            GinIndex(content_vector(), name="pmsg_content_search_idx"),
         ]
 
     def get_absolute_url(self):
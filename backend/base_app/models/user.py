@@ -3,21 +3,29 @@
 import os
 from uuid import uuid4
 
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.dispatch import receiver
 from django.db.models import (
     Q,
     F,
     Value,
-    Max,
     Subquery,
     OuterRef,
+    Exists,
 )
-from django.db.models.functions import Coalesce
 
-from .groups import GroupMessage
+from ..presence import presence
+from ..cache import users
+from .utils import trigram_index, search_exps
+
+
+# User fields to search people by
+USER_SEARCH_FIELDS = ["username", "first_name", "last_name"]
 
 
 class UserQuerySet(models.QuerySet):
@@ -37,57 +45,57 @@ class UserQuerySet(models.QuerySet):
 
     def get_chats(self, user):
         """
-        Returns queryset of user chats
+        Returns queryset of chat ids of user with outer people
         """
 
-        from .pchats import PChat
+        from .pchats import Contact
 
-        exp = (Q(from_user=user) & Q(to_user=OuterRef("pk"))) | (
-            Q(from_user=OuterRef("pk")) & Q(to_user=user)
-        )
-        return PChat.objects.filter(exp).values("pk").order_by()
+        return Contact.objects.filter(user=user, contact=OuterRef("pk")).values("chat")
 
-    def search_query(self, query):
+    def filter_contacts(self, user):
+        """
+        Filters people that user has a chat with and annotates their chat ids
+        """
+        return self.filter(contacted__user=user).annotate(chat_id=F("contacted__chat"))
 
-        exp = (
-            Q(username__icontains=query)
-            | Q(first_name__icontains=query)
-            | Q(last_name__icontains=query)
+    def search_query(self, query):
+        """
+        Searches people by names. Prefix matches come first,
+        then people are ranked by name similarity
+        """
+        exp, priority, similarity = search_exps(
+            query, USER_SEARCH_FIELDS, ["username", "first_name"]
         )
         return (
-            self.alias(
-                user_order=(
-                    Q(username__istartswith=query) | Q(first_name__istartswith=query)
-                )
-            )
+            self.alias(user_order=priority, similarity=similarity)
             .filter(exp)
-            .order_by("-user_order", "first_name", "last_name")
+            .order_by("-user_order", "-similarity", "first_name", "last_name")
         )
 
     def search_people(self, query: str, user: "User"):
         """
         Simple people searching by given query and user
         """
-        qs = self.filter_people(user).alias_chat(user)
+        qs = self.filter_people(user).exclude(Exists(self.get_chats(user)))
         if query:
             qs = qs.search_query(query)
-        return qs.filter(chat_id__isnull=True)
+        return qs
 
     def search_friends(self, query: str, user):
         """Search people that user has common chat with"""
 
-        qs = self.exclude(pk=user.pk).annotate_chat(user)
+        qs = self.filter_contacts(user)
         if query:
             qs = qs.search_query(query)
-        return qs.filter(chat_id__isnull=False)
+        return qs
 
     def annotate_chat(self, user):
         sub_q = self.get_chats(user)
-        return self.annotate(chat_id=Subquery(sub_q[:1]))
+        return self.annotate(chat_id=Subquery(sub_q))
 
-    def alias_chat(self, user):
-        sub_q = self.get_chats(user)
-        return self.alias(chat_id=Subquery(sub_q[:1]))
+    def update_last_seen(self):
+        """Persists current time as last seen time of users"""
+        return self.update(last_seen=timezone.now())
 
 
 class MyUserManager(UserManager):
@@ -130,8 +138,8 @@ class User(AbstractUser):
         upload_to=user_photo_path, max_length=255, default="defaults/user/default.png"
     )
 
-    # user sessions number
-    status = models.PositiveSmallIntegerField(_("user status"), default=0)
+    # last time user went offline, online status is tracked by presence backend
+    last_seen = models.DateTimeField(_("last seen"), null=True, blank=True)
 
     # people whom user started chat with
     chat_to = models.ManyToManyField(
@@ -145,6 +153,9 @@ class User(AbstractUser):
 
     objects = MyUserManager()
 
+    # fields of user snapshots in caches, enough to authenticate requests
+    RECORD_FIELDS = ("id", "is_active", "username", "first_name", "last_name", "photo")
+
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = [
         "username",
@@ -166,8 +177,8 @@ class User(AbstractUser):
         indexes = [
             # Indexing user first and last name to speed up ordering
             models.Index(fields=["first_name", "last_name"], name="user_fullname_idx"),
-            # Indexing user status to speed up sorting
-            models.Index(F("status").desc(), name="user_status_idx"),
+            # Indexing user names with trigrams to speed up searching
+            trigram_index(*USER_SEARCH_FIELDS, name="user_name_trgm_idx"),
         ]
         ordering = ("first_name", "last_name")
 
@@ -186,15 +197,25 @@ class User(AbstractUser):
         """
         Get all people that user has a chat with
         """
-        return (self.chat_to.all() | self.chat_from.all()).distinct()
+        return type(self).objects.filter(contacted__user=self)
 
     def has_chat(self, user):
         """Checks if user has a chat with this user"""
-        return self.chatted_people.contains(user)
+        return self.contacts.filter(contact=user).exists()
 
     def get_absolute_url(self):
         return reverse("user", kwargs={"pk": self.pk})
 
+    @classmethod
+    def from_record(cls, record) -> "User":
+        """
+        Builds user from compact record of RECORD_FIELDS.
+        Other fields are deferred and loaded from DB on access
+        """
+        data = dict(zip(cls.RECORD_FIELDS, record))
+        names = [f.attname for f in cls._meta.concrete_fields if f.attname in data]
+        return cls.from_db(None, names, [data[name] for name in names])
+
     def save(self, *args, **kwargs):
         # set first name same as username if not specified
         if not self.first_name:
@@ -208,41 +229,55 @@ class User(AbstractUser):
         return self.from_me.all() | self.to_me.all()
 
     def get_generic_chats(self):
-        """Get queryset of all types of available user chats"""
-
-        created = Max("messages__created", default=F("created"))
-        sub_q = (
-            GroupMessage.objects.filter(group=OuterRef("pk"))
-            .values("group__pk")
-            .annotate(last_created=Max("created"))
-            .values("last_created")
-        )
-        values = ("id", "last_created", "type")
+        """Get inbox entries of all types of available user chats"""
+        return self.inbox.only("user_id", "chat_id", "group_id")
+
+    def get_chat_members(self):
+        """
+        Returns rows of (type, id, member1, member2) of all available
+        user chats and groups in one query. Members are set only for chats
+        """
+
+        values = ("type", "id", "member1", "member2")
         chats = (
             self.get_chats()
-            .annotate(type=Value("chat"), last_created=created)
-            .values(*values)
+            .annotate(
+                type=Value("chat"),
+                member1=F("from_user_id"),
+                member2=F("to_user_id"),
+            )
+            .values_list(*values)
             .order_by()
         )
         groups = (
             self.allowed_groups.annotate(
                 type=Value("group"),
-                last_created=Coalesce(Subquery(sub_q), F("created")),
+                member1=Value(None, models.IntegerField()),
+                member2=Value(None, models.IntegerField()),
             )
-            .values(*values)
+            .values_list(*values)
             .order_by()
         )
-        return chats.union(groups, all=True).order_by("-last_created")
+        return chats.union(groups, all=True)
 
-    def update_status(self, value):
+    def update_last_seen(self):
         """
-        Update user status
+        Persists the time user went offline
         """
-        type(self).objects.filter(pk=self.pk).update(status=F("status") + value)
+        self.last_seen = timezone.now()
+        type(self).objects.filter(pk=self.pk).update(last_seen=self.last_seen)
 
-    @property
+    @cached_property
     def is_online(self):
         """
         Indicates whether user is online
         """
-        return self.status > 0
+        return presence.is_online(self.pk)
+
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_delete, sender=User)
+def on_user_change(sender, instance: User, **kwargs):
+    """Invalidates cached user after user is changed"""
+    user_id = instance.pk
+    transaction.on_commit(lambda: users.invalidate(user_id))
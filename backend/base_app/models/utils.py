@@ -5,8 +5,11 @@ from uuid import uuid4
 from operator import attrgetter
 
 from django.utils.deconstruct import deconstructible
-from django.db.models import FileField
+from django.db.models import FileField, Q
+from django.db.models.functions import Greatest, Upper
 from django.core.validators import FileExtensionValidator
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import TrigramSimilarity
 
 
 # Valid image extensions
@@ -49,6 +52,37 @@ DOC_EXTS = {
 }
 
 
+def trigram_index(*fields: str, name: str) -> GinIndex:
+    """
+    Returns trigram index of upper cased fields that serves
+    case-insensitive substring and prefix lookups of the fields
+    """
+    exps = (OpClass(Upper(field), name="gin_trgm_ops") for field in fields)
+    return GinIndex(*exps, name=name)
+
+
+def search_exps(query: str, fields: list[str], prefix_fields: list[str]) -> tuple:
+    """Returns text search expressions of query over fields
+
+    Args:
+        query (str): Search query
+        fields (list[str]): Fields to match query in, at least two
+        prefix_fields (list[str]): Fields whose prefix matches come first
+
+    Returns:
+        tuple: filter of case-insensitive matches, prefix match priority
+        and the best trigram similarity of the fields
+    """
+    exp = Q()
+    for field in fields:
+        exp |= Q(**{field + "__icontains": query})
+    priority = Q()
+    for field in prefix_fields:
+        priority |= Q(**{field + "__istartswith": query})
+    similarity = Greatest(*(TrigramSimilarity(field, query) for field in fields))
+    return exp, priority, similarity
+
+
 # Available file types
 FILE_TYPES = {
     "image": IMAGE_EXTS,
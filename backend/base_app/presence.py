@@ -0,0 +1,250 @@
+"""User presence backends"""
+
+import os
+import time
+import socket
+import threading
+from uuid import uuid4
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+
+def default_node_id() -> str:
+    """Generates unique id for current server node (process)"""
+    return "%s-%s-%s" % (socket.gethostname(), os.getpid(), uuid4().hex[:8])
+
+
+class BasePresence:
+    """
+    Base presence backend.
+    Every session is owned by the server node that accepted it.
+    Nodes send periodic heartbeats and sessions of nodes whose heartbeat
+    expired are reaped by any alive node.
+    """
+
+    def __init__(self, ttl: int = 60, heartbeat: int = 20, node_id=None, **kwargs):
+        """Initializes presence backend
+
+        Args:
+            ttl (int, optional): node heartbeat lifetime in seconds. Defaults to 60.
+            heartbeat (int, optional): heartbeat interval in seconds. Defaults to 20.
+            node_id (str, optional): current node id. Defaults to None.
+        """
+        assert heartbeat < ttl, "Heartbeat interval must be less than TTL"
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.node_id = node_id or default_node_id()
+
+    def connect(self, user_id, session: str) -> bool:
+        """Adds user session. Returns True if user came online"""
+        raise NotImplementedError
+
+    def disconnect(self, user_id, session: str) -> bool:
+        """Removes user session. Returns True if user went offline"""
+        raise NotImplementedError
+
+    def beat(self):
+        """Extends lifetime of current node"""
+        raise NotImplementedError
+
+    def reap(self) -> list:
+        """
+        Removes sessions of nodes with expired heartbeat.
+        Returns ids of users that went offline
+        """
+        raise NotImplementedError
+
+    def sessions_count(self, user_id) -> int:
+        """Returns the number of alive sessions of a user"""
+        raise NotImplementedError
+
+    def online_ids(self, user_ids) -> set:
+        """Returns online ones from given user ids"""
+        return {pk for pk in user_ids if self.is_online(pk)}
+
+    def is_online(self, user_id) -> bool:
+        """Indicates whether user has alive sessions"""
+        return self.sessions_count(user_id) > 0
+
+    def online_count(self, user_ids) -> int:
+        """Returns the number of online users from given user ids"""
+        return len(self.online_ids(user_ids))
+
+
+class MemoryPresence(BasePresence):
+    """
+    Process local presence backend.
+    Should be used only with single process servers
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # user id -> {session: node id}
+        self._sessions: dict[int, dict[str, str]] = {}
+        # node id -> heartbeat expiry time
+        self._nodes: dict[str, float] = {}
+        # node id -> {(user id, session)}
+        self._node_sessions: dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, session: str) -> bool:
+        with self._lock:
+            self._nodes[self.node_id] = time.monotonic() + self.ttl
+            sessions = self._sessions.setdefault(user_id, {})
+            came_online = not sessions
+            sessions[session] = self.node_id
+            self._node_sessions.setdefault(self.node_id, set()).add((user_id, session))
+            return came_online
+
+    def _remove(self, user_id, session: str) -> bool:
+        """Removes session and returns True if it was the last user session"""
+        sessions = self._sessions.get(user_id, {})
+        node_id = sessions.pop(session, None)
+        if node_id is None:
+            return False
+        self._node_sessions.get(node_id, set()).discard((user_id, session))
+        if sessions:
+            return False
+        del self._sessions[user_id]
+        return True
+
+    def disconnect(self, user_id, session: str) -> bool:
+        with self._lock:
+            return self._remove(user_id, session)
+
+    def beat(self):
+        with self._lock:
+            self._nodes[self.node_id] = time.monotonic() + self.ttl
+
+    def reap(self) -> list:
+        offline = []
+        with self._lock:
+            now = time.monotonic()
+            for node_id in [n for n, exp in self._nodes.items() if exp <= now]:
+                del self._nodes[node_id]
+                for user_id, session in self._node_sessions.pop(node_id, ()):
+                    if self._remove(user_id, session):
+                        offline.append(user_id)
+        return offline
+
+    def sessions_count(self, user_id) -> int:
+        with self._lock:
+            return len(self._sessions.get(user_id, ()))
+
+
+class RedisPresence(BasePresence):
+    """
+    Redis presence backend to share presence between server nodes.
+    Every user has a hash of sessions mapped to their nodes, every node
+    has a set of its sessions and node heartbeats are kept in a sorted set
+    scored by expiry time.
+    """
+
+    def __init__(
+        self, host="localhost", port=6379, prefix="presence", client=None, **kwargs
+    ):
+        """Initializes redis presence backend
+
+        Args:
+            host (str, optional): redis host. Defaults to "localhost".
+            port (int, optional): redis port. Defaults to 6379.
+            prefix (str, optional): keys prefix. Defaults to "presence".
+            client (optional): redis compatible client or import path of its
+            class, e.g. "base_app.local_redis.LocalRedis" for tests.
+            Defaults to None.
+        """
+        super().__init__(**kwargs)
+        if isinstance(client, str):
+            client = import_string(client)()
+        elif client is None:
+            from redis import Redis
+
+            client = Redis(host=host, port=port)
+        self.client = client
+        self.prefix = prefix
+        self.nodes_key = "%s:nodes" % prefix
+        self.reaper_key = "%s:reaper" % prefix
+
+    def user_key(self, user_id) -> str:
+        return "%s:user:%s" % (self.prefix, user_id)
+
+    def node_key(self, node_id) -> str:
+        return "%s:node:%s" % (self.prefix, node_id)
+
+    def connect(self, user_id, session: str) -> bool:
+        key = self.user_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(self.nodes_key, {self.node_id: time.time() + self.ttl})
+        pipe.hlen(key)
+        pipe.hset(key, session, self.node_id)
+        pipe.sadd(self.node_key(self.node_id), "%s|%s" % (user_id, session))
+        _, count, *_ = pipe.execute()
+        return not count
+
+    def disconnect(self, user_id, session: str) -> bool:
+        key = self.user_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.hdel(key, session)
+        pipe.srem(self.node_key(self.node_id), "%s|%s" % (user_id, session))
+        pipe.hlen(key)
+        removed, _, count = pipe.execute()
+        return bool(removed) and not count
+
+    def beat(self):
+        self.client.zadd(self.nodes_key, {self.node_id: time.time() + self.ttl})
+
+    def reap(self) -> list:
+        # only one node reaps at a time
+        if not self.client.set(
+            self.reaper_key, self.node_id, nx=True, ex=self.heartbeat
+        ):
+            return []
+        dead_nodes = self.client.zrangebyscore(self.nodes_key, "-inf", time.time())
+        offline = []
+        for node_id in dead_nodes:
+            node_key = self.node_key(node_id.decode())
+            sessions = [
+                member.decode().split("|", 1)
+                for member in self.client.smembers(node_key)
+            ]
+            pipe = self.client.pipeline()
+            for user_id, session in sessions:
+                pipe.hdel(self.user_key(user_id), session)
+            for user_id, _ in sessions:
+                pipe.hlen(self.user_key(user_id))
+            pipe.delete(node_key)
+            pipe.zrem(self.nodes_key, node_id)
+            counts = pipe.execute()[len(sessions) : 2 * len(sessions)]
+            offline.extend(
+                {
+                    int(user_id)
+                    for (user_id, _), count in zip(sessions, counts)
+                    if not count
+                }
+            )
+        return offline
+
+    def sessions_count(self, user_id) -> int:
+        return self.client.hlen(self.user_key(user_id))
+
+    def online_ids(self, user_ids) -> set:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        pipe = self.client.pipeline()
+        for pk in user_ids:
+            pipe.exists(self.user_key(pk))
+        return {pk for pk, exists in zip(user_ids, pipe.execute()) if exists}
+
+
+def get_presence() -> BasePresence:
+    """Creates presence backend based on 'PRESENCE' setting"""
+    conf = getattr(settings, "PRESENCE", {})
+    backend = import_string(conf.get("BACKEND", "base_app.presence.MemoryPresence"))
+    return backend(**conf.get("CONFIG", {}))
+
+
+# Default presence backend
+presence: BasePresence = SimpleLazyObject(get_presence)
@@ -0,0 +1,99 @@
+"""Redis channel layer with multi-group support"""
+
+import time
+import logging
+from collections import defaultdict
+
+from channels_redis.core import RedisChannelLayer
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkRedisChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer that can send a message to many groups and
+    add a channel to many groups using one pipeline per redis connection
+    """
+
+    # Same script 'group_send' uses to push messages to channels
+    send_lua = """
+        local over_capacity = 0
+        local current_time = ARGV[#ARGV - 1]
+        local expiry = ARGV[#ARGV]
+        for i=1,#KEYS do
+            if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+                redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+                redis.call('EXPIRE', KEYS[i], expiry)
+            else
+                over_capacity = over_capacity + 1
+            end
+        end
+        return over_capacity
+    """
+
+    async def group_send_many(self, groups, message):
+        """Sends a message to all channels of given groups once"""
+        channel_names = set()
+        min_score = int(time.time()) - self.group_expiry
+        for index, keys in self._group_keys_by_connection(groups).items():
+            pipe = self.connection(index).pipeline()
+            for key in keys:
+                # Discard old channels based on group_expiry
+                pipe.zremrangebyscore(key, min=0, max=min_score)
+                pipe.zrange(key, 0, -1)
+            results = await pipe.execute()
+            for names in results[1::2]:
+                channel_names.update(name.decode("utf8") for name in names)
+        if channel_names:
+            await self.send_to_channels(sorted(channel_names), message)
+
+    async def group_add_many(self, groups, channel):
+        """Adds a channel to given groups using one pipeline per redis connection"""
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        now = time.time()
+        for index, keys in self._group_keys_by_connection(groups).items():
+            pipe = self.connection(index).pipeline()
+            for key in keys:
+                pipe.zadd(key, {channel: now})
+                pipe.expire(key, self.group_expiry)
+            await pipe.execute()
+
+    async def send_to_channels(self, channel_names, message):
+        """Sends a message to given channels grouped by redis connection"""
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = self._map_channel_keys_to_connection(channel_names, message)
+
+        for index, channel_keys in connection_to_channel_keys.items():
+            connection = self.connection(index)
+            # Discard old messages based on expiry
+            pipe = connection.pipeline()
+            for key in channel_keys:
+                pipe.zremrangebyscore(
+                    key, min=0, max=int(time.time()) - int(self.expiry)
+                )
+            await pipe.execute()
+
+            args = [channel_keys_to_message[key] for key in channel_keys]
+            args += [channel_keys_to_capacity[key] for key in channel_keys]
+            args += [time.time(), self.expiry]
+            over_capacity = await connection.eval(
+                self.send_lua, len(channel_keys), *channel_keys, *args
+            )
+            if over_capacity > 0:
+                logger.info(
+                    "%s of %s channels over capacity",
+                    over_capacity,
+                    len(channel_names),
+                )
+
+    def _group_keys_by_connection(self, groups) -> dict:
+        """Maps group keys to their redis connection index"""
+        keys = defaultdict(list)
+        for group in groups:
+            assert self.valid_group_name(group), "Group name not valid"
+            keys[self.consistent_hash(group)].append(self._group_key(group))
+        return keys
@@ -0,0 +1,284 @@
+"""Replay buffers of WebSocket event frames"""
+
+import time
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+
+class BaseReplay:
+    """
+    Base replay buffer backend.
+    Event frames are published to streams, e.g. user, chat or group
+    channel layers. Every stream numbers its frames with its own
+    monotonically growing sequence and keeps them in a bounded buffer,
+    so reconnecting sessions can replay frames they missed.
+    Buffers of streams without new frames expire after TTL.
+
+    Position of a session is a mapping of its streams to the last
+    sequence numbers it has. Positions of sessions are kept for TTL,
+    so the next session of the client resumes from them.
+    """
+
+    def __init__(self, size: int = 200, ttl: int = 60 * 60, **kwargs):
+        """Initializes replay buffer backend
+
+        Args:
+            size (int, optional): max frames per stream. Defaults to 200.
+            ttl (int, optional): buffer lifetime in seconds. Defaults to 3600.
+        """
+        self.size = size
+        self.ttl = ttl
+
+    def next_seq(self, stream: str) -> int:
+        """Returns next sequence number of stream"""
+        raise NotImplementedError
+
+    def last_seqs(self, streams) -> dict:
+        """Returns last given sequence numbers of streams"""
+        raise NotImplementedError
+
+    def append(self, stream: str, seq: int, frame: str, origin: str = None):
+        """Appends frame to buffer of stream
+
+        Args:
+            stream (str): stream name
+            seq (int): frame sequence number
+            frame (str): encoded frame
+            origin (str, optional): sender session to exclude on replay.
+            Defaults to None.
+        """
+        raise NotImplementedError
+
+    def since(self, positions: dict, session: str = None):
+        """
+        Returns list of (stream, seq, frame) of given streams after their
+        sequence numbers in order they were appended excluding frames sent
+        by given session. Returns None if some of the frames were already
+        dropped or expired
+        """
+        raise NotImplementedError
+
+    def save_position(self, session: str, position: dict):
+        """Keeps position of session for TTL"""
+        raise NotImplementedError
+
+    def get_position(self, session: str):
+        """Returns kept position of session or None if it expired"""
+        raise NotImplementedError
+
+
+class MemoryReplay(BaseReplay):
+    """
+    Process local replay buffer backend.
+    Should be used only with single process servers
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # stream -> last sequence number
+        self._seqs: dict[str, int] = {}
+        # stream -> deque of (seq, origin, time, frame)
+        self._buffers: dict[str, deque] = {}
+        # stream -> seq before the first buffered frame
+        self._floors: dict[str, int] = {}
+        # stream -> buffer expiry time
+        self._expiry: dict[str, float] = {}
+        # session -> (position, expiry time)
+        self._positions: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def next_seq(self, stream: str) -> int:
+        with self._lock:
+            seq = self._seqs[stream] = self._seqs.get(stream, 0) + 1
+            return seq
+
+    def last_seqs(self, streams) -> dict:
+        with self._lock:
+            return {stream: self._seqs.get(stream, 0) for stream in streams}
+
+    def _expire(self, now: float):
+        for stream in [s for s, exp in self._expiry.items() if exp <= now]:
+            del self._expiry[stream]
+            self._buffers.pop(stream, None)
+            self._floors.pop(stream, None)
+        for session in [s for s, (_, exp) in self._positions.items() if exp <= now]:
+            del self._positions[session]
+
+    def append(self, stream: str, seq: int, frame: str, origin: str = None):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            buffer = self._buffers.get(stream)
+            if buffer is None:
+                buffer = self._buffers[stream] = deque()
+                self._floors[stream] = seq - 1
+            buffer.append((seq, origin, time.time(), frame))
+            if len(buffer) > self.size:
+                self._floors[stream] = buffer.popleft()[0]
+            self._expiry[stream] = now + self.ttl
+
+    def since(self, positions: dict, session: str = None):
+        with self._lock:
+            self._expire(time.monotonic())
+            frames = []
+            for stream, seq in positions.items():
+                last = self._seqs.get(stream, 0)
+                # frames of expired buffers are gone
+                floor = self._floors.get(stream, last)
+                if seq < floor or seq > last:
+                    return None
+                frames.extend(
+                    (at, stream, s, frame)
+                    for s, origin, at, frame in self._buffers.get(stream, ())
+                    if s > seq and (session is None or origin != session)
+                )
+            frames.sort(key=lambda f: f[:3])
+            return [frame[1:] for frame in frames]
+
+    def save_position(self, session: str, position: dict):
+        with self._lock:
+            expiry = time.monotonic() + self.ttl
+            self._positions[session] = (dict(position), expiry)
+
+    def get_position(self, session: str):
+        with self._lock:
+            self._expire(time.monotonic())
+            position = self._positions.get(session)
+            return dict(position[0]) if position else None
+
+
+class RedisReplay(BaseReplay):
+    """
+    Redis replay buffer backend to share buffers between server nodes.
+    Every stream has a sequence counter and a sorted set of frames scored
+    by sequence number. Sequence number before the first buffered frame
+    is kept as the buffer floor. Counters are kept without expiry, so
+    numbers of a stream are never reused.
+    Positions of sessions are kept in hashes.
+    """
+
+    def __init__(
+        self, host="localhost", port=6379, prefix="replay", client=None, **kwargs
+    ):
+        """Initializes redis replay buffer backend
+
+        Args:
+            host (str, optional): redis host. Defaults to "localhost".
+            port (int, optional): redis port. Defaults to 6379.
+            prefix (str, optional): keys prefix. Defaults to "replay".
+            client (optional): redis compatible client or import path of its
+            class. Defaults to None.
+        """
+        super().__init__(**kwargs)
+        if isinstance(client, str):
+            client = import_string(client)()
+        elif client is None:
+            from redis import Redis
+
+            client = Redis(host=host, port=port)
+        self.client = client
+        self.prefix = prefix
+
+    def seq_key(self, stream: str) -> str:
+        return "%s:seq:%s" % (self.prefix, stream)
+
+    def buffer_key(self, stream: str) -> str:
+        return "%s:stream:%s" % (self.prefix, stream)
+
+    def floor_key(self, stream: str) -> str:
+        return "%s:floor:%s" % (self.prefix, stream)
+
+    def position_key(self, session: str) -> str:
+        return "%s:session:%s" % (self.prefix, session)
+
+    def next_seq(self, stream: str) -> int:
+        return self.client.incr(self.seq_key(stream))
+
+    def last_seqs(self, streams) -> dict:
+        streams = list(streams)
+        if not streams:
+            return {}
+        seqs = self.client.mget([self.seq_key(stream) for stream in streams])
+        return {stream: int(seq or 0) for stream, seq in zip(streams, seqs)}
+
+    def append(self, stream: str, seq: int, frame: str, origin: str = None):
+        key, floor_key = self.buffer_key(stream), self.floor_key(stream)
+        member = "%s|%s|%s" % (origin or "", time.time(), frame)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {member: seq})
+        pipe.zcard(key)
+        pipe.zrange(key, 0, -self.size - 1, withscores=True)
+        pipe.zremrangebyrank(key, 0, -self.size - 1)
+        pipe.expire(key, self.ttl)
+        pipe.expire(floor_key, self.ttl)
+        _, size, dropped, *_ = pipe.execute()
+        if dropped:
+            self.client.set(floor_key, int(dropped[-1][1]), ex=self.ttl)
+        elif size == 1:
+            # new buffer doesn't have frames before its first one
+            self.client.set(floor_key, seq - 1, ex=self.ttl)
+
+    def since(self, positions: dict, session: str = None):
+        streams = list(positions)
+        pipe = self.client.pipeline()
+        for stream in streams:
+            pipe.get(self.seq_key(stream))
+            pipe.get(self.floor_key(stream))
+            pipe.zrangebyscore(
+                self.buffer_key(stream),
+                "(%s" % positions[stream],
+                "+inf",
+                withscores=True,
+            )
+        results = pipe.execute()
+
+        frames = []
+        for i, stream in enumerate(streams):
+            last, floor, members = results[i * 3 : i * 3 + 3]
+            seq, last = positions[stream], int(last or 0)
+            if floor is not None:
+                floor = int(floor)
+            elif members:
+                # buffer is being created
+                floor = int(members[0][1]) - 1
+            else:
+                # frames of expired buffers are gone
+                floor = last
+            if seq < floor or seq > last:
+                return None
+            for member, score in members:
+                origin, at, frame = member.decode().split("|", 2)
+                if session is None or origin != session:
+                    frames.append((float(at), stream, int(score), frame))
+        frames.sort(key=lambda f: f[:3])
+        return [frame[1:] for frame in frames]
+
+    def save_position(self, session: str, position: dict):
+        key = self.position_key(session)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if position:
+            pipe.hset(key, mapping=position)
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get_position(self, session: str):
+        position = self.client.hgetall(self.position_key(session))
+        if not position:
+            return None
+        return {stream.decode(): int(seq) for stream, seq in position.items()}
+
+
+def get_replay() -> BaseReplay:
+    """Creates replay buffer backend based on 'REPLAY' setting"""
+    conf = getattr(settings, "REPLAY", {})
+    backend = import_string(conf.get("BACKEND", "base_app.replay.MemoryReplay"))
+    return backend(**conf.get("CONFIG", {}))
+
+
+# Default replay buffer backend
+replay: BaseReplay = SimpleLazyObject(get_replay)
@@ -0,0 +1,107 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..cache import UserCache, member_activity
+from ..models import Group, GroupMessage
+from .test_outbox import create_user
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.users = UserCache()
+        self.user = create_user("alice")
+        self.users.invalidate(self.user.pk)
+        self.addCleanup(self.users.invalidate, self.user.pk)
+
+    def test_snapshot(self):
+        self.users.get(self.user.pk)
+        record = self.users.cache.get(self.users.key_p % self.user.pk)
+        self.assertNotIn(self.user.password, record)
+        self.assertNotIn(self.user.email, record)
+
+        with self.assertNumQueries(0):
+            user = self.users.get(self.user.pk)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertIs(user.is_active, True)
+            self.assertEqual(user.username, "alice")
+            self.assertEqual(user.get_full_name(), self.user.get_full_name())
+            self.assertEqual(user.photo.name, self.user.photo.name)
+        self.assertEqual(self.users.stats.as_dict(), {"hits": 1, "misses": 1})
+        # private fields are loaded on access
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, self.user.email)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.users.get(0))
+        self.assertIsNone(self.users.get(0))
+        self.assertEqual(self.users.stats.misses, 2)
+
+    def test_invalidated_on_change(self):
+        self.users.get(self.user.pk)
+        self.user.first_name = "Alice"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.users.get(self.user.pk).first_name, "Alice")
+
+
+class ActivityThrottleTests(TestCase):
+    def setUp(self):
+        self.owner = create_user("alice")
+        self.group = Group.objects.create(name="group", owner=self.owner)
+        self.group.setup_group()
+        self.key = member_activity.key_p % (self.group.pk, self.owner.pk)
+        member_activity.cache.delete(self.key)
+        self.addCleanup(member_activity.cache.delete, self.key)
+
+    def activity_updates(self, count: int) -> list:
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(count):
+                GroupMessage.objects.create(
+                    group=self.group, owner=self.owner, content=str(i)
+                )
+        table = '"base_app_groupmember"'
+        return [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE %s SET "last_activity"' % table)
+        ]
+
+    def test_allow(self):
+        interval = timedelta(minutes=1)
+        self.assertTrue(member_activity.allow(self.group.pk, self.owner.pk, interval))
+        self.assertFalse(member_activity.allow(self.group.pk, self.owner.pk, interval))
+        self.assertTrue(member_activity.allow(self.group.pk, 0, interval))
+        member_activity.cache.delete(member_activity.key_p % (self.group.pk, 0))
+
+    def test_messages_within_throttle(self):
+        self.assertEqual(len(self.activity_updates(3)), 1)
+        # throttled senders don't reach the database
+        self.assertEqual(self.activity_updates(2), [])
+        member_activity.cache.delete(self.key)
+        self.assertEqual(len(self.activity_updates(1)), 1)
+
+
+class GroupRolePermTests(TestCase):
+    def setUp(self):
+        self.owner = create_user("alice")
+        group = Group.objects.create(name="group", owner=self.owner)
+        group.setup_group()
+        self.group = Group.objects.get(pk=group.pk)
+
+    def test_perm_over_role(self):
+        role = self.group.default_role
+        self.assertTrue(self.group.has_perm_over(self.owner.pk, role, "ban_user"))
+        # non members have no permissions
+        stranger = create_user("bob")
+        self.assertFalse(self.group.has_perm_over(stranger.pk, role, "ban_user"))
+
+    def test_errors_not_swallowed(self):
+        role = self.group.default_role
+        with mock.patch.object(
+            Group, "get_member_roles", side_effect=ConnectionError
+        ), self.assertRaises(ConnectionError):
+            self.group.has_perm_over(self.owner.pk, role, "ban_user")
@@ -0,0 +1,181 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase
+
+from channels.testing import WebsocketCommunicator
+
+from wini_chat.routing import routes
+
+from ..models import PChat, Group
+from ..api.consumers import SessionConsumer, encode_frame
+from ..api.outbound import OutboundQueue
+from .test_outbox import create_user
+
+
+class ReceiveEventTests(SimpleTestCase):
+    def setUp(self):
+        self.consumer = SessionConsumer()
+        self.consumer.outbound = OutboundQueue(mock.AsyncMock())
+        self.frames = []
+
+        async def send_frame(event_type, event, data=None):
+            self.frames.append((event_type, event, data))
+
+        self.consumer.send_frame = send_frame
+
+    def receive(self, content: dict):
+        asyncio.run(self.consumer.receive_json(content))
+
+    def test_ack(self):
+        self.consumer.outbound.unacked.extend([("chat_1", 1), ("chat_1", 2)])
+        self.receive(
+            {"event_type": "user", "event": "ack", "stream": "chat_1", "seq": 1}
+        )
+        self.assertEqual(self.frames, [])
+        self.assertEqual(list(self.consumer.outbound.unacked), [("chat_1", 2)])
+
+    def test_malformed_events(self):
+        for content in (
+            {"event": "ack"},
+            {"event_type": "unknown", "event": "ack"},
+            {"event_type": "user", "event": "unknown"},
+            {"event_type": "user", "event": "ack", "seq": 1},
+            {"event_type": "user", "event": "ack", "stream": "chat_1", "seq": "1"},
+            {"event_type": "chat", "event": "send_msg", "ref": 3},
+        ):
+            self.frames.clear()
+            self.receive(content)
+            [(event_type, event, data)] = self.frames
+            self.assertEqual(event, "error", content)
+            self.assertEqual(data["ref"], content.get("ref"))
+            self.assertIn("detail", data["errors"])
+        self.assertFalse(self.consumer.outbound.acking)
+
+    def test_unexpected_errors_are_raised(self):
+        with mock.patch.object(
+            SessionConsumer, "user_watch_event", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.receive({"event_type": "user", "event": "watch", "user_id": 1})
+
+
+class SendManyTests(SimpleTestCase):
+    def test_encoded_once(self):
+        consumer = SessionConsumer()
+        # channel layer without 'group_send_many'
+        consumer.channel_layer = mock.Mock(
+            spec=["group_send"], group_send=mock.AsyncMock()
+        )
+        data = {"event_type": "user", "event": "new_msg", "data": {"id": 1}}
+        groups = ["user_1", "user_2", "user_3"]
+        with mock.patch(
+            "base_app.api.consumers.encode_frame", wraps=encode_frame
+        ) as encode:
+            asyncio.run(consumer.send_many(groups, data))
+        encode.assert_called_once_with(data)
+        messages = [call.args for call in consumer.channel_layer.group_send.mock_calls]
+        self.assertEqual([group for group, _ in messages], groups)
+        # every recipient gets the same encoded frame
+        self.assertEqual(len({id(message) for _, message in messages}), 1)
+
+
+class SessionTests(TransactionTestCase):
+    def setUp(self):
+        self.alice, self.bob = create_user("alice"), create_user("bob")
+        self.chat = PChat.objects.create(from_user=self.alice, to_user=self.bob)
+        self.group = Group.objects.create(name="group", owner=self.alice)
+        self.group.setup_group()
+        self.group.members.create(user=self.bob, role=self.group.default_role)
+
+    async def connect(self, user, query: str = "") -> WebsocketCommunicator:
+        communicator = WebsocketCommunicator(
+            routes, "/ws/session/" + query, headers=[(b"host", b"testserver")]
+        )
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        frame = await communicator.receive_json_from(1)
+        self.assertEqual(frame["event"], "session")
+        return communicator
+
+    async def receive_events(self, communicator, count: int) -> list:
+        frames = [await communicator.receive_json_from(1) for _ in range(count)]
+        return sorted((frame["event_type"], frame["event"]) for frame in frames)
+
+    async def test_send_and_edit(self):
+        alice, bob = await self.connect(self.alice), await self.connect(self.bob)
+        chat_id = self.chat.pk
+        await bob.send_json_to(
+            {"event_type": "chat", "event": "connect", "chat_id": chat_id}
+        )
+        await bob.receive_nothing(0.1)
+
+        await alice.send_json_to(
+            {
+                "event_type": "chat",
+                "event": "send_msg",
+                "chat_id": chat_id,
+                "data": {"content": "hello"},
+                "ref": 1,
+            }
+        )
+        ack = await alice.receive_json_from(1)
+        self.assertEqual((ack["event"], ack["data"]["ref"]), ("ack", 1))
+        self.assertEqual(ack["data"]["data"]["content"], "hello")
+        self.assertEqual(
+            await self.receive_events(bob, 2),
+            [("chat", "%d:new" % chat_id), ("user", "new_msg")],
+        )
+
+        await alice.send_json_to(
+            {
+                "event_type": "chat",
+                "event": "update_msg",
+                "chat_id": chat_id,
+                "msg_id": ack["data"]["id"],
+                "data": {"content": "edited", "is_edited": True},
+                "ref": 2,
+            }
+        )
+        ack = await alice.receive_json_from(1)
+        self.assertEqual(ack["data"]["data"]["content"], "edited")
+        frame = await bob.receive_json_from(1)
+        self.assertEqual(frame["event"], "%d:update" % chat_id)
+
+        # events of unknown groups are answered with errors
+        await alice.send_json_to(
+            {
+                "event_type": "group",
+                "event": "send_msg",
+                "group_id": 0,
+                "data": {"content": "hello"},
+                "ref": 3,
+            }
+        )
+        error = await alice.receive_json_from(1)
+        self.assertEqual((error["event"], error["data"]["ref"]), ("error", 3))
+        for communicator in (alice, bob):
+            await communicator.disconnect()
+
+    async def test_subscribe_all(self):
+        alice = await self.connect(self.alice, "?subscribe=all")
+        bob = await self.connect(self.bob)
+        await bob.send_json_to(
+            {
+                "event_type": "group",
+                "event": "send_msg",
+                "group_id": self.group.pk,
+                "data": {"content": "hello"},
+                "ref": 1,
+            }
+        )
+        ack = await bob.receive_json_from(1)
+        self.assertEqual(ack["event"], "ack")
+        # group events reach the session without connecting to the group
+        self.assertEqual(
+            await self.receive_events(alice, 2),
+            [("group", "new_msg"), ("user", "new_msg")],
+        )
+        for communicator in (alice, bob):
+            await communicator.disconnect()
@@ -0,0 +1,62 @@
+from django.test import TestCase
+
+from rest_framework.test import APIClient
+
+from ..models import User, PChat, Group, Contact
+from .test_outbox import create_user
+
+
+class ContactTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol, self.dave = [
+            create_user(name) for name in ("alice", "bob", "carol", "dave")
+        ]
+        self.chat = PChat.objects.create(from_user=self.alice, to_user=self.bob)
+        self.chat2 = PChat.objects.create(from_user=self.carol, to_user=self.alice)
+
+    def test_adjacency(self):
+        self.assertEqual(
+            set(Contact.objects.values_list("user", "contact", "chat")),
+            {
+                (self.alice.pk, self.bob.pk, self.chat.pk),
+                (self.bob.pk, self.alice.pk, self.chat.pk),
+                (self.carol.pk, self.alice.pk, self.chat2.pk),
+                (self.alice.pk, self.carol.pk, self.chat2.pk),
+            },
+        )
+        self.assertEqual(set(self.alice.chatted_people), {self.bob, self.carol})
+        self.assertTrue(self.bob.has_chat(self.alice))
+        self.assertFalse(self.bob.has_chat(self.carol))
+
+        self.chat2.delete()
+        self.assertFalse(self.alice.has_chat(self.carol))
+        self.assertFalse(Contact.objects.filter(chat=self.chat2.pk).exists())
+
+    def test_search(self):
+        friends = User.objects.search_friends("", self.alice)
+        self.assertEqual(
+            {user.pk: user.chat_id for user in friends},
+            {self.bob.pk: self.chat.pk, self.carol.pk: self.chat2.pk},
+        )
+        friends = User.objects.search_friends("bo", self.alice)
+        # friends are joined by contacts only
+        self.assertEqual(str(friends.query).count("JOIN"), 1)
+        self.assertEqual([user.pk for user in friends], [self.bob.pk])
+        people = User.objects.search_people("", self.bob)
+        self.assertEqual({user.pk for user in people}, {self.carol.pk, self.dave.pk})
+        users = User.objects.all().annotate_chat(self.bob)
+        self.assertEqual(users.get(pk=self.alice.pk).chat_id, self.chat.pk)
+        self.assertIsNone(users.get(pk=self.carol.pk).chat_id)
+
+    def test_invites(self):
+        group = Group.objects.create(name="group", owner=self.alice)
+        group.setup_group()
+        group.members.create(user=self.bob, role=group.default_role)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.get("/api/groups/%d/invites/" % group.pk)
+        self.assertEqual(response.status_code, 200, response.content)
+        # contacts that are not members yet
+        self.assertEqual(
+            [user["id"] for user in response.data["results"]], [self.carol.pk]
+        )
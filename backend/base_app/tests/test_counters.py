@@ -0,0 +1,98 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models import Group, GroupBan
+from ..presence import presence
+from ..api.counters import OnlineCounters
+from .test_outbox import create_user
+
+
+class OnlineCountersTests(TestCase):
+    def setUp(self):
+        self.owner = create_user("alice")
+        self.members = [create_user("bob"), create_user("carol")]
+        self.groups = [
+            Group.objects.create(name="group%d" % i, owner=self.owner) for i in range(2)
+        ]
+        for group in self.groups:
+            group.setup_group()
+            for user in self.members:
+                group.members.create(user=user, role=group.default_role)
+
+    def online_counts(self) -> list:
+        return [
+            Group.objects.values_list("online_count", flat=True).get(pk=group.pk)
+            for group in self.groups
+        ]
+
+    def test_batch(self):
+        counters = OnlineCounters(window=60)
+        bob, carol = self.members
+        with mock.patch.object(counters, "schedule") as schedule:
+            counters.add([bob.pk], 1)
+            counters.add([carol.pk], 1)
+            # reconnecting user doesn't touch its groups
+            counters.add([self.owner.pk], 1)
+            counters.add([self.owner.pk], -1)
+        schedule.assert_called_once()
+        with self.assertNumQueries(3):
+            self.assertEqual(counters.flush(), 2)
+        self.assertEqual(self.online_counts(), [2, 2])
+
+        with mock.patch.object(counters, "schedule"):
+            counters.add([bob.pk, self.owner.pk], -1)
+            counters.add([self.owner.pk], 1)
+        counters.flush()
+        self.assertEqual(self.online_counts(), [1, 1])
+        self.assertFalse(counters.pending)
+
+    def test_without_server_loop(self):
+        counters = OnlineCounters(window=60)
+        counters.add([self.owner.pk], 1)
+        self.assertEqual(self.online_counts(), [1, 1])
+        self.assertFalse(counters.pending)
+
+
+class MemberCountsTests(TestCase):
+    def setUp(self):
+        self.owner = create_user("alice")
+        self.group = Group.objects.create(name="group", owner=self.owner)
+        self.group.setup_group()
+
+    def counts(self) -> tuple:
+        return Group.objects.values_list("member_count", "online_count").get(
+            pk=self.group.pk
+        )
+
+    def test_membership_changes(self):
+        bob = create_user("bob")
+        self.assertEqual(self.counts(), (1, 0))
+        presence.connect(bob.pk, "session")
+        self.addCleanup(presence.disconnect, bob.pk, "session")
+        self.group.members.create(user=bob, role=self.group.default_role)
+        self.assertEqual(self.counts(), (2, 1))
+
+        ban = GroupBan.objects.create(group=self.group, user=bob, banned_by=self.owner)
+        self.assertEqual(self.counts(), (1, 0))
+        # banned members going offline don't change counters
+        Group.objects.shift_online([bob.pk], -1)
+        self.assertEqual(self.counts(), (1, 0))
+        ban.delete()
+        self.assertEqual(self.counts(), (2, 1))
+
+        self.group.members.filter(user=bob).delete()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_counters_are_kept_on_save(self):
+        Group.objects.filter(pk=self.group.pk).shift_counts(5)
+        self.group.description = "description"
+        self.group.save()
+        self.assertEqual(self.counts(), (6, 0))
+        Group.objects.filter(pk=self.group.pk).shift_counts(-10, -10)
+        self.assertEqual(self.counts(), (0, 0))
+
+        call_command("repair_group_counts", stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 0))
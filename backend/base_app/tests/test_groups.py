@@ -0,0 +1,186 @@
+from datetime import timedelta
+from itertools import product
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from ..cache import group_roles
+from ..api.outbox import dispatcher
+from ..models import Group, GroupRole, GroupMember, GroupMessage
+from .test_outbox import create_user
+
+
+class GroupMixin:
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user("alice")
+        self.group = Group.objects.create(name="group", owner=self.owner)
+        self.group.setup_group()
+
+    def add_member(self, username: str, role: GroupRole = None) -> GroupMember:
+        return GroupMember.objects.create(
+            group=self.group,
+            user=create_user(username),
+            role=role or self.group.default_role,
+        )
+
+
+class RolePermissionTests(GroupMixin, TestCase):
+    def legacy_perm(self, role: GroupRole, perm: str) -> bool:
+        return getattr(role, perm, False) or role.super_admin or role.is_owner
+
+    def test_bitmask_matches_flags(self):
+        perms = GroupRole.PERMISSIONS[:4]
+        for i, flags in enumerate(product((False, True), repeat=len(perms))):
+            GroupRole.objects.create(
+                group=self.group,
+                name="role%d" % i,
+                super_admin=i == 3,
+                created_by=self.owner,
+                **dict(zip(perms, flags)),
+            )
+        roles = list(self.group.roles.all())
+        for role in roles:
+            record = [getattr(role, field) for field in GroupRole.RECORD_FIELDS]
+            cached = GroupRole.from_record(self.group.pk, record)
+            for perm in GroupRole.PERMISSIONS + ("unknown",):
+                self.assertEqual(role.has_perm(perm), self.legacy_perm(role, perm))
+                self.assertEqual(cached.has_perm(perm), self.legacy_perm(role, perm))
+        for perm in GroupRole.PERMISSIONS + ("unknown",):
+            with_perm = self.group.roles.filter(GroupRole.perm_q(perm))
+            self.assertEqual(
+                set(with_perm.values_list("pk", flat=True)),
+                {role.pk for role in roles if self.legacy_perm(role, perm)},
+            )
+
+    def test_synced_on_update_fields(self):
+        role = self.group.default_role
+        role.ban_user = True
+        role.save(update_fields=["ban_user"])
+        role.refresh_from_db()
+        self.assertEqual(role.permissions, role.pack_permissions())
+        self.assertTrue(role.has_perm("ban_user"))
+
+        member = self.add_member("bob")
+        members = GroupMember.objects.filter(group=self.group)
+        self.assertEqual(
+            set(members.with_perm("ban_user").values_list("user", flat=True)),
+            {self.owner.pk, member.user_id},
+        )
+        self.assertEqual(
+            set(members.with_perm("kick_user").values_list("user", flat=True)),
+            {self.owner.pk},
+        )
+
+
+class RoleCacheTests(GroupMixin, TestCase):
+    def test_cached_roles(self):
+        member = self.add_member("bob")
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(
+            group.get_member_roles(self.owner, member.user_id).keys(),
+            {self.owner.pk, member.user_id},
+        )
+        # roles are memoized by the instance and cached for other instances
+        with self.assertNumQueries(0):
+            self.assertTrue(group.can_send(member.user_id))
+            group = Group(pk=self.group.pk)
+            self.assertTrue(group.can_kick(self.owner.pk, member.user_id))
+            self.assertFalse(group.can_kick(member.user_id, self.owner.pk))
+        self.assertGreater(group_roles.stats.hits, 0)
+
+    @mock.patch.object(dispatcher, "submit")
+    def test_invalidated_on_change(self, submit):
+        member = self.add_member("bob")
+        self.assertTrue(Group.objects.get(pk=self.group.pk).can_send(member.user_id))
+        role = self.group.default_role
+        role.send_msg = False
+        with self.captureOnCommitCallbacks(execute=True):
+            role.save()
+        self.assertFalse(Group.objects.get(pk=self.group.pk).can_send(member.user_id))
+
+        member.role = self.group.roles.get(is_owner=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+        self.assertTrue(Group.objects.get(pk=self.group.pk).can_send(member.user_id))
+        # non members have no permissions
+        self.assertFalse(self.group.can_send(create_user("carol").pk))
+
+
+class MemberCapabilitiesTests(GroupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        moderator = GroupRole.objects.create(
+            group=self.group,
+            name="moderator",
+            priority=50,
+            kick_user=True,
+            ban_user=True,
+            created_by=self.owner,
+        )
+        self.moderator = self.add_member("bob", moderator).user
+        self.member = self.add_member("carol").user
+        for i in range(5):
+            self.add_member("member%d" % i)
+
+    def members(self, viewer, **params) -> list:
+        client = APIClient()
+        client.force_authenticate(viewer)
+        url = "/api/groups/%d/members/" % self.group.pk
+        response = client.get(url, {"limit": 50, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["results"]
+
+    def test_matches_permission_checks(self):
+        group = Group.objects.get(pk=self.group.pk)
+        for viewer in (self.owner, self.moderator, self.member):
+            for member in self.members(viewer, capabilities=1):
+                user_id = member["user"]["id"]
+                self.assertEqual(
+                    member["can_kick"], group.can_kick(viewer.pk, user_id), viewer
+                )
+                self.assertEqual(
+                    member["can_ban"], group.can_ban(viewer.pk, user_id), viewer
+                )
+                self.assertEqual(
+                    member["can_manage_role"],
+                    group.manage_role_over(viewer.pk, user_id),
+                    viewer,
+                )
+
+    def test_annotated_in_one_query(self):
+        group = Group.objects.get(pk=self.group.pk)
+        role = group.get_user_role(self.moderator.pk)
+        with self.assertNumQueries(1):
+            members = list(group.members.annotate_capabilities(role))
+        kickable = {m.user_id for m in members if m.can_kick}
+        self.assertEqual(len(kickable), 6)
+        self.assertNotIn(self.owner.pk, kickable)
+        self.assertNotIn("can_kick", self.members(self.member)[0])
+
+
+class MemberActivityTests(GroupMixin, TestCase):
+    def test_members_by_activity(self):
+        bob, carol = self.add_member("bob"), self.add_member("carol")
+        hour_ago = timezone.now() - timedelta(hours=1)
+        self.group.members.update(last_activity=hour_ago)
+        msg = GroupMessage.objects.create(group=self.group, owner=bob.user, content="a")
+        bob.refresh_from_db()
+        self.assertEqual(bob.last_activity, msg.created)
+
+        client = APIClient()
+        client.force_authenticate(carol.user)
+        url = "/api/groups/%d/members/" % self.group.pk
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.data["results"][0]["user"]["id"], bob.user_id)
+        # members are ordered without scanning messages
+        self.assertFalse(
+            any("base_app_groupmessage" in q["sql"] for q in queries.captured_queries)
+        )
@@ -0,0 +1,91 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIClient
+
+from ..models import PChat, PMessage, Group, GroupMessage, Inbox
+from .test_outbox import create_user
+
+
+class UnreadTests(TestCase):
+    def setUp(self):
+        self.owner = create_user("alice")
+        self.reader = create_user("bob")
+
+    def test_chat_counters(self):
+        chat = PChat.objects.create(from_user=self.owner, to_user=self.reader)
+        messages = [
+            PMessage.objects.create(chat=chat, owner=self.owner, content=str(i))
+            for i in range(3)
+        ]
+        PMessage.objects.create(chat=chat, owner=self.reader, content="reply")
+        entry = Inbox.objects.filter(chat=chat, user=self.reader)
+        self.assertEqual(entry.get().unread, 3)
+
+        Inbox.objects.read(self.reader, messages[0])
+        self.assertEqual(entry.get().unread, 2)
+        messages[-1].delete()
+        self.assertEqual(entry.get().unread, 1)
+        self.assertEqual(
+            PChat.objects.all().annotate_unread(self.reader).get().unread, 1
+        )
+
+    def test_group_unread_from_watermark(self):
+        group = Group.objects.create(name="group", owner=self.owner)
+        group.setup_group()
+        group.members.create(user=self.reader, role=group.default_role)
+        messages = [
+            GroupMessage.objects.create(group=group, owner=self.owner, content=str(i))
+            for i in range(3)
+        ]
+        GroupMessage.objects.create(group=group, owner=self.reader, content="reply")
+        # group messages don't update counters of members
+        self.assertFalse(Inbox.objects.all().groups().exclude(unread=0).exists())
+
+        groups = Group.objects.all().annotate_unread(self.reader)
+        self.assertEqual(groups.get().unread, 3)
+        Inbox.objects.read(self.reader, messages[1])
+        self.assertEqual(groups.get().unread, 1)
+        self.assertEqual(
+            Group.objects.all().annotate_unread(self.owner).get().unread, 1
+        )
+
+        # deleted message is not counted anymore
+        messages[-1].delete()
+        self.assertEqual(groups.get().unread, 0)
+        missing, stale, orphan = Inbox.objects.diff([self.owner.pk, self.reader.pk])
+        self.assertEqual((missing, stale, orphan), ([], [], []))
+
+
+class LatestMessageTests(TestCase):
+    def setUp(self):
+        self.user = create_user("alice")
+        self.chat = PChat.objects.create(
+            from_user=self.user, to_user=create_user("bob")
+        )
+        self.group = Group.objects.create(name="group", owner=self.user)
+        self.group.setup_group()
+        for i in range(5):
+            PMessage.objects.create(chat=self.chat, owner=self.user, content="p%d" % i)
+            GroupMessage.objects.create(
+                group=self.group, owner=self.user, content="g%d" % i
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_only_latest_fetched(self):
+        for url, content in (
+            ("/api/chats/", "p4"),
+            ("/api/groups/", "g4"),
+            ("/api/all-chats/", "g4"),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response.data["results"][0]["latest"]["content"], content)
+            # latest messages are fetched with a window function per chat
+            sql = [
+                q["sql"] for q in queries.captured_queries if "ROW_NUMBER" in q["sql"]
+            ]
+            self.assertTrue(sql, url)
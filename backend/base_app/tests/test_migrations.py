@@ -0,0 +1,315 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Migrates database back to 'migrate_from' to test data migrations"""
+
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        self.apps = self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self, name: str):
+        """Migrates app to given migration and returns its models registry"""
+        targets = [("base_app", name)]
+        MigrationExecutor(connection).migrate(targets)
+        return MigrationExecutor(connection).loader.project_state(targets).apps
+
+
+class ReadWatermarksMigrationTests(MigrationTestCase):
+    migrate_from = "0004_message_order_indexes"
+    migrate_to = "0006_read_watermarks"
+
+    def create_messages(self, model, count: int, seen: int, **kwargs) -> list:
+        now = timezone.now()
+        return [
+            model.objects.create(
+                content=str(i),
+                seen=i < seen,
+                created=now + timedelta(seconds=i),
+                edited=now,
+                **kwargs,
+            )
+            for i in range(count)
+        ]
+
+    def test_read_state_is_kept(self):
+        User = self.apps.get_model("base_app", "User")
+        PChat = self.apps.get_model("base_app", "PChat")
+        PMessage = self.apps.get_model("base_app", "PMessage")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+        GroupMember = self.apps.get_model("base_app", "GroupMember")
+        GroupMessage = self.apps.get_model("base_app", "GroupMessage")
+
+        alice, bob = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob")
+        ]
+        chat = PChat.objects.create(from_user=alice, to_user=bob)
+        messages = self.create_messages(PMessage, 4, 2, chat=chat, owner=alice)
+        empty_chat = PChat.objects.create(
+            from_user=bob, to_user=User.objects.create(username="carol")
+        )
+        group = Group.objects.create(name="group", owner=alice)
+        role = GroupRole.objects.create(group=group, name="member")
+        GroupMember.objects.create(group=group, user=bob, role=role)
+        group_messages = self.create_messages(
+            GroupMessage, 2, 0, group=group, owner=alice
+        )
+
+        Inbox = self.migrate(self.migrate_to).get_model("base_app", "Inbox")
+        entries = Inbox.objects.filter(chat_id=chat.pk)
+        # companion has read up to the last seen message
+        bob_entry = entries.get(user_id=bob.pk)
+        self.assertEqual(bob_entry.last_read_id, messages[1].pk)
+        self.assertEqual(bob_entry.unread, 2)
+        self.assertEqual(bob_entry.last_message_id, messages[-1].pk)
+        alice_entry = entries.get(user_id=alice.pk)
+        self.assertEqual(alice_entry.unread, 0)
+        self.assertEqual(alice_entry.last_read, chat.created)
+
+        empty_entry = Inbox.objects.get(chat_id=empty_chat.pk, user_id=bob.pk)
+        self.assertEqual(empty_entry.last_activity, empty_chat.created)
+        self.assertIsNone(empty_entry.last_message_id)
+
+        group_entry = Inbox.objects.get(group_id=group.pk, user_id=bob.pk)
+        self.assertEqual(group_entry.last_read_id, group_messages[-1].pk)
+        self.assertEqual(group_entry.unread, 0)
+
+
+class RepairGroupCountsMigrationTests(MigrationTestCase):
+    migrate_from = "0014_outboxevent_base_url"
+    migrate_to = "0015_repair_group_counts"
+
+    def test_counts_are_repaired(self):
+        User = self.apps.get_model("base_app", "User")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+        GroupMember = self.apps.get_model("base_app", "GroupMember")
+        GroupBan = self.apps.get_model("base_app", "GroupBan")
+
+        alice, bob, carol = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob", "carol")
+        ]
+        group = Group.objects.create(name="group", owner=alice)
+        empty_group = Group.objects.create(name="empty", owner=alice, member_count=3)
+        role = GroupRole.objects.create(group=group, name="member")
+        for user in (alice, bob, carol):
+            GroupMember.objects.create(group=group, user=user, role=role)
+        GroupBan.objects.create(group=group, user=carol, banned_by=alice)
+
+        online = mock.patch(
+            "base_app.presence.presence.online_ids",
+            lambda ids: {bob.pk, carol.pk} & set(ids),
+        )
+        with online:
+            Group = self.migrate(self.migrate_to).get_model("base_app", "Group")
+        counts = Group.objects.values_list("member_count", "online_count")
+        self.assertEqual(counts.get(pk=group.pk), (2, 1))
+        self.assertEqual(counts.get(pk=empty_group.pk), (0, 0))
+
+
+class InboxMigrationTests(MigrationTestCase):
+    migrate_from = "0004_message_order_indexes"
+    migrate_to = "0005_inbox"
+
+    def test_entries_of_allowed_members(self):
+        User = self.apps.get_model("base_app", "User")
+        PChat = self.apps.get_model("base_app", "PChat")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+        GroupMember = self.apps.get_model("base_app", "GroupMember")
+        GroupBan = self.apps.get_model("base_app", "GroupBan")
+        GroupMessage = self.apps.get_model("base_app", "GroupMessage")
+
+        alice, bob, carol = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob", "carol")
+        ]
+        chat = PChat.objects.create(from_user=alice, to_user=bob)
+        group = Group.objects.create(name="group", owner=alice)
+        role = GroupRole.objects.create(group=group, name="member")
+        for user in (alice, bob, carol):
+            GroupMember.objects.create(group=group, user=user, role=role)
+        GroupBan.objects.create(group=group, user=carol, banned_by=alice)
+        now = timezone.now()
+        msg = GroupMessage.objects.create(
+            group=group, owner=alice, content="a", created=now, edited=now
+        )
+
+        Inbox = self.migrate(self.migrate_to).get_model("base_app", "Inbox")
+        chat_entries = Inbox.objects.filter(chat_id=chat.pk)
+        self.assertEqual(
+            set(chat_entries.values_list("user_id", flat=True)), {alice.pk, bob.pk}
+        )
+        self.assertEqual(chat_entries.first().last_activity, chat.created)
+        group_entries = Inbox.objects.filter(group_id=group.pk)
+        # banned members don't have entries
+        self.assertEqual(
+            set(group_entries.values_list("user_id", flat=True)), {alice.pk, bob.pk}
+        )
+        entry = group_entries.get(user_id=bob.pk)
+        self.assertEqual(
+            (entry.last_message_id, entry.last_activity), (msg.pk, msg.created)
+        )
+
+
+class RolePermissionsMigrationTests(MigrationTestCase):
+    migrate_from = "0008_trigram_search"
+    migrate_to = "0009_role_permissions"
+
+    def test_bitmask_from_flags(self):
+        User = self.apps.get_model("base_app", "User")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+
+        alice = User.objects.create(username="alice", email="alice@example.com")
+        group = Group.objects.create(name="group", owner=alice)
+        flags = {
+            "member": {},
+            "moderator": {"send_msg": False, "kick_user": True, "ban_user": True},
+            "admin": {"delete_msg": True, "edit_group": True, "manage_role": True},
+        }
+        for name, perms in flags.items():
+            GroupRole.objects.create(group=group, name=name, **perms)
+
+        apps = self.migrate(self.migrate_to)
+        GroupRole = apps.get_model("base_app", "GroupRole")
+        permissions = dict(GroupRole.objects.values_list("name", "permissions"))
+        # send_msg and add_user are granted by default
+        self.assertEqual(
+            permissions,
+            {"member": 0b1001, "moderator": 0b11100, "admin": 0b11001011},
+        )
+
+
+class GroupCountersMigrationTests(MigrationTestCase):
+    migrate_from = "0009_role_permissions"
+    migrate_to = "0010_group_counters"
+
+    def test_member_counts(self):
+        User = self.apps.get_model("base_app", "User")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+        GroupMember = self.apps.get_model("base_app", "GroupMember")
+        GroupBan = self.apps.get_model("base_app", "GroupBan")
+
+        alice, bob, carol = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob", "carol")
+        ]
+        group = Group.objects.create(name="group", owner=alice)
+        empty_group = Group.objects.create(name="empty", owner=alice)
+        role = GroupRole.objects.create(group=group, name="member")
+        for user in (alice, bob, carol):
+            GroupMember.objects.create(group=group, user=user, role=role)
+        GroupBan.objects.create(group=group, user=carol, banned_by=alice)
+
+        Group = self.migrate(self.migrate_to).get_model("base_app", "Group")
+        counts = Group.objects.values_list("member_count", "online_count")
+        self.assertEqual(counts.get(pk=group.pk), (2, 0))
+        self.assertEqual(counts.get(pk=empty_group.pk), (0, 0))
+
+
+class MemberLastActivityMigrationTests(MigrationTestCase):
+    migrate_from = "0010_group_counters"
+    migrate_to = "0011_member_last_activity"
+
+    def test_latest_message_or_joint(self):
+        User = self.apps.get_model("base_app", "User")
+        Group = self.apps.get_model("base_app", "Group")
+        GroupRole = self.apps.get_model("base_app", "GroupRole")
+        GroupMember = self.apps.get_model("base_app", "GroupMember")
+        GroupMessage = self.apps.get_model("base_app", "GroupMessage")
+
+        alice, bob = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob")
+        ]
+        group = Group.objects.create(name="group", owner=alice)
+        role = GroupRole.objects.create(group=group, name="member")
+        members = {
+            user.pk: GroupMember.objects.create(group=group, user=user, role=role)
+            for user in (alice, bob)
+        }
+        now = timezone.now()
+        messages = [
+            GroupMessage.objects.create(
+                group=group,
+                owner=alice,
+                content=str(i),
+                created=now + timedelta(minutes=i),
+                edited=now,
+            )
+            for i in range(1, 3)
+        ]
+
+        apps = self.migrate(self.migrate_to)
+        GroupMember = apps.get_model("base_app", "GroupMember")
+        activity = dict(GroupMember.objects.values_list("user_id", "last_activity"))
+        self.assertEqual(activity[alice.pk], messages[-1].created)
+        self.assertEqual(activity[bob.pk], members[bob.pk].joint)
+
+
+class ContactMigrationTests(MigrationTestCase):
+    migrate_from = "0011_member_last_activity"
+    migrate_to = "0014_outboxevent_base_url"
+
+    def test_contacts_of_chats(self):
+        User = self.apps.get_model("base_app", "User")
+        PChat = self.apps.get_model("base_app", "PChat")
+
+        alice, bob, carol = [
+            User.objects.create(username=name, email="%s@example.com" % name)
+            for name in ("alice", "bob", "carol")
+        ]
+        chats = [
+            PChat.objects.create(from_user=alice, to_user=bob),
+            PChat.objects.create(from_user=carol, to_user=alice),
+        ]
+
+        apps = self.migrate(self.migrate_to)
+        Contact = apps.get_model("base_app", "Contact")
+        self.assertEqual(
+            set(Contact.objects.values_list("user_id", "contact_id", "chat_id")),
+            {
+                (alice.pk, bob.pk, chats[0].pk),
+                (bob.pk, alice.pk, chats[0].pk),
+                (carol.pk, alice.pk, chats[1].pk),
+                (alice.pk, carol.pk, chats[1].pk),
+            },
+        )
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Contact._meta.db_table
+            )
+        self.assertIn("contact_reverse_idx", constraints)
+        self.assertIn("unique_contact", constraints)
+
+
+class MessageSearchMigrationTests(MigrationTestCase):
+    migrate_from = "0006_read_watermarks"
+    migrate_to = "0007_message_search"
+
+    def test_search_indexes(self):
+        self.migrate(self.migrate_to)
+        with connection.cursor() as cursor:
+            for table, name in (
+                ("base_app_pmessage", "pmsg_content_search_idx"),
+                ("base_app_groupmessage", "group_msg_content_search_idx"),
+            ):
+                constraints = connection.introspection.get_constraints(cursor, table)
+                self.assertEqual(constraints[name]["type"], "gin")
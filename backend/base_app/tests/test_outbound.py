@@ -0,0 +1,75 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from ..api.outbound import OutboundQueue, OutboundStats
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.stats = OutboundStats()
+
+    async def send(self, text):
+        self.sent.append(text)
+
+    def make(self, **kwargs) -> OutboundQueue:
+        return OutboundQueue(self.send, stats=self.stats, **kwargs)
+
+    async def flush(self):
+        await asyncio.sleep(0.01)
+
+    def test_coalesce_and_overflow(self):
+        queue = self.make(high_water=2, limit=3)
+        self.assertTrue(queue.put("p1", "presence", coalesce="presence:1"))
+        self.assertTrue(queue.put("p2", "presence", coalesce="presence:1"))
+        self.assertTrue(queue.put("m1", "chat", ref=1))
+        # above high-water mark
+        self.assertTrue(queue.put("p3", "presence", coalesce="presence:2"))
+        self.assertTrue(queue.put("m2", "chat", ref=2))
+        self.assertFalse(queue.put("m3", "chat", ref=3))
+        self.assertEqual(
+            self.stats.as_dict(),
+            {"dropped": {"presence": 1, "chat": 1}, "coalesced": {"presence": 1}},
+        )
+
+    def test_unacknowledged_frames(self):
+        async def run():
+            queue = self.make(high_water=2, limit=4)
+            queue.ack(("chat_1", 0))
+            queue.start()
+            for seq in range(1, 4):
+                queue.put("m%d" % seq, "chat", ref=("chat_1", seq))
+            await self.flush()
+            # writer waits for client to acknowledge written frames
+            self.assertEqual(self.sent, ["m1", "m2"])
+            self.assertEqual(queue.backlog, 3)
+            # droppable frames are dropped while client is behind
+            queue.put("p1", "presence", coalesce="presence:1")
+            self.assertEqual(self.stats.dropped["presence"], 1)
+            self.assertTrue(queue.put("m4", "chat", ref=("chat_1", 4)))
+            self.assertFalse(queue.put("m5", "chat", ref=("chat_1", 5)))
+
+            queue.ack(("chat_1", 1))
+            await self.flush()
+            self.assertEqual(self.sent, ["m1", "m2", "m3"])
+            queue.ack(("chat_1", 3))
+            await self.flush()
+            self.assertEqual(self.sent, ["m1", "m2", "m3", "m4"])
+            self.assertEqual(list(queue.unacked), [("chat_1", 4)])
+            queue.stop()
+
+        asyncio.run(run())
+
+    def test_not_acknowledging_client(self):
+        async def run():
+            queue = self.make(high_water=2, limit=3)
+            queue.start()
+            for seq in range(1, 6):
+                self.assertTrue(queue.put("m%d" % seq, "chat", ref=("chat_1", seq)))
+                await self.flush()
+            self.assertEqual(len(self.sent), 5)
+            self.assertEqual(queue.backlog, 0)
+            queue.stop()
+
+        asyncio.run(run())
@@ -0,0 +1,107 @@
+import asyncio
+from unittest import mock
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase
+
+from rest_framework.test import APIClient
+
+from ..models import User, PChat, PMessage, Group, GroupMember, OutboxEvent
+from ..api.outbox import OutboxDispatcher, ServerSession, claim_events
+
+
+def create_user(username: str) -> User:
+    return User.objects.create_user(
+        username=username, email="%s@example.com" % username, password="pw"
+    )
+
+
+class OutboxEventTests(TestCase):
+    def setUp(self):
+        self.user = create_user("alice")
+        self.chat = PChat.objects.create(
+            from_user=self.user, to_user=create_user("bob")
+        )
+        OutboxEvent.objects.all().delete()
+
+    def test_recorded_with_change(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            msg = PMessage.objects.create(chat=self.chat, owner=self.user, content="a")
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event_type, event.event), ("chat", "send"))
+        self.assertEqual(event.kwargs, {"chat_id": self.chat.pk, "msg_id": msg.pk})
+        # event is published only after commit
+        self.assertEqual(len(callbacks), 1)
+
+    def test_rolled_back_with_change(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                PMessage.objects.create(chat=self.chat, owner=self.user, content="a")
+                raise ValueError
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertEqual(callbacks, [])
+
+    def test_absolute_urls(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = "/api/chats/%d/messages/" % self.chat.pk
+        response = client.post(url, {"content": "a"})
+        self.assertEqual(response.status_code, 201, response.content)
+        event = OutboxEvent.objects.get(event="send")
+        self.assertEqual(event.base_url, "http://testserver/")
+        data = ServerSession.hydrate(event)["data"]
+        self.assertTrue(data["url"].startswith("http://testserver/"), data["url"])
+
+    def test_claim(self):
+        events = [
+            OutboxEvent.objects.create(event_type="chat", event="new", kwargs={})
+            for _ in range(3)
+        ]
+        # events claimed by other publisher are skipped until the lease expires
+        self.assertEqual(claim_events(events[:2]), events[:2])
+        self.assertEqual(claim_events(events), events[2:])
+        expired = timezone.now() - timedelta(seconds=OutboxEvent.CLAIM_LEASE + 1)
+        OutboxEvent.objects.filter(pk=events[0].pk).update(claimed=expired)
+        self.assertEqual(claim_events(events), events[:1])
+
+    def test_member_events(self):
+        group = Group.objects.create(name="group", owner=self.user)
+        group.setup_group()
+        # owner joins without event
+        self.assertFalse(OutboxEvent.objects.filter(event_type="group").exists())
+        member = GroupMember(group=group, user=self.chat.to_user)
+        member.role_id = group.default_role.pk
+        member.save()
+        event = OutboxEvent.objects.get(event_type="group")
+        self.assertEqual(event.event, "join")
+
+
+class OutboxDispatcherTests(SimpleTestCase):
+    def test_publish_in_commit_order(self):
+        published = []
+
+        async def publish_events(events):
+            # batch is published across several loop iterations
+            for event in events:
+                await asyncio.sleep(0)
+                published.append(event)
+
+        async def run():
+            dispatcher = OutboxDispatcher()
+            dispatcher.bind(asyncio.get_running_loop())
+            for batch in ([1, 2], [3], [4, 5]):
+                dispatcher.submit(batch)
+            await asyncio.sleep(0.05)
+            self.assertEqual(published, [1, 2, 3, 4, 5])
+            self.assertTrue(dispatcher.task.done())
+
+        with mock.patch("base_app.api.outbox.publish_events", publish_events):
+            asyncio.run(run())
+
+    def test_publish_in_place_without_loop(self):
+        with mock.patch("base_app.api.outbox.dispatch_events") as dispatch_events:
+            OutboxDispatcher().submit([1])
+        dispatch_events.assert_called_once_with([1])
@@ -0,0 +1,186 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIClient
+
+from ..models import User, PChat, PMessage, Group, GroupMessage
+from .test_outbox import create_user
+
+
+def result_ids(response) -> list:
+    return [result["id"] for result in response.data["results"]]
+
+
+class MessageCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = create_user("alice")
+        self.chat = PChat.objects.create(
+            from_user=self.user, to_user=create_user("bob")
+        )
+        for i in range(25):
+            PMessage.objects.create(chat=self.chat, owner=self.user, content=str(i))
+        self.ids = list(
+            self.chat.messages.order_by("-created", "-id").values_list("pk", flat=True)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = "/api/chats/%d/messages/" % self.chat.pk
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_pages(self):
+        response = self.get(self.url, limit=10)
+        self.assertEqual(result_ids(response), self.ids[:10])
+        self.assertIsNone(response.data["previous"])
+        ids = result_ids(response)
+        while response.data["next"]:
+            response = self.get(response.data["next"])
+            ids += result_ids(response)
+        self.assertEqual(ids, self.ids)
+
+    def test_cursors(self):
+        response = self.get(self.url, limit=5, before=self.ids[10])
+        self.assertEqual(result_ids(response), self.ids[11:16])
+        response = self.get(response.data["previous"])
+        self.assertEqual(result_ids(response), self.ids[6:11])
+
+        response = self.get(self.url, limit=5, after=self.ids[3])
+        self.assertEqual(result_ids(response), self.ids[:3])
+        self.assertIsNone(response.data["previous"])
+
+        response = self.get(self.url, limit=6, around=self.ids[10])
+        self.assertEqual(result_ids(response), self.ids[7:13])
+        self.assertIn("before=%d" % self.ids[12], response.data["next"])
+        self.assertIn("after=%d" % self.ids[7], response.data["previous"])
+
+        response = self.get(self.url, limit=5, offset=2)
+        self.assertEqual(result_ids(response), self.ids[2:7])
+        self.assertIn("after=%d" % self.ids[2], response.data["previous"])
+
+    def test_invalid_cursors(self):
+        response = self.client.get(self.url, {"before": "x"})
+        self.assertEqual(response.status_code, 404)
+        # messages of other chats are not cursors
+        other = PChat.objects.create(from_user=self.user, to_user=create_user("carol"))
+        msg = PMessage.objects.create(chat=other, owner=self.user, content="a")
+        self.assertEqual(result_ids(self.get(self.url, around=msg.pk)), [])
+
+    def test_group_messages(self):
+        group = Group.objects.create(name="group", owner=self.user)
+        group.setup_group()
+        for i in range(10):
+            GroupMessage.objects.create(group=group, owner=self.user, content=str(i))
+        ids = list(
+            group.messages.order_by("-created", "-id").values_list("pk", flat=True)
+        )
+        url = "/api/groups/%d/messages/" % group.pk
+        response = self.get(url, limit=4, around=ids[5])
+        self.assertEqual(result_ids(response), ids[3:7])
+        response = self.get(response.data["next"])
+        self.assertEqual(result_ids(response), ids[7:])
+
+
+class MessageSearchPaginationTests(TestCase):
+    def setUp(self):
+        self.user = create_user("alice")
+        bob = create_user("bob")
+        chat = PChat.objects.create(from_user=self.user, to_user=bob)
+        for i in range(5):
+            owner = bob if i % 2 else self.user
+            PMessage.objects.create(chat=chat, owner=owner, content="hello %d" % i)
+        self.group = Group.objects.create(name="group", owner=self.user)
+        self.group.setup_group()
+        for i in range(3):
+            GroupMessage.objects.create(
+                group=self.group, owner=self.user, content="hello hello %d" % i
+            )
+        # messages of other users are not searched
+        stranger = create_user("carol")
+        PMessage.objects.create(
+            chat=PChat.objects.create(from_user=bob, to_user=stranger),
+            owner=stranger,
+            content="hello stranger",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = "/api/search/messages/"
+
+    def search(self, **params) -> list:
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["results"]
+
+    def test_pages(self):
+        response = self.client.get(self.url, {"q": "hello", "limit": 3})
+        results, pages = [], 0
+        while True:
+            pages += 1
+            results += [(r["type"], r["id"]) for r in response.data["results"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(set(results)), 8)
+        # group messages have more matches, so they are ranked first
+        self.assertEqual([type_ for type_, _ in results[:3]], ["group"] * 3)
+
+    def test_filters(self):
+        results = self.search(q="hello", type="group")
+        self.assertEqual({r["type"] for r in results}, {"group"})
+        results = self.search(q="hello 3")
+        self.assertEqual([r["content"] for r in results], ["hello 3"])
+        self.assertEqual(self.search(q="hello", has_file="true"), [])
+        self.assertEqual(self.search(q="hello", until="2000-01-01"), [])
+
+    def test_invalid_params(self):
+        response = self.client.get(self.url, {"q": "hello", "cursor": "x"})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(self.url, {"q": "hello", "file_type": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchPaginationTests(TestCase):
+    def setUp(self):
+        self.user = create_user("alice")
+        users = [create_user("bob%d" % i) for i in range(4)]
+        # groups of the user are not searched
+        for i in range(3):
+            Group.objects.create(
+                name="Bob group %d" % i,
+                owner=users[i],
+                public=True,
+                unique_name="bob_%d" % i,
+            ).setup_group()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/search/", {"q": "bob", "limit": 4})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn("count", response.data)
+        self.assertFalse(any("COUNT(" in q["sql"] for q in queries.captured_queries))
+        results = response.data["results"]
+        response = self.client.get(response.data["next"])
+        results += response.data["results"]
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(
+            sorted(r.get("username") or r["unique_name"] for r in results),
+            ["bob0", "bob1", "bob2", "bob3", "bob_0", "bob_1", "bob_2"],
+        )
+
+    def test_prefix_matches_first(self):
+        create_user("xbob")
+        response = self.client.get("/api/search/", {"q": "bob", "limit": 50})
+        names = [
+            r.get("username") or r["unique_name"] for r in response.data["results"]
+        ]
+        self.assertEqual(len(names), 8)
+        self.assertEqual(names[-1], "xbob")
+        # names are matched case insensitively
+        people = User.objects.search_people("BOB1", self.user)
+        self.assertEqual(people.values_list("username", flat=True)[0], "bob1")
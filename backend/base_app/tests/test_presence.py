@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase
+
+from ..presence import MemoryPresence, RedisPresence
+from ..local_redis import LocalRedis
+
+
+class Clock:
+    """Manually advanced clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class PresenceTests(SimpleTestCase):
+    def make(self, node_id):
+        return MemoryPresence(node_id=node_id)
+
+    def test_sessions(self):
+        presence = self.make("node")
+        self.assertTrue(presence.connect(1, "a"))
+        self.assertFalse(presence.connect(1, "b"))
+        self.assertTrue(presence.connect(2, "c"))
+        self.assertEqual(presence.sessions_count(1), 2)
+        self.assertEqual(presence.online_ids([1, 2, 3]), {1, 2})
+        self.assertEqual(presence.online_count([1, 3]), 1)
+
+        self.assertFalse(presence.disconnect(1, "a"))
+        self.assertTrue(presence.disconnect(1, "b"))
+        self.assertFalse(presence.disconnect(1, "b"))
+        self.assertFalse(presence.is_online(1))
+
+
+class RedisPresenceTests(PresenceTests):
+    def setUp(self):
+        self.clock = Clock()
+        self.client = LocalRedis(clock=self.clock)
+
+    def make(self, node_id):
+        return RedisPresence(client=self.client, ttl=60, heartbeat=20, node_id=node_id)
+
+    def test_client_path(self):
+        presence = RedisPresence(client="base_app.local_redis.LocalRedis")
+        self.assertIsInstance(presence.client, LocalRedis)
+
+    def test_reap(self):
+        alive, dead = self.make("alive"), self.make("dead")
+        alive.connect(1, "a")
+        dead.connect(1, "b")
+        dead.connect(2, "c")
+
+        # heartbeats are scored by wall clock time
+        self.client.zadd(dead.nodes_key, {dead.node_id: 0})
+        self.assertEqual(alive.reap(), [2])
+        self.assertEqual(alive.online_ids([1, 2]), {1})
+        self.assertEqual(alive.sessions_count(1), 1)
+        # reaper lock is held for a heartbeat interval
+        self.client.zadd(alive.nodes_key, {alive.node_id: 0})
+        self.assertEqual(alive.reap(), [])
+        self.clock.now += 20
+        self.assertEqual(alive.reap(), [1])
@@ -0,0 +1,96 @@
+import asyncio
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from rest_framework.test import APIClient
+
+from ..models import PChat, PMessage, Inbox, OutboxEvent
+from ..api.outbox import dispatcher
+from ..api.receipts import ReadReceipts, receipts as shared_receipts
+from .test_outbox import create_user
+
+
+class ReceiptsMixin:
+    def setUp(self):
+        self.reader = create_user("bob")
+        self.chat = PChat.objects.create(
+            from_user=create_user("alice"), to_user=self.reader
+        )
+        self.messages = [
+            PMessage.objects.create(
+                chat=self.chat, owner=self.chat.from_user, content="m%d" % i
+            )
+            for i in range(3)
+        ]
+        OutboxEvent.objects.all().delete()
+
+    def assert_read(self, msg: PMessage):
+        entry = Inbox.objects.get(user=self.reader, chat=self.chat)
+        self.assertEqual(entry.last_read_id, msg.pk)
+        event = OutboxEvent.objects.get(event="read")
+        self.assertEqual(event.kwargs["msg_id"], msg.pk)
+
+
+class ReadReceiptsTests(ReceiptsMixin, TestCase):
+    def test_coalesce(self):
+        receipts = ReadReceipts(window=60)
+        first, middle, last = self.messages
+        with mock.patch.object(receipts, "schedule") as schedule:
+            for msg in (first, last, middle):
+                receipts.add(self.reader, msg)
+        # only the first receipt of the window schedules a flush
+        schedule.assert_called_once()
+        with self.captureOnCommitCallbacks():
+            self.assertEqual(receipts.flush_user(self.reader.pk), 1)
+        self.assert_read(last)
+        self.assertEqual(receipts.flush_user(self.reader.pk), 0)
+
+    def test_not_moved_watermark(self):
+        receipts = ReadReceipts(window=60)
+        with mock.patch.object(receipts, "schedule"):
+            receipts.add(self.reader, self.messages[-1])
+            receipts.flush_all()
+            receipts.add(self.reader, self.messages[0])
+        self.assertEqual(receipts.flush_all(), 0)
+        self.assertEqual(OutboxEvent.objects.filter(event="read").count(), 1)
+
+    def test_accepted_over_rest(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        msg = self.messages[1]
+        with mock.patch.object(shared_receipts, "add") as add:
+            response = client.patch("/api/messages/%d/" % msg.pk, {"seen": True})
+        # seen state isn't echoed before the receipt is written
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.data)
+        add.assert_called_once_with(self.reader, msg)
+
+
+class ReadReceiptsWindowTests(ReceiptsMixin, TransactionTestCase):
+    def test_flush_on_server_loop(self):
+        receipts = ReadReceipts(window=0.05)
+        writes = []
+        read = Inbox.objects.read
+
+        def count_read(*args):
+            writes.append(args)
+            return read(*args)
+
+        async def run():
+            dispatcher.bind(asyncio.get_running_loop())
+            for msg in self.messages:
+                receipts.add(self.reader, msg)
+            self.assertEqual(writes, [])
+            await asyncio.sleep(0.3)
+
+        with mock.patch.object(dispatcher, "submit"), mock.patch.object(
+            Inbox.objects, "read", count_read
+        ):
+            try:
+                asyncio.run(run())
+            finally:
+                dispatcher.bind(None)
+        self.assertEqual(len(writes), 1)
+        self.assertFalse(receipts.pending)
+        self.assert_read(self.messages[-1])
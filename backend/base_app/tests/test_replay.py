@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..replay import MemoryReplay, RedisReplay
+from ..local_redis import LocalRedis
+from .test_presence import Clock
+
+
+class ReplayTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("base_app.replay.time")
+        self.addCleanup(patcher.stop)
+        fake_time = patcher.start()
+        fake_time.time = fake_time.monotonic = self.clock
+
+    def make(self, **kwargs):
+        return MemoryReplay(**kwargs)
+
+    def publish(self, replay, stream, frame, origin=None) -> int:
+        self.clock.now += 0.001
+        seq = replay.next_seq(stream)
+        replay.append(stream, seq, frame, origin)
+        return seq
+
+    def frames(self, replay, position, session=None) -> list:
+        frames = replay.since(position, session)
+        return None if frames is None else [frame for *_, frame in frames]
+
+    def test_sequences(self):
+        replay = self.make()
+        self.assertEqual(self.publish(replay, "user_1", "a"), 1)
+        self.assertEqual(self.publish(replay, "group_1", "b"), 1)
+        self.assertEqual(self.publish(replay, "user_1", "c"), 2)
+        self.assertEqual(
+            replay.last_seqs(["user_1", "group_1", "chat_1"]),
+            {"user_1": 2, "group_1": 1, "chat_1": 0},
+        )
+
+    def test_resume(self):
+        replay = self.make()
+        self.publish(replay, "user_1", "a")
+        position = replay.last_seqs(["user_1", "group_1", "chat_1"])
+        self.publish(replay, "group_1", "b", origin="s1")
+        self.publish(replay, "user_2", "c")
+        self.publish(replay, "user_1", "d")
+        self.publish(replay, "group_1", "e")
+
+        # frames of streams are replayed in order they were appended
+        self.assertEqual(self.frames(replay, position), ["b", "d", "e"])
+        self.assertEqual(
+            replay.since(position, "s1"), [("user_1", 2, "d"), ("group_1", 2, "e")]
+        )
+        position = replay.last_seqs(position)
+        self.assertEqual(replay.since(position), [])
+        # position ahead of the stream is not valid
+        self.assertIsNone(replay.since({"chat_1": 1}))
+
+    def test_dropped(self):
+        replay = self.make(size=3)
+        for i in range(5):
+            self.publish(replay, "group_1", str(i))
+        self.publish(replay, "user_1", "5")
+
+        self.assertIsNone(replay.since({"user_1": 0, "group_1": 1}))
+        self.assertEqual(
+            self.frames(replay, {"user_1": 0, "group_1": 2}), ["2", "3", "4", "5"]
+        )
+
+    def test_expired(self):
+        replay = self.make(ttl=60)
+        seen = self.publish(replay, "chat_1", "a")
+        self.publish(replay, "chat_1", "b")
+        self.clock.now += 30
+        self.publish(replay, "chat_2", "c")
+        self.clock.now += 31
+
+        # buffer of chat 1 expired with the frame session missed
+        self.assertIsNone(replay.since({"chat_1": seen}))
+        self.assertEqual(self.frames(replay, {"chat_1": 2, "chat_2": 0}), ["c"])
+
+        # new buffer doesn't have frames sent before it
+        last = self.publish(replay, "chat_1", "d")
+        self.assertIsNone(replay.since({"chat_1": seen}))
+        self.assertEqual(self.frames(replay, {"chat_1": last - 1}), ["d"])
+
+        self.clock.now += 61
+        self.assertEqual(replay.since({"chat_1": last, "chat_2": 1}), [])
+        self.assertIsNone(replay.since({"chat_1": last - 1}))
+
+    def test_positions(self):
+        replay = self.make(ttl=60)
+        replay.save_position("s1", {"user_1": 2, "group_1": 5})
+        self.assertEqual(replay.get_position("s1"), {"user_1": 2, "group_1": 5})
+        replay.save_position("s1", {"user_1": 3})
+        self.assertEqual(replay.get_position("s1"), {"user_1": 3})
+        self.assertIsNone(replay.get_position("s2"))
+        self.clock.now += 61
+        self.assertIsNone(replay.get_position("s1"))
+
+
+class RedisReplayTests(ReplayTests):
+    def make(self, **kwargs):
+        return RedisReplay(client=LocalRedis(clock=self.clock), **kwargs)
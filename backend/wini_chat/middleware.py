@@ -1,26 +1,26 @@
 from urllib.parse import parse_qs
 
-from django.db import close_old_connections
-from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 
-from rest_framework_simplejwt.tokens import UntypedToken
-from jwt import decode as jwt_decode
-
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from channels.auth import AuthMiddlewareStack
 
+from base_app.api.authentication import CachedJWTAuthentication
+
+
+# authentication shared with REST API to validate tokens and get users
+authentication = CachedJWTAuthentication()
+
 
 @database_sync_to_async
-def get_user(token_data):
+def get_user(validated_token):
     """
-    Try to get user based on token_data.
+    Try to get user based on validated token.
     If any error is encountered return AnonymousUser
     """
     try:
-        return get_user_model().objects.get(pk=token_data["user_id"])
+        return authentication.get_user(validated_token)
     except Exception as e:
         return AnonymousUser()
 
@@ -31,8 +31,6 @@ class JWTAuthMiddleware(BaseMiddleware):
     """
 
     async def __call__(self, scope, receive, send):
-        # Close old database connections to prevent usage of timed out connections
-        close_old_connections()
         # get query byte string and decode it to normal str
         qs = scope["query_string"].decode()
         # parse query string to dictionary
@@ -41,16 +39,14 @@ class JWTAuthMiddleware(BaseMiddleware):
         try:
             # get the token from parsed dictionary
             token = qr_dict["token"][0]
-            # Validate the token type
-            UntypedToken(token)
+            # Validate and decode the token, validated tokens are cached
+            validated_token = authentication.get_validated_token(token)
         except Exception as e:
             # stop JWT authentication if any error occurred
             print(repr(e))
             return
-        # decode the token using jwt_decode function
-        token_data = jwt_decode(token, settings.SECRET_KEY, ["HS256"])
-        # get user using token_data which contains user id and token info
-        scope["user"] = await get_user(token_data)
+        # get user using validated token which contains user id and token info
+        scope["user"] = await get_user(validated_token)
         return await super().__call__(scope, receive, send)
 
 
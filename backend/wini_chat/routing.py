@@ -6,6 +6,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.urls import path
 from base_app.api.routing import websocket_urlpatterns
+from base_app.api.outbox import OutboxDispatcherMiddleware
 from .middleware import JWTAuthMiddlewareStack
 
 # Initialize Django ASGI application early to ensure the AppRegistry
@@ -14,11 +15,13 @@ from .middleware import JWTAuthMiddlewareStack
 routes = URLRouter([path("ws/", URLRouter(websocket_urlpatterns))])
 
 
-application = ProtocolTypeRouter(
-    {
-        # http requests handler
-        "http": django_asgi_app,
-        # ws requests handler
-        "websocket": AllowedHostsOriginValidator(JWTAuthMiddlewareStack(routes)),
-    }
+application = OutboxDispatcherMiddleware(
+    ProtocolTypeRouter(
+        {
+            # http requests handler
+            "http": django_asgi_app,
+            # ws requests handler
+            "websocket": AllowedHostsOriginValidator(JWTAuthMiddlewareStack(routes)),
+        }
+    )
 )
@@ -3,6 +3,8 @@ from pathlib import Path
 from datetime import timedelta
 from django.core.management.utils import get_random_secret_key
 
+from corsheaders.defaults import default_headers
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,6 +57,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # this is used to publish WebSocket events of model writes
+    "base_app.api.outbox.OutboxMiddleware",
 ]
 
 ROOT_URLCONF = "wini_chat.urls"
@@ -166,7 +170,7 @@ if DEBUG:
 else:
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "base_app.redis_layer.BulkRedisChannelLayer",
             "CONFIG": {
                 "hosts": [
                     (
@@ -178,11 +182,57 @@ else:
         },
     }
 
+# Cache settings
+if DEBUG:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://%s:%s/1"
+            % (os.getenv("REDIS_HOST", "localhost"), os.getenv("REDIS_PORT", "6379")),
+        }
+    }
+
+# User presence backend settings
+if DEBUG:
+    PRESENCE = {"BACKEND": "base_app.presence.MemoryPresence"}
+else:
+    PRESENCE = {
+        "BACKEND": "base_app.presence.RedisPresence",
+        "CONFIG": {
+            "host": os.getenv("REDIS_HOST", "localhost"),
+            "port": int(os.getenv("REDIS_PORT", "6379")),
+        },
+    }
+
+# WebSocket events replay buffer settings
+if DEBUG:
+    REPLAY = {"BACKEND": "base_app.replay.MemoryReplay"}
+else:
+    REPLAY = {
+        "BACKEND": "base_app.replay.RedisReplay",
+        "CONFIG": {
+            "host": os.getenv("REDIS_HOST", "localhost"),
+            "port": int(os.getenv("REDIS_PORT", "6379")),
+        },
+    }
+
+# WebSocket session outbound queue settings.
+# Sizes count queued frames and frames not acknowledged by the client
+WS_OUTBOUND = {"high_water": 100, "limit": 1000}
+
+# Seconds to coalesce read receipts of a user chat before writing them
+READ_RECEIPTS = {"window": 0.5}
+
+# Seconds to batch presence transitions before shifting online counters
+ONLINE_COUNTERS = {"window": 1}
+
 # Rest Framework Settings
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "base_app.api.authentication.CachedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -204,6 +254,8 @@ CORS_ALLOWED_ORIGINS = [
     for origin in os.getenv("DJANGO_ORIGINS", "http://localhost:5173").split(",")
     if origin
 ]
+# allow header of the WebSocket session that made a request
+CORS_ALLOW_HEADERS = (*default_headers, "x-ws-session")
 
 
 # allowed api urls pattern
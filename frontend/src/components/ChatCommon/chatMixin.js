@@ -23,6 +23,9 @@ export default {
     // fetch properties
     reverseFetch: true,
     limit: 30,
+    // cursor links of older and newer messages
+    nextUrl: null,
+    prevUrl: null,
   }),
 
   props: {
@@ -57,6 +60,20 @@ export default {
       return this.fetchUrl;
     },
 
+    next() {
+      return this.nextUrl;
+    },
+
+    previous() {
+      return this.prevUrl;
+    },
+
+    // Hook to return ws event options to send and edit messages
+    // without files over ws
+    msgEvent() {
+      return null;
+    },
+
     isFullScroll() {
       const diff =
         this.scrollElm.scrollHeight -
@@ -99,6 +116,7 @@ export default {
 
   created() {
     this.resetMsg();
+    this.socket.onResync(this.fetchData);
   },
 
   mounted() {
@@ -117,6 +135,7 @@ export default {
   },
 
   unmounted() {
+    this.socket?.offResync(this.fetchData);
     this.scrollElm.removeEventListener("scroll", this.scrolled);
   },
 
@@ -146,6 +165,21 @@ export default {
       return context.messages;
     },
 
+    // messages are paginated with cursor links
+    toFetchUrl(url) {
+      if (!url) return null;
+      const { pathname, search } = new URL(url);
+      return `${pathname.replace(/^\/?api/, "")}${search}`;
+    },
+
+    updateNext(url) {
+      this.nextUrl = this.toFetchUrl(url);
+    },
+
+    updatePrev(url) {
+      this.prevUrl = this.toFetchUrl(url);
+    },
+
     pushMsg(msg) {
       return this.pushOrShift(msg);
     },
@@ -206,8 +240,16 @@ export default {
 
     async submitMsg(msg) {
       if (this.currProm) await this.currProm;
-      const data = this.toFormData(msg);
       try {
+        if (this.msgEvent && !msg.files.length) {
+          const { content } = msg;
+          return await this.socket.requestEvent({
+            ...this.msgEvent,
+            event: "send_msg",
+            data: { content },
+          });
+        }
+        const data = this.toFormData(msg);
         const prom = this.$session.post(this.msgUrl, data, { timeout: 36e5 });
         return (await this.$session.animate(prom, null, "xyz")).data;
       } catch (error) {
@@ -217,7 +259,6 @@ export default {
 
     async addMsg(msg, scroll = false) {
       if (this.previous) return;
-      this.next && this.nextOff++;
       msg = reactive(msg);
       const context = this.unshiftMsg(msg);
       if (scroll || this.isFullScroll) {
@@ -270,9 +311,21 @@ export default {
       return;
     },
 
-    async patchMessage(msg, data) {
+    async sendPatch(msg, data, overWS) {
+      if (overWS && this.msgEvent) {
+        return await this.socket.requestEvent({
+          ...this.msgEvent,
+          event: "update_msg",
+          msg_id: msg.id,
+          data,
+        });
+      }
+      return (await this.$session.patch(msg.url, data)).data;
+    },
+
+    async patchMessage(msg, data, overWS = false) {
       try {
-        const { data: rData } = await this.$session.patch(msg.url, data);
+        const rData = await this.sendPatch(msg, data, overWS);
         this.msgPatched(msg, data, rData);
         return rData;
       } catch (error) {
@@ -310,7 +363,7 @@ export default {
     async saveEdit() {
       const { content } = this.message;
       const data = { content, is_edited: true };
-      await this.patchMessage(this.editing, data);
+      await this.patchMessage(this.editing, data, true);
       Object.assign(this.editing, data);
       this.cancelEdit();
     },
@@ -341,9 +394,6 @@ export default {
     removeMsg(id) {
       const [context, idx] = this.findMsgIdx(id);
       if (context && idx >= 0) {
-        if (this.next && this.nextOff > 0) {
-          this.nextOff--;
-        }
         delete this.contexts[id];
         const [msg] = context.splice(idx, 1);
         if (!msg.seen && msg.owner != this.user.id) {
@@ -352,6 +402,20 @@ export default {
       }
     },
 
+    // marks own messages up to read receipt of another member as seen
+    markRead({ user_id, created }) {
+      if (user_id == this.user.id) return;
+      const readUntil = moment(created);
+      for (const contexts of this.dataList.values()) {
+        for (const { owner, messages } of contexts) {
+          if (owner.id != this.user.id) continue;
+          for (const msg of messages) {
+            if (moment(msg.created) <= readUntil) msg.seen = true;
+          }
+        }
+      }
+    },
+
     scrollBottom(options) {
       requestAnimationFrame(() =>
         this.scrollElm.scrollTo({
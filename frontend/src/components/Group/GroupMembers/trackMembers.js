@@ -12,7 +12,7 @@ export default {
 
   computed: {
     fetchUrl() {
-      return `${this.group.url}members/`;
+      return `${this.group.url}members/?capabilities=true`;
     },
 
     sortedMembers() {
@@ -5,11 +5,6 @@ export default {
       const { group } = this;
       try {
         await session.delete(`${group.url}leave/`);
-        session.socket.sendGroupEvent({
-          event: "leave",
-          group_id: group.id,
-          user_id: session.user.id,
-        });
         this.$chats.removeChat(group);
       } catch (error) {
         this.$flashes.axiosError(error);
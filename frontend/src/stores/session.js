@@ -6,6 +6,9 @@ import { defineStore } from "pinia";
 import axios from "axios";
 import { request } from "@/plugins/request.js";
 
+// WebSocket close code of sessions closed by the server for not reading frames
+const OVERFLOW_CODE = 4008;
+
 const GroupWSMixin = (Cls = Object) =>
   /**
    * Mixin to handle Group WS Events
@@ -17,6 +20,8 @@ const GroupWSMixin = (Cls = Object) =>
 
       // map of group websocket objects
       this.groupWS = new Map();
+      // ids of connected groups
+      this.groups = new Set();
       // map of general group websocket event handlers
       this.grpGenEvents = new Map();
       this.onGroupGen("role_updated", ({ group_id, role_id, data }) =>
@@ -324,6 +329,7 @@ const GroupWSMixin = (Cls = Object) =>
      */
     connectGroup(group_id, newMsgCB, updateMsgCB, deleteMsgCB) {
       this.sendGroupEvent({ event: "connect", group_id });
+      this.groups.add(group_id);
       this.onGroup(group_id, "new_msg", newMsgCB);
       this.onGroup(group_id, "edit_msg", updateMsgCB);
       this.onGroup(group_id, "del_msg", deleteMsgCB);
@@ -335,6 +341,7 @@ const GroupWSMixin = (Cls = Object) =>
      */
     disconnectGroup(group_id) {
       this.sendGroupEvent({ event: "disconnect", group_id });
+      this.groups.delete(group_id);
       this.rmGroupWS(group_id);
     }
 
@@ -364,6 +371,8 @@ const ChatWSMixin = (Cls = Object) =>
       super();
       // chat event listeners
       this.chatEvents = new Map();
+      // ids of connected chats
+      this.chats = new Set();
     }
 
     /**
@@ -388,6 +397,7 @@ const ChatWSMixin = (Cls = Object) =>
 
     connectChat(chat_id, newMsgCB, updateMsgCB, deleteMsgCB) {
       this.sendChatEvent({ event: "connect", chat_id });
+      this.chats.add(chat_id);
       this.onChat(`${chat_id}:new`, newMsgCB);
       this.onChat(`${chat_id}:update`, updateMsgCB);
       this.onChat(`${chat_id}:delete`, deleteMsgCB);
@@ -395,6 +405,7 @@ const ChatWSMixin = (Cls = Object) =>
 
     disconnectChat(chat_id) {
       this.sendChatEvent({ event: "disconnect", chat_id });
+      this.chats.delete(chat_id);
       this.removeChatEvent(`${chat_id}:new`);
       this.removeChatEvent(`${chat_id}:update`);
       this.removeChatEvent(`${chat_id}:delete`);
@@ -584,28 +595,90 @@ class SessionSocket extends UserWSMixin(ChatWSMixin(GroupWSMixin())) {
     return `${protocol}://${location.host}/django-ws/session/`;
   }
 
+  // ws route url. Reconnecting socket resumes previous server session
+  // from the last received sequence numbers of its streams
+  get url() {
+    const params = new URLSearchParams({ token: this.getToken() });
+    if (this.session) {
+      params.set("session", this.session);
+      params.set("resume_from", JSON.stringify(this.positions));
+    }
+    return `${this.endpoint}?${params}`;
+  }
+
   /**
    * Initializes SessionSocket instance.
-   * @param {String} token - User token. Used to connect to server
+   * @param {Function} getToken - Returns user token. Used to connect to server
+   * @param {Any} sessionId - Session user id
+   * @param {Function} refreshToken - Called when connection couldn't be opened
    */
-  constructor(token, sessionId) {
+  constructor(getToken, sessionId, refreshToken) {
     super();
 
-    // WebSocket object
-    this._socket = new WebSocket(`${this.endpoint}?token=${token}`);
+    this.getToken = getToken;
+    this.refreshToken = refreshToken;
     // current session user id
     this.sessionId = sessionId;
+    // map of pending event requests waiting for acknowledgement
+    this.pending = new Map();
+    this.lastRef = 0;
+    // stream and sequence number of the last received frame
+    this.lastFrame = null;
+    // timer of pending frames acknowledgement
+    this.ackTimer = null;
+    // last received sequence numbers of streams
+    this.positions = {};
+    // server session name, sent on reconnect to resume the session
+    this.session = "";
+    // ws listeners set again on every reconnected socket
+    this.wsListeners = [];
+    // listeners called when missed events can't be replayed
+    this.resyncListeners = new Set();
+    // reconnection attempts since the last opened session
+    this.retries = 0;
+    this.reconnectTimer = null;
+    this.opened = false;
+    this.closed = false;
+    this.resumed = false;
+
+    // WebSocket object
+    this._socket = new WebSocket(this.url);
     // on message call base message handler method
     this.onWS("message", (...args) => this.onMessage(...args));
+    this.onWS("open", () => (this.opened = true));
+    this.onWS("close", (data, ev) => {
+      clearTimeout(this.ackTimer);
+      this.ackTimer = null;
+      this.rejectPending();
+      this.reconnect(ev.code);
+    });
+    this.onUser("session", ({ session }) => {
+      this.session = session;
+      this.retries = 0;
+      this.resumed && this.restore();
+      this.sessionCallback?.(session);
+    });
+    this.onUser("resync", () => this.resync());
+    // server closes session it can't write to, the next session
+    // resumes from the hint or resyncs if frames were dropped
+    this.onUser("overflow", ({ session }) => (this.session = session));
   }
 
   /**
    * Base method to set ws event listeners.
+   * Listeners are set again on reconnected socket unless they are `once`
    * @param {String} type - ws event name.
    * @param {Function} callback - callback function.
    * @param {Object} options - extra options.
    */
   onWS(type, callback, options) {
+    if (!options?.once) {
+      this.wsListeners.push([type, callback, options]);
+    }
+    this.addWSListener(type, callback, options);
+  }
+
+  addWSListener(type, callback, options) {
     this._socket.addEventListener(
       type,
       (ev) => {
@@ -620,7 +693,12 @@ class SessionSocket extends UserWSMixin(ChatWSMixin(GroupWSMixin())) {
    * Base ws message event handler.
    * Calls base message event handler based on event type
    */
-  onMessage({ event_type, event, data }, wsEvent) {
+  onMessage({ event_type, event, data, stream, seq }, wsEvent) {
+    if (stream) {
+      this.positions[stream] = Math.max(this.positions[stream] || 0, seq);
+      this.ackFrame(stream, seq);
+    }
+    if (this.settleRequest(event, data)) return;
     try {
       this[`${event_type}Message`](event, data, wsEvent);
     } catch (error) {
@@ -669,10 +747,141 @@ class SessionSocket extends UserWSMixin(ChatWSMixin(GroupWSMixin())) {
     }
   }
 
+  /**
+   * Acknowledges received frames to the server.
+   * Acknowledgements are batched, server stops writing frames
+   * to the session while too many of them are unacknowledged
+   * @param {String} stream - Stream of received frame
+   * @param {Number} seq - Sequence number of received frame
+   */
+  ackFrame(stream, seq) {
+    this.lastFrame = { stream, seq };
+    if (this.ackTimer) return;
+    this.ackTimer = setTimeout(() => {
+      this.ackTimer = null;
+      this.sendEvent({ event_type: "user", event: "ack", ...this.lastFrame });
+    }, 100);
+  }
+
+  /**
+   * Reconnects closed socket with exponential backoff.
+   * Token is refreshed if connection couldn't be opened
+   * @param {Number} code - close code
+   */
+  reconnect(code) {
+    if (this.closed) return;
+    // overflowed session backs off longer to let the client catch up
+    if (code == OVERFLOW_CODE) this.retries = Math.max(this.retries, 3);
+    const delay = Math.min(1000 * 2 ** this.retries, 30000);
+    ++this.retries;
+    this.reconnectTimer = setTimeout(async () => {
+      if (!this.opened) await this.refreshToken?.();
+      if (this.closed) return;
+      this.opened = false;
+      this.resumed = true;
+      this._socket = new WebSocket(this.url);
+      for (const args of this.wsListeners) this.addWSListener(...args);
+    }, delay * (0.5 + Math.random() / 2));
+  }
+
+  /**
+   * Connects resumed session to chats, groups and users
+   * the previous session was connected to
+   */
+  restore() {
+    for (const chat_id of this.chats) {
+      this.sendChatEvent({ event: "connect", chat_id });
+    }
+    for (const group_id of this.groups) {
+      this.sendGroupEvent({ event: "connect", group_id });
+    }
+    for (const user_id of this.trackingPeople.keys()) {
+      this.sendUserEvent({ event: "watch", user_id });
+    }
+  }
+
+  /**
+   * Called when server couldn't replay missed events.
+   * Listeners should fetch their data again
+   */
+  resync() {
+    this.positions = {};
+    for (const callback of this.resyncListeners) {
+      try {
+        callback();
+      } catch (error) {
+        console.log(error);
+      }
+    }
+  }
+
+  /**
+   * Adds listener called on resync
+   * @param {Function} callback - callback function
+   */
+  onResync(callback) {
+    this.resyncListeners.add(callback);
+  }
+
+  offResync(callback) {
+    this.resyncListeners.delete(callback);
+  }
+
+  /**
+   * Sets callback called with server session name on every connection
+   * @param {Function} callback - callback function
+   */
+  onSession(callback) {
+    this.sessionCallback = callback;
+  }
+
+  /**
+   * Sends ws event that is acknowledged by the server.
+   * Returns promise that resolves with acknowledged data and
+   * rejects with errors in the form of request errors
+   * @param {Object} options - event data
+   * @return {Promise}
+   */
+  requestEvent(options) {
+    const ref = ++this.lastRef;
+    return new Promise((resolve, reject) => {
+      this.pending.set(ref, { resolve, reject });
+      this.sendEvent({ ...options, ref });
+    });
+  }
+
+  /**
+   * Settles pending event request of acknowledgement events.
+   * Returns true if event was an acknowledgement
+   */
+  settleRequest(event, data) {
+    const request = data?.ref && this.pending.get(data.ref);
+    if (!request || !(event == "ack" || event == "error")) return false;
+    this.pending.delete(data.ref);
+    if (event == "ack") {
+      request.resolve(data.data);
+    } else {
+      request.reject({ response: { data: data.errors } });
+    }
+    return true;
+  }
+
+  /**
+   * Rejects all pending event requests
+   */
+  rejectPending() {
+    for (const { reject } of this.pending.values()) {
+      reject(new Error("Connection closed."));
+    }
+    this.pending.clear();
+  }
+
   /**
    * called to close connection with server
    */
   close(code) {
+    this.closed = true;
+    clearTimeout(this.reconnectTimer);
     this._socket.close(code);
   }
 }
@@ -686,6 +895,8 @@ const defaultStates = {
   user: undefined,
   // session socket object
   socket: null,
+  // session socket id sent with requests to exclude it from their events
+  wsSession: "",
   fetching: new Map(),
 };
 
@@ -709,7 +920,10 @@ export const useSessionStore = defineStore("session", {
     tRequest(state) {
       const { defaults } = request;
       const conf = {
-        headers: { Authorization: `Bearer ${state.access}` },
+        headers: {
+          Authorization: `Bearer ${state.access}`,
+          "X-WS-Session": state.wsSession,
+        },
       };
       return axios.create({ ...defaults, ...conf });
     },
@@ -963,8 +1177,15 @@ export const useSessionStore = defineStore("session", {
      * Connects to the server using WebSocket protocol.
      */
     connectServer(callback) {
-      this.socket = markRaw(new SessionSocket(this.access, this.user.id));
-      this.socket.onWS("open", callback);
+      this.socket = markRaw(
+        new SessionSocket(
+          () => this.access,
+          this.user.id,
+          () => this.updateToken()
+        )
+      );
+      this.socket.onSession((session) => (this.wsSession = session));
+      this.socket.onWS("open", callback, { once: true });
     },
 
     /**